@@ -0,0 +1,483 @@
+import gc
+import json
+import logging
+import mmap
+import os
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from config import (
+    logger, log_pipeline, GPIO_BACKEND, ACTUATION_CPUS, ACTUATION_PRIORITY, ACTUATION_RING_SLOTS, ACTUATION_TIMEOUT
+)
+from gpio_backend import GPIOBackend, create_backend
+from instrumentation import ACTUATION_PROCESS_SECONDS
+
+# Slots: command (sequence, op, payload length) and acknowledgement (sequence, kind, time the command was
+# received and applied, payload length) headers followed by their payload. Times are perf_counter_ns(),
+# CLOCK_MONOTONIC on Linux and therefore comparable between the processes
+COMMAND = struct.Struct("<QBH")
+ACK = struct.Struct("<QBqqH")
+TAIL = struct.Struct("<Q")
+EDGE = struct.Struct("<BBd")
+SLOT_SIZE = 256
+
+# Commands: pin states as (pin, state) byte pairs, or a JSON [method, args] call of the backend
+OP_APPLY = 1
+OP_CALL = 2
+CALLS = {"setup_output", "setup_input", "read", "watch", "unwatch", "release"}
+
+# Acknowledgements, input edges are sent unsolicited with sequence 0
+ACK_OK = 0
+ACK_ERROR = 1
+ACK_EDGE = 2
+
+# Seconds the worker gets to start its interpreter and the driver
+STARTUP_TIMEOUT = 30
+
+
+class Ring:
+    """Single-producer single-consumer ring of fixed-size slots in shared memory
+
+    The producer writes one byte to a pipe (the doorbell) per slot it fills and the
+    consumer reads exactly one slot per byte it receives, so the pipe orders the
+    slot writes before the reads, also on CPUs with weak memory ordering. The
+    consumer publishes how far it got in the tail, the producer never overwrites
+    slots that weren't read.
+    """
+
+    def __init__(self, buffer, offset, slots, doorbell):
+        self.buffer = buffer
+        self.offset = offset
+        self.slots = slots
+        # Write end of the doorbell for the producer, read end for the consumer
+        self.doorbell = doorbell
+        # Slots filled by the producer, or read by the consumer
+        self.position = 0
+
+    @staticmethod
+    def size(slots):
+        return TAIL.size + slots * SLOT_SIZE
+
+    def put(self, header, fields, payload=b""):
+        """Fill the next slot and ring the doorbell, returns False when the ring is full"""
+        if header.size + len(payload) > SLOT_SIZE:
+            raise ValueError(f"payload of {len(payload)} bytes doesn't fit a slot")
+        if self.position - TAIL.unpack_from(self.buffer, self.offset)[0] >= self.slots:
+            return False
+
+        start = self._slot()
+        header.pack_into(self.buffer, start, *fields, len(payload))
+        self.buffer[start + header.size:start + header.size + len(payload)] = payload
+        self.position += 1
+        os.write(self.doorbell, b"\0")
+        return True
+
+    def wait(self):
+        """Block until the producer filled slots, returns how many (0 once it closed the doorbell)"""
+        return len(os.read(self.doorbell, self.slots))
+
+    def get(self, header):
+        """Read the next slot, returns the header fields and the payload"""
+        start = self._slot()
+        fields = header.unpack_from(self.buffer, start)
+        payload = self.buffer[start + header.size:start + header.size + fields[-1]]
+        self.position += 1
+        TAIL.pack_into(self.buffer, self.offset, self.position)
+        return fields[:-1], payload
+
+    def _slot(self):
+        return self.offset + TAIL.size + self.position % self.slots * SLOT_SIZE
+
+
+class Ack:
+    """Acknowledgement of a command, times are perf_counter_ns() of both processes"""
+
+    __slots__ = ("sent", "received", "applied", "acked", "ok", "result")
+
+    def __init__(self, sent, received, applied, acked, ok, result):
+        self.sent = sent
+        self.received = received
+        self.applied = applied
+        self.acked = acked
+        self.ok = ok
+        self.result = result
+
+
+class ActuationProcessBackend(GPIOBackend):
+    """GPIO backend running another backend in a dedicated worker process.
+
+    Pin writes leave the controller through a shared-memory command ring and are
+    applied by a small process that does nothing else: no JSON parsing, HTTP or
+    sampling competing for its GIL, garbage collection disabled, optionally pinned
+    to a CPU and scheduled SCHED_FIFO. Every command is acknowledged with the times
+    it was received and applied. Input edges come back through the acknowledgement
+    ring. The worker is restarted and its pins set up again if it dies.
+    """
+
+    name = "process"
+
+    def __init__(self, backend=GPIO_BACKEND, cpus=ACTUATION_CPUS, priority=ACTUATION_PRIORITY,
+                 slots=ACTUATION_RING_SLOTS, timeout=ACTUATION_TIMEOUT):
+        """Start the worker process
+
+        Args:
+            backend: Name of the backend run by the worker ("rpi", "gpiomem" or "sim")
+            cpus: Comma separated CPUs the worker is pinned to, empty for any
+            priority: SCHED_FIFO priority of the worker (1-99), 0 keeps the normal scheduler
+            slots: Commands that can be in flight
+            timeout: Seconds to wait for the acknowledgement of a command
+        """
+        self.backend = backend
+        self.cpus = cpus
+        self.priority = priority
+        self.slots = slots
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.closed = False
+
+        # Pins as set up, replayed when the worker is restarted. Key: pin, Value: (method, args)
+        self.pins = {}
+        # Key: pin, Value: edge callback of a watched input
+        self.watchers = {}
+
+        self.stats = {"commands": 0, "errors": 0, "restarts": 0}
+        self.worker = self._start()
+
+    def setup_output(self, pin, state):
+        self._call("setup_output", pin, bool(state))
+        self.pins[pin] = ("setup_output", (pin, bool(state)))
+
+    def setup_input(self, pin, pull_up=None):
+        self._call("setup_input", pin, pull_up)
+        self.pins[pin] = ("setup_input", (pin, pull_up))
+
+    def apply(self, states):
+        """Drive several output pins at once, returns the Ack of the worker"""
+        if not states:
+            return None
+        payload = bytearray()
+        for pin, state in states.items():
+            payload += bytes((pin, 1 if state else 0))
+        ack = self.execute(OP_APPLY, payload)
+        for pin, state in states.items():
+            self.pins[pin] = ("setup_output", (pin, bool(state)))
+        return ack
+
+    def read(self, pin):
+        return self._call("read", pin)
+
+    def watch(self, pin, callback, pull_up=None):
+        self.watchers[pin] = callback
+        self._call("watch", pin, pull_up)
+        self.pins[pin] = ("watch", (pin, pull_up))
+
+    def unwatch(self, pin):
+        self.watchers.pop(pin, None)
+        self._call("unwatch", pin)
+        method, args = self.pins.get(pin, (None, None))
+        if method == "watch":
+            self.pins[pin] = ("setup_input", args)
+
+    def release(self, pin):
+        self.pins.pop(pin, None)
+        self.watchers.pop(pin, None)
+        self._call("release", pin)
+
+    def close(self):
+        """Stop the worker, which closes the backend"""
+        with self.lock:
+            self.closed = True
+            self.worker.close()
+
+    def execute(self, op, payload):
+        """Send a command to the worker and wait for its acknowledgement, returns the Ack
+
+        Raises RuntimeError when the worker failed to apply it, TimeoutError when it wasn't
+        acknowledged within `timeout` seconds.
+        """
+        worker = self.worker
+        if not worker.alive:
+            worker = self._restart(worker)
+        ack = worker.send(op, payload, self.timeout)
+        self.stats["commands"] += 1
+        ACTUATION_PROCESS_SECONDS.observe((ack.applied - ack.sent) / 1e9)
+        if not ack.ok:
+            self.stats["errors"] += 1
+            raise RuntimeError(ack.result)
+        return ack
+
+    def _call(self, method, *args):
+        ack = self.execute(OP_CALL, json.dumps([method, args]).encode())
+        return json.loads(ack.result) if ack.result else None
+
+    def _start(self):
+        worker = _Worker(self.backend, self.cpus, self.priority, self.slots, self._on_edge)
+        try:
+            ack = worker.ready(STARTUP_TIMEOUT)
+        except Exception:
+            worker.close()
+            raise
+        if not ack.ok:
+            worker.close()
+            raise RuntimeError(f"Actuation process failed to start: {ack.result}")
+        logger.info(f"Actuation process {worker.process.pid} started in {(ack.acked - ack.sent) / 1e6:.0f} ms")
+        return worker
+
+    def _restart(self, worker):
+        """Replace a dead worker and set up its pins again"""
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("actuation process is closed")
+            if self.worker is not worker:
+                return self.worker
+
+            logger.error(f"Actuation process exited with code {worker.process.poll()}, restarting it")
+            worker.close()
+            new = self._start()
+            for method, args in list(self.pins.values()):
+                ack = new.send(OP_CALL, json.dumps([method, args]).encode(), self.timeout)
+                if not ack.ok:
+                    logger.error(f"Failed to restore GPIO {args[0]} in the actuation process: {ack.result}")
+            self.worker = new
+            self.stats["restarts"] += 1
+            return new
+
+    def _on_edge(self, pin, level, timestamp):
+        callback = self.watchers.get(pin)
+        if callback:
+            callback(pin, level, timestamp)
+
+
+class _Worker:
+    """One worker process with its rings and the threads reading its acknowledgements and log"""
+
+    def __init__(self, backend, cpus, priority, slots, on_edge):
+        self.on_edge = on_edge
+        self.sequence = 0
+        self.lock = threading.Lock()
+        # Commands waiting for their acknowledgement, sequence 0 is the start of the worker
+        # Key: sequence, Value: [threading.Event, Ack once acknowledged, perf_counter_ns() when sent]
+        self.pending = {0: [threading.Event(), None, time.perf_counter_ns()]}
+        # Free command slots, taken when sending and given back with the acknowledgement
+        self.space = threading.Semaphore(slots)
+        self.alive = True
+
+        size = 2 * Ring.size(slots)
+        memory = os.memfd_create("raspberry-iot-actuation")
+        command_read, command_write = os.pipe()
+        ack_read, ack_write = os.pipe()
+        try:
+            os.ftruncate(memory, size)
+            self.buffer = mmap.mmap(memory, size)
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), backend, str(memory), str(slots), str(command_read),
+                 str(ack_write), cpus, str(priority)],
+                pass_fds=(memory, command_read, ack_write), stdin=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+        except Exception:
+            os.close(command_write)
+            os.close(ack_read)
+            raise
+        finally:
+            os.close(memory)
+            os.close(command_read)
+            os.close(ack_write)
+
+        self.commands = Ring(self.buffer, 0, slots, command_write)
+        self.acks = Ring(self.buffer, Ring.size(slots), slots, ack_read)
+        self.ack_thread = threading.Thread(target=self._read_acks, name="actuation-acks", daemon=True)
+        self.ack_thread.start()
+        threading.Thread(target=self._read_log, name="actuation-log", daemon=True).start()
+
+    def ready(self, timeout):
+        """Wait for the worker to set up its backend, returns its Ack"""
+        event, ack, _ = self.pending[0]
+        if not event.wait(timeout):
+            raise TimeoutError(f"actuation process didn't start within {timeout} seconds")
+        return self.pending.pop(0)[1] or Ack(0, 0, 0, 0, False, "exited while starting")
+
+    def send(self, op, payload, timeout):
+        """Send a command, returns its Ack"""
+        if not self.space.acquire(timeout=timeout):
+            raise TimeoutError("actuation command ring is full")
+        entry = [threading.Event(), None, 0]
+        with self.lock:
+            if not self.alive:
+                self.space.release()
+                raise RuntimeError("actuation process is not running")
+            self.sequence += 1
+            sequence = self.sequence
+            self.pending[sequence] = entry
+            entry[2] = time.perf_counter_ns()
+            if not self.commands.put(COMMAND, (sequence, op), payload):
+                del self.pending[sequence]
+                self.space.release()
+                raise RuntimeError("actuation command ring is full")
+
+        if not entry[0].wait(timeout):
+            # The slot is given back when the late acknowledgement arrives
+            self.pending.pop(sequence, None)
+            raise TimeoutError(f"actuation command {sequence} not acknowledged within {timeout} seconds")
+        if entry[1] is None:
+            raise RuntimeError("actuation process exited")
+        return entry[1]
+
+    def close(self):
+        """Close the command doorbell, the worker closes its backend and exits"""
+        with self.lock:
+            if self.commands.doorbell is None:
+                return
+            os.close(self.commands.doorbell)
+            self.commands.doorbell = None
+            self.alive = False
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Actuation process {self.process.pid} didn't exit, killing it")
+            self.process.kill()
+            self.process.wait()
+        self.ack_thread.join(1)
+
+    def _read_acks(self):
+        try:
+            while True:
+                count = self.acks.wait()
+                if not count:
+                    break
+                for _ in range(count):
+                    (sequence, kind, received, applied), payload = self.acks.get(ACK)
+                    if kind == ACK_EDGE:
+                        pin, level, timestamp = EDGE.unpack(payload)
+                        try:
+                            self.on_edge(pin, bool(level), timestamp)
+                        except Exception as e:
+                            logger.error(f"Error handling edge of GPIO {pin}: {e}")
+                        continue
+
+                    entry = self.pending.get(sequence) if not sequence else self.pending.pop(sequence, None)
+                    if sequence:
+                        self.space.release()
+                    if entry is not None:
+                        entry[1] = Ack(entry[2], received, applied, time.perf_counter_ns(), kind == ACK_OK,
+                                       payload.decode(errors="replace"))
+                        entry[0].set()
+        except Exception as e:
+            logger.error(f"Failed to read actuation acknowledgements: {e}")
+        finally:
+            self.alive = False
+            os.close(self.acks.doorbell)
+            # Commands in flight are lost with the process
+            for event, _, _ in list(self.pending.values()):
+                event.set()
+
+    def _read_log(self):
+        """Log the records the worker writes to stderr as "<level> <message>" lines"""
+        for line in self.process.stderr:
+            level, _, message = line.decode(errors="replace").rstrip().partition(" ")
+            if level.isdigit():
+                logger.log(int(level), "Actuation process: %s", message)
+            else:
+                logger.error("Actuation process: %s", line.decode(errors="replace").rstrip())
+        self.process.stderr.close()
+
+
+def serve(backend, memory, slots, command_fd, ack_fd, cpus="", priority=0):
+    """Worker main: apply the commands of the ring until the controller closes it"""
+    # Records go to the controller through stderr, it owns the log file
+    log_pipeline.stop()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelno)d %(message)s"))
+    logging.getLogger().handlers = [handler]
+    # Stopped by the controller closing the ring, not by the signals meant for the controller
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    size = 2 * Ring.size(slots)
+    buffer = mmap.mmap(memory, size)
+    os.close(memory)
+    commands = Ring(buffer, 0, slots, command_fd)
+    acks = Ring(buffer, Ring.size(slots), slots, ack_fd)
+    ack_lock = threading.Lock()
+
+    def ack(sequence, kind, received=0, payload=b""):
+        # Also called by the driver threads reporting edges
+        deadline = time.monotonic() + 1
+        with ack_lock:
+            while not acks.put(ACK, (sequence, kind, received, time.perf_counter_ns()), payload):
+                if time.monotonic() > deadline:
+                    logger.error(f"Acknowledgement ring full, dropped acknowledgement of command {sequence}")
+                    return
+                time.sleep(0.001)
+
+    def on_edge(pin, level, timestamp):
+        ack(0, ACK_EDGE, payload=EDGE.pack(pin, level, timestamp))
+
+    _isolate(cpus, priority)
+    try:
+        gpio = create_backend(backend, isolated=False)
+    except Exception as e:
+        ack(0, ACK_ERROR, payload=_error(e))
+        return 1
+
+    # Everything the loop needs exists now, garbage collections would only add pauses
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+    ack(0, ACK_OK)
+
+    try:
+        while True:
+            count = commands.wait()
+            if not count:
+                break
+            for _ in range(count):
+                (sequence, op), payload = commands.get(COMMAND)
+                received = time.perf_counter_ns()
+                try:
+                    if op == OP_APPLY:
+                        gpio.apply({payload[index]: bool(payload[index + 1]) for index in range(0, len(payload), 2)})
+                        ack(sequence, ACK_OK, received)
+                        continue
+
+                    method, args = json.loads(payload)
+                    if method not in CALLS:
+                        raise ValueError(f"unknown call {method!r}")
+                    if method == "watch":
+                        args = [args[0], on_edge, args[1]]
+                    result = getattr(gpio, method)(*args)
+                    ack(sequence, ACK_OK, received, b"" if result is None else json.dumps(result).encode())
+                except Exception as e:
+                    ack(sequence, ACK_ERROR, received, _error(e))
+    finally:
+        gpio.close()
+    return 0
+
+
+def _isolate(cpus, priority):
+    """Pin the worker to `cpus` and switch it to SCHED_FIFO, threads started later inherit both"""
+    if cpus:
+        try:
+            os.sched_setaffinity(0, {int(cpu) for cpu in cpus.split(",")})
+            logger.info(f"Pinned to CPU {cpus}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to pin to CPU {cpus}: {e}")
+    if priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            logger.info(f"Scheduled SCHED_FIFO with priority {priority}")
+        except OSError as e:
+            logger.warning(f"Failed to set SCHED_FIFO priority {priority} (needs root or CAP_SYS_NICE): {e}")
+
+
+def _error(e):
+    return str(e).encode()[:SLOT_SIZE - ACK.size]
+
+
+if __name__ == "__main__":
+    name, memory_fd, slot_count, commands_fd, acks_fd, cpu_list, fifo_priority = sys.argv[1:]
+    sys.exit(serve(name, int(memory_fd), int(slot_count), int(commands_fd), int(acks_fd), cpu_list,
+                   int(fifo_priority)))
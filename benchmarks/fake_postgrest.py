@@ -0,0 +1,210 @@
+import gzip
+import json
+import socket
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+# PostgREST filter operators understood by the stand-in
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+    "in": lambda a, b: a in [item.strip('"') for item in b.strip("()").split(",")],
+}
+
+
+class FakePostgREST:
+    """In-memory stand-in for the Supabase REST endpoint (/rest/v1).
+
+    Supports the subset of PostgREST used by the controller: select with column
+    projection and simple filters, PATCH with filters, upsert (POST with
+    on_conflict, bulk bodies rejected unless every object has the same keys like
+    PostgREST does) and RPC calls. Every request is counted per method and table.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        """Initialize the server
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, a free one if 0
+            latency: Seconds every request is delayed, to mimic a remote endpoint
+        """
+        self.latency = latency
+        self.lock = threading.Lock()
+
+        # Key: table name, Value: dict of id -> row
+        self.tables = {"devices": {}, "control_units": {}}
+        # Key: "METHOD table", Value: number of requests
+        self.requests = Counter()
+        self.bytes_received = 0
+        # Optional callback(event, table, row) called for every written row, e.g. to feed a realtime stand-in
+        self.on_change = None
+
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-postgrest", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def seed(self, table, rows):
+        """Replace the rows of a table"""
+        with self.lock:
+            self.tables[table] = {row["id"]: dict(row) for row in rows}
+
+    def update_rows(self, table, changes):
+        """Change rows in place, `changes` maps id -> fields"""
+        with self.lock:
+            for row_id, fields in changes.items():
+                self.tables[table][row_id].update(fields)
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+            self.bytes_received = 0
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def handle(self, method, path, query, body):
+        """Apply a request to the in-memory tables, returns (status, response rows)"""
+        changes = []
+        status, payload = self._apply(method, path, query, body, changes)
+        if self.on_change:
+            for event, table, row in changes:
+                self.on_change(event, table, row)
+        return status, payload
+
+    def _apply(self, method, path, query, body, changes):
+        parts = [part for part in path.split("/") if part]
+        if parts[:2] != ["rest", "v1"] or len(parts) < 3:
+            return 404, {"message": f"Unknown path {path}"}
+
+        with self.lock:
+            if parts[2] == "rpc":
+                self.requests[f"{method} rpc/{parts[3]}"] += 1
+                return 200, []
+
+            table_name = parts[2]
+            self.requests[f"{method} {table_name}"] += 1
+            table = self.tables.setdefault(table_name, {})
+
+            params = dict(parse_qsl(query, keep_blank_values=True))
+            columns = params.pop("select", "*")
+            on_conflict = params.pop("on_conflict", "id")
+            filters = [(column, *value.split(".", 1)) for column, value in params.items() if "." in value]
+            matching = [row for row in table.values() if self._matches(row, filters)]
+
+            if method == "GET":
+                return 200, [self._project(row, columns) for row in matching]
+
+            if method == "PATCH":
+                for row in matching:
+                    row.update(body)
+                    changes.append(("UPDATE", table_name, dict(row)))
+                return 200, [dict(row) for row in matching]
+
+            if method == "POST":
+                rows = body if isinstance(body, list) else [body]
+                if len({frozenset(row) for row in rows}) > 1:
+                    return 400, {"code": "PGRST102", "message": "All object keys must match"}
+                for row in rows:
+                    key = tuple(row.get(column) for column in on_conflict.split(",")) if "," in on_conflict \
+                        else row.get(on_conflict)
+                    event = "UPDATE" if key in table else "INSERT"
+                    table.setdefault(key, {}).update(row)
+                    changes.append((event, table_name, dict(table[key])))
+                return 201, rows
+
+            if method == "DELETE":
+                for row in matching:
+                    del table[row["id"]]
+                    changes.append(("DELETE", table_name, row))
+                return 200, matching
+
+        return 405, {"message": f"Unsupported method {method}"}
+
+    @staticmethod
+    def _matches(row, filters):
+        for column, operator, value in filters:
+            compare = OPERATORS.get(operator)
+            if compare is None:
+                continue
+            field = row.get(column)
+            if field is None or not compare(str(field), value):
+                return False
+        return True
+
+    @staticmethod
+    def _project(row, columns):
+        if columns == "*":
+            return dict(row)
+        return {column: row.get(column) for column in columns.split(",")}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Write responses in as few segments as possible and never wait for the client's delayed ACK
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def handle_one_request(self):
+                # Clients send request headers and body separately, acknowledge right away so the body isn't
+                # held back by Nagle until our delayed ACK fires (Linux only)
+                if hasattr(socket, "TCP_QUICKACK"):
+                    self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+                super().handle_one_request()
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                fake.bytes_received += len(raw)
+                if self.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                body = json.loads(raw) if raw else None
+
+                if fake.latency:
+                    threading.Event().wait(fake.latency)
+
+                url = urlsplit(self.path)
+                status, payload = fake.handle(self.command, url.path, url.query, body)
+                if status < 400 and "return=minimal" in (self.headers.get("Prefer") or ""):
+                    status, payload = 204, None
+                data = json.dumps(payload).encode() if payload is not None else b""
+
+                self.send_response(status)
+                if data:
+                    self.send_header("Content-Type", "application/json")
+                    if len(data) >= 1024 and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                        data = gzip.compress(data, compresslevel=5)
+                        self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
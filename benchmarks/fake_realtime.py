@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+
+import websockets
+
+
+class FakeRealtime:
+    """Local Supabase Realtime stand-in speaking the Phoenix protocol.
+
+    Answers phx_join and heartbeats with phx_reply and pushes postgres change
+    events (INSERT/UPDATE/DELETE) to every socket joined to a topic.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.server = None
+
+        # Key: topic, Value: set of joined sockets
+        self.subscribers = {}
+        self.stats = {"connections": 0, "joins": 0, "heartbeats": 0, "pushed": 0}
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/realtime/v1/websocket"
+
+    async def start(self):
+        self.server = await websockets.serve(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def wait_for_join(self, topic, timeout=10.0):
+        """Wait until a socket joined the topic"""
+        deadline = time.monotonic() + timeout
+        while not self.subscribers.get(topic):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Nobody joined {topic} within {timeout} seconds")
+            await asyncio.sleep(0.01)
+
+    async def push(self, topic, event, record):
+        """Send a postgres change event to the subscribers of a topic, returns the send time"""
+        key = "old_record" if event == "DELETE" else "record"
+        message = json.dumps({"topic": topic, "event": event, "payload": {key: record}, "ref": None})
+        sent_at = time.perf_counter()
+        for ws in list(self.subscribers.get(topic, ())):
+            await ws.send(message)
+            self.stats["pushed"] += 1
+        return sent_at
+
+    async def _handle(self, ws):
+        self.stats["connections"] += 1
+        try:
+            async for message in ws:
+                data = json.loads(message)
+                event = data.get("event")
+
+                if event == "phx_join":
+                    self.stats["joins"] += 1
+                    self.subscribers.setdefault(data["topic"], set()).add(ws)
+                elif event == "heartbeat":
+                    self.stats["heartbeats"] += 1
+                elif event == "phx_leave":
+                    self.subscribers.get(data["topic"], set()).discard(ws)
+                else:
+                    continue
+
+                await ws.send(json.dumps({
+                    "topic": data["topic"],
+                    "event": "phx_reply",
+                    "payload": {"status": "ok", "response": {}},
+                    "ref": data.get("ref"),
+                }))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for sockets in self.subscribers.values():
+                sockets.discard(ws)
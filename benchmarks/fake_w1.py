@@ -0,0 +1,39 @@
+import os
+import random
+
+
+def make_w1_tree(root, count, bulk_read=True, seed=0):
+    """Create a stand-in for /sys/bus/w1/devices with `count` DS18B20 probes
+
+    Every probe gets both the legacy w1_slave file and the newer temperature file.
+    With `bulk_read` a bus master supporting therm_bulk_read is added as well.
+    Returns the sensor ids.
+    """
+    rng = random.Random(seed)
+    sensor_ids = []
+
+    for index in range(count):
+        sensor_id = f"28-{index:012x}"
+        path = os.path.join(root, sensor_id)
+        os.makedirs(path, exist_ok=True)
+        write_temperature(root, sensor_id, round(rng.uniform(18.0, 26.0), 3))
+        sensor_ids.append(sensor_id)
+
+    if bulk_read:
+        master = os.path.join(root, "w1_bus_master1")
+        os.makedirs(master, exist_ok=True)
+        with open(os.path.join(master, "therm_bulk_read"), "w") as f:
+            f.write("0\n")
+
+    return sensor_ids
+
+
+def write_temperature(root, sensor_id, temperature):
+    """Set the reading of a probe in the stand-in tree"""
+    millidegrees = int(round(temperature * 1000))
+    path = os.path.join(root, sensor_id)
+
+    with open(os.path.join(path, "w1_slave"), "w") as f:
+        f.write(f"72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t={millidegrees}\n")
+    with open(os.path.join(path, "temperature"), "w") as f:
+        f.write(f"{millidegrees}\n")
@@ -0,0 +1,491 @@
+"""Simulate a fleet of controllers against a Supabase project or the local stand-ins.
+
+Every virtual controller runs as a few asyncio tasks in this process and produces
+the traffic of a real one: start-up (system info, online status, full device
+sync), the realtime subscription with Phoenix heartbeats, periodic metrics and
+sensor writes flushed by the telemetry queue, and incremental device resyncs.
+Start times are staggered over --ramp seconds and every interval is jittered.
+Meanwhile a commander switches random devices through PostgREST and times how
+long the change takes to reach the controller over realtime, and devices are
+created and deleted to churn the fleet.
+
+    python -m benchmarks.fleet --local --controllers 1000 --duration 300 --time-scale 10
+    SUPABASE_URL=... SUPABASE_KEY=... python -m benchmarks.fleet --controllers 200 --seed
+
+Against a real project, --seed writes the control units and devices of the fleet
+first (ids start with --prefix). Results are written as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import time
+from collections import defaultdict
+from datetime import datetime, UTC
+
+import httpx
+import websockets
+
+from benchmarks.fake_postgrest import FakePostgREST
+from benchmarks.fake_realtime import FakeRealtime
+from benchmarks.run import STEADY_STATE_INTERVALS, percentile, summarize, git_revision
+
+DEVICE_COLUMNS = "id,name,type,subtype,unit,gpio_pin,is_active,value,controller_id,updated_at"
+
+
+class FleetStats:
+    """Request counts, errors and latencies per operation, shared by the whole fleet"""
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.realtime = defaultdict(int)
+        self.commands = defaultdict(int)
+        self.command_latencies = []
+        self.churn = defaultdict(int)
+
+    def report(self, elapsed):
+        operations = {}
+        for operation in sorted(self.requests):
+            count = self.requests[operation]
+            operations[operation] = {
+                "count": count,
+                "per_second": round(count / elapsed, 3),
+                "errors": self.errors[operation],
+                "error_rate": round(self.errors[operation] / count, 4) if count else 0.0,
+                "latency_ms": summarize(self.latencies[operation]),
+            }
+
+        total = sum(self.requests.values())
+        latencies = self.command_latencies
+        commands = dict(self.commands, latency_ms=summarize(latencies))
+        if latencies:
+            commands["latency_ms"]["p90"] = round(percentile(latencies, 0.90) * 1000, 3)
+
+        return {
+            "requests": operations,
+            "total": {
+                "requests": total,
+                "requests_per_second": round(total / elapsed, 3),
+                "errors": sum(self.errors.values()),
+                "error_rate": round(sum(self.errors.values()) / total, 4) if total else 0.0,
+            },
+            "realtime": dict(self.realtime),
+            "commands": commands,
+            "churn": dict(self.churn),
+        }
+
+
+class VirtualController:
+    """Traffic of one RaspberryPiController, with simulated pins and sensors"""
+
+    def __init__(self, fleet, unit_id, devices):
+        self.fleet = fleet
+        self.unit_id = unit_id
+        self.topic = f"realtime:public:devices:controller_id=eq.{unit_id}"
+
+        # Key: device id, Value: pin state (switches) or last temperature (sensors)
+        self.pins = {row["id"]: bool(row.get("is_active")) for row in devices if row["type"] == "switch"}
+        self.sensors = {row["id"]: 21.0 for row in devices if row["type"] == "temperature"}
+        self.pending_rows = {}
+        self.pending_heartbeat = None
+        self.watermark = None
+        self.ref = 0
+
+    async def run(self):
+        fleet = self.fleet
+        await asyncio.sleep(random.uniform(0, fleet.args.ramp))
+
+        await self.connect()
+        await asyncio.gather(
+            self.listen(),
+            fleet.every("KEEP_ALIVE_INTERVAL", self.keep_alive),
+            fleet.every("SENSOR_SAMPLE_INTERVAL", self.sample_sensors),
+            fleet.every("TELEMETRY_FLUSH_INTERVAL", self.flush_telemetry),
+            fleet.every("DEVICE_SYNC_INTERVAL", self.sync_devices),
+        )
+
+    async def connect(self):
+        """Start-up requests: system info, online status and the first full sync"""
+        unit_filter = [("id", f"eq.{self.unit_id}")]
+        await self.fleet.request("system_info", "PATCH", "control_units", unit_filter, {
+            "ip_address": "10.0.0.1", "mac_address": "b8:27:eb:00:00:00", "firmware": "6.6", "model": "aarch64",
+        })
+        await self.fleet.request("online", "PATCH", "control_units", unit_filter, {
+            "is_online": True, "last_seen": _now(), "cpu_usage": 0, "memory_usage": 0, "storage_usage": 0,
+        })
+        await self.sync_devices(full=True)
+
+    async def listen(self):
+        """Realtime subscription with Phoenix heartbeats, reconnecting with backoff"""
+        fleet = self.fleet
+        url = f"{fleet.realtime_url}?apikey={fleet.key}&vsn=1.0.0"
+        attempt = 0
+        while True:
+            try:
+                async with websockets.connect(url, ping_interval=None, open_timeout=30) as ws:
+                    fleet.stats.realtime["connects"] += 1
+                    await ws.send(json.dumps({"topic": self.topic, "event": "phx_join", "payload": {},
+                                              "ref": self._next_ref()}))
+                    heartbeat = asyncio.create_task(self._heartbeats(ws))
+                    try:
+                        attempt = 0
+                        async for message in ws:
+                            self._on_message(message)
+                    finally:
+                        heartbeat.cancel()
+                fleet.stats.realtime["closed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                fleet.stats.realtime["connect_errors"] += 1
+
+            attempt += 1
+            await asyncio.sleep(random.uniform(1, min(60, 2 ** attempt)))
+
+    async def keep_alive(self):
+        self.pending_heartbeat = {
+            "cpu_usage": random.randint(2, 30), "memory_usage": random.randint(20, 60), "storage_usage": 40,
+            "is_online": True, "last_seen": _now(),
+        }
+
+    async def sample_sensors(self):
+        """Sensor sweep, only changed readings are queued (the reporting policy drops the others)"""
+        for device_id, value in self.sensors.items():
+            if random.random() < self.fleet.args.sensor_change_rate:
+                value = round(value + random.uniform(-0.5, 0.5), 1)
+                self.sensors[device_id] = value
+                self.pending_rows[device_id] = {"id": device_id, "value": value, "unit": "°C",
+                                                "last_updated": _now()}
+
+    async def flush_telemetry(self):
+        """Write the queued sensor rows (a PATCH per device, or one bulk upsert) and one control unit update"""
+        if self.pending_rows:
+            rows, self.pending_rows = list(self.pending_rows.values()), {}
+            if self.fleet.args.bulk_upsert:
+                await self.fleet.request("telemetry_upsert", "POST", "devices", [("on_conflict", "id")], rows,
+                                         prefer="resolution=merge-duplicates,return=minimal")
+            else:
+                # Sensor values differ, so every device is its own request like in the controller
+                await asyncio.gather(*(
+                    self.fleet.request("telemetry_patch", "PATCH", "devices", [("id", f"eq.{row['id']}")],
+                                       {key: value for key, value in row.items() if key != "id"})
+                    for row in rows
+                ))
+        if self.pending_heartbeat:
+            heartbeat, self.pending_heartbeat = self.pending_heartbeat, None
+            await self.fleet.request("heartbeat", "PATCH", "control_units", [("id", f"eq.{self.unit_id}")],
+                                     heartbeat)
+
+    async def sync_devices(self, full=False):
+        """Incremental resync: rows changed since the watermark plus the tombstone check"""
+        filters = [("select", DEVICE_COLUMNS), ("controller_id", f"eq.{self.unit_id}")]
+        if self.watermark and not full:
+            filters.append(("updated_at", f"gte.{self.watermark}"))
+        rows = await self.fleet.request("sync_full" if full else "sync_changed", "GET", "devices", filters)
+        for row in rows or ():
+            changed_at = row.get("updated_at")
+            if changed_at and (self.watermark is None or changed_at > self.watermark):
+                self.watermark = changed_at
+        if not full:
+            await self.fleet.request("sync_ids", "GET", "devices",
+                                     [("select", "id"), ("controller_id", f"eq.{self.unit_id}")])
+
+    async def _heartbeats(self, ws):
+        while True:
+            await asyncio.sleep(self.fleet.interval("REALTIME_HEARTBEAT_INTERVAL"))
+            await ws.send(json.dumps({"topic": "phoenix", "event": "heartbeat", "payload": {},
+                                      "ref": self._next_ref()}))
+            self.fleet.stats.realtime["heartbeats"] += 1
+
+    def _on_message(self, message):
+        received_at = time.perf_counter()
+        data = json.loads(message)
+        event = data.get("event")
+        payload = data.get("payload", {})
+        stats = self.fleet.stats.realtime
+
+        if event == "phx_reply":
+            if data.get("topic") == self.topic:
+                stats["joins" if payload.get("status") == "ok" else "join_errors"] += 1
+            return
+        if event not in ("INSERT", "UPDATE", "DELETE"):
+            return
+
+        stats["events"] += 1
+        record = payload.get("old_record" if event == "DELETE" else "record") or {}
+        device_id = record.get("id")
+        if event == "DELETE":
+            self.pins.pop(device_id, None)
+            self.sensors.pop(device_id, None)
+        elif record.get("type") == "switch":
+            self.pins[device_id] = bool(record.get("is_active"))
+            self.fleet.command_applied(device_id, self.pins[device_id], received_at)
+
+    def _next_ref(self):
+        self.ref += 1
+        return str(self.ref)
+
+
+class Fleet:
+    """Runs the virtual controllers, the commander and the churn against one endpoint"""
+
+    def __init__(self, args, rest_url, key, realtime_url):
+        self.args = args
+        self.key = key
+        self.realtime_url = realtime_url
+        self.stats = FleetStats()
+        self.client = httpx.AsyncClient(
+            base_url=f"{rest_url.rstrip('/')}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}", "Accept": "application/json"},
+            timeout=httpx.Timeout(args.timeout),
+            limits=httpx.Limits(max_connections=args.http_connections,
+                                max_keepalive_connections=args.http_connections),
+        )
+        self.controllers = []
+        # Key: (device id, state), Value: perf_counter() time the command was sent
+        self.waiting = {}
+
+    def interval(self, name):
+        """Controller interval shortened by --time-scale and jittered by --jitter"""
+        jitter = self.args.jitter
+        return STEADY_STATE_INTERVALS.get(name, 25) / self.args.time_scale * random.uniform(1 - jitter, 1 + jitter)
+
+    async def every(self, name, func):
+        while True:
+            await asyncio.sleep(self.interval(name))
+            await func()
+
+    async def request(self, operation, method, table, params=(), body=None, prefer="return=minimal"):
+        """Send one PostgREST request, returns the decoded rows or None"""
+        self.stats.requests[operation] += 1
+        headers = {"Prefer": prefer} if method != "GET" else {}
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, table, params=list(params), json=body, headers=headers)
+            self.stats.latencies[operation].append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                self.stats.errors[operation] += 1
+                return None
+            return response.json() if response.content else None
+        except httpx.HTTPError:
+            self.stats.errors[operation] += 1
+            return None
+
+    def command_applied(self, device_id, state, received_at):
+        future = self.waiting.pop((device_id, state), None)
+        if future is not None and not future.done():
+            future.set_result(received_at)
+
+    async def commander(self):
+        """Switch random devices at --command-rate per second and time them until they reach the controller"""
+        loop = asyncio.get_running_loop()
+        commands = self.stats.commands
+        pending = set()
+        while True:
+            await asyncio.sleep(random.expovariate(self.args.command_rate))
+            controller = random.choice(self.controllers)
+            if not controller.pins:
+                continue
+            device_id = random.choice(list(controller.pins))
+            state = not controller.pins[device_id]
+            if (device_id, state) in self.waiting:
+                continue
+
+            future = loop.create_future()
+            self.waiting[(device_id, state)] = future
+            task = asyncio.create_task(self._command(device_id, state, future))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            commands["sent"] += 1
+
+    async def churn(self):
+        """Create and delete devices at --churn-rate per second"""
+        while True:
+            await asyncio.sleep(random.expovariate(self.args.churn_rate))
+            controller = random.choice(self.controllers)
+            if controller.pins and random.random() < 0.5:
+                device_id = random.choice(list(controller.pins))
+                await self.request("churn_delete", "DELETE", "devices", [("id", f"eq.{device_id}")])
+                self.stats.churn["deleted"] += 1
+            else:
+                row = _device(controller.unit_id, f"churn{random.getrandbits(32):08x}", "switch", 100)
+                await self.request("churn_insert", "POST", "devices", [("on_conflict", "id")], [row],
+                                   prefer="resolution=merge-duplicates,return=minimal")
+                self.stats.churn["created"] += 1
+
+    async def seed(self, rows_by_unit):
+        """Write the control units and devices of the fleet in chunks"""
+        units = [{"id": unit_id, "name": unit_id, "is_online": False} for unit_id in rows_by_unit]
+        devices = [row for rows in rows_by_unit.values() for row in rows]
+        for table, rows in (("control_units", units), ("devices", devices)):
+            for start in range(0, len(rows), 500):
+                await self.request(f"seed_{table}", "POST", table, [("on_conflict", "id")], rows[start:start + 500],
+                                   prefer="resolution=merge-duplicates,return=minimal")
+
+    async def run(self, rows_by_unit):
+        self.controllers = [VirtualController(self, unit_id, rows) for unit_id, rows in rows_by_unit.items()]
+        tasks = [asyncio.create_task(controller.run()) for controller in self.controllers]
+        # Commands and churn start once the fleet is (mostly) up
+        await asyncio.sleep(self.args.ramp)
+        if self.args.command_rate > 0:
+            tasks.append(asyncio.create_task(self.commander()))
+        if self.args.churn_rate > 0:
+            tasks.append(asyncio.create_task(self.churn()))
+
+        # Start-up traffic is not part of the measurement
+        self.stats = FleetStats()
+        started = time.monotonic()
+        await asyncio.sleep(self.args.duration)
+        elapsed = time.monotonic() - started
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.aclose()
+        return elapsed
+
+    async def _command(self, device_id, state, future):
+        sent_at = time.perf_counter()
+        await self.request("command", "PATCH", "devices", [("id", f"eq.{device_id}")],
+                           {"is_active": state, "updated_at": _now()})
+        try:
+            received_at = await asyncio.wait_for(future, self.args.command_timeout)
+        except asyncio.TimeoutError:
+            self.waiting.pop((device_id, state), None)
+            self.stats.commands["timeouts"] += 1
+            return
+        self.stats.commands["applied"] += 1
+        self.stats.command_latencies.append(received_at - sent_at)
+
+
+def make_fleet(count, devices, prefix):
+    """Device rows of every virtual controller: two DS18B20 probes, switches for the rest"""
+    rows_by_unit = {}
+    for index in range(count):
+        unit_id = f"{prefix}{index:05d}"
+        rows = [_device(unit_id, f"t{number}", "temperature", 4) for number in range(min(2, devices))]
+        rows += [_device(unit_id, f"sw{number}", "switch", 5 + number) for number in range(devices - len(rows))]
+        rows_by_unit[unit_id] = rows
+    return rows_by_unit
+
+
+def _device(unit_id, suffix, device_type, gpio_pin):
+    row = {"id": f"{unit_id}-{suffix}", "controller_id": unit_id, "name": suffix, "type": device_type,
+           "gpio_pin": gpio_pin, "is_active": False, "value": None, "updated_at": _now()}
+    if device_type == "temperature":
+        row.update(subtype="DS18B20", unit="°C")
+    return row
+
+
+def _now():
+    return datetime.now(UTC).isoformat()
+
+
+def _raise_file_limit():
+    """Every controller holds a websocket (two sockets with the local stand-in)"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def run(args):
+    rows_by_unit = make_fleet(args.controllers, args.devices, args.prefix)
+    postgrest = realtime = None
+
+    if args.local:
+        postgrest = FakePostgREST(latency=args.http_latency / 1000).start()
+        realtime = await FakeRealtime().start()
+        rest_url, key, realtime_url = postgrest.url, "fleet.fleet.fleet", realtime.url
+        postgrest.seed("devices", [row for rows in rows_by_unit.values() for row in rows])
+        postgrest.seed("control_units", [{"id": unit_id} for unit_id in rows_by_unit])
+
+        # Written device rows reach the controllers over realtime, as with Supabase
+        loop = asyncio.get_running_loop()
+
+        def on_change(event, table, row):
+            if table == "devices" and row.get("controller_id"):
+                topic = f"realtime:public:devices:controller_id=eq.{row['controller_id']}"
+                loop.call_soon_threadsafe(asyncio.ensure_future, realtime.push(topic, event, row))
+
+        postgrest.on_change = on_change
+    else:
+        rest_url, key = os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]
+        realtime_url = os.environ.get("SUPABASE_REALTIME_URL") or rest_url.replace(
+            "https://", "wss://").replace(".supabase.co", ".supabase.co/realtime/v1/websocket")
+
+    fleet = Fleet(args, rest_url, key, realtime_url)
+    try:
+        if args.seed and not args.local:
+            await fleet.seed(rows_by_unit)
+        elapsed = await fleet.run(rows_by_unit)
+    finally:
+        if realtime:
+            await realtime.stop()
+        if postgrest:
+            postgrest.stop()
+
+    result = {
+        "meta": {
+            "timestamp": _now(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "endpoint": "local" if args.local else rest_url,
+            "args": vars(args),
+        },
+        "controllers": args.controllers,
+        "devices": sum(len(rows) for rows in rows_by_unit.values()),
+        "duration_s": round(elapsed, 1),
+        # Rates of the simulated fleet; with --time-scale every interval is shortened, divide to get real rates
+        **fleet.stats.report(elapsed),
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--controllers", type=int, default=100, help="virtual controllers")
+    parser.add_argument("--devices", type=int, default=8, help="devices per controller (two of them sensors)")
+    parser.add_argument("--duration", type=float, default=120, help="seconds measured after the ramp")
+    parser.add_argument("--ramp", type=float, default=30, help="seconds over which the controllers start")
+    parser.add_argument("--time-scale", type=float, default=1, help="factor the controller intervals are shortened by")
+    parser.add_argument("--jitter", type=float, default=0.1, help="relative random deviation of every interval")
+    parser.add_argument("--sensor-change-rate", type=float, default=0.3,
+                        help="probability a sensor reading changed enough to be reported")
+    parser.add_argument("--bulk-upsert", action="store_true",
+                        help="write sensor rows with one bulk upsert per flush (TELEMETRY_BULK_UPSERT)")
+    parser.add_argument("--command-rate", type=float, default=5, help="device commands per second over the fleet")
+    parser.add_argument("--command-timeout", type=float, default=10, help="seconds until a command counts as lost")
+    parser.add_argument("--churn-rate", type=float, default=0.2, help="devices created or deleted per second")
+    parser.add_argument("--http-connections", type=int, default=100, help="HTTP connections shared by the fleet")
+    parser.add_argument("--timeout", type=float, default=10, help="HTTP timeout in seconds")
+    parser.add_argument("--local", action="store_true", help="run against in-process PostgREST and Realtime stand-ins")
+    parser.add_argument("--http-latency", type=float, default=0, help="milliseconds added by the local stand-in")
+    parser.add_argument("--seed", action="store_true", help="create the fleet's control units and devices first")
+    parser.add_argument("--prefix", default="fleet-", help="prefix of the virtual control unit ids")
+    parser.add_argument("--output", default="fleet-results.json", help="JSON file receiving the results")
+    args = parser.parse_args()
+
+    _raise_file_limit()
+    output = os.path.abspath(args.output)
+    result = asyncio.run(run(args))
+
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    total, commands = result["total"], result["commands"]
+    print(f"{args.controllers} controllers: {total['requests_per_second']} requests/s, "
+          f"error rate {total['error_rate']:.2%}")
+    if commands.get("latency_ms", {}).get("count"):
+        latency = commands["latency_ms"]
+        print(f"commands: {commands.get('applied', 0)} applied, {commands.get('timeouts', 0)} lost, "
+              f"latency p50 {latency['p50']:.1f} ms, p90 {latency['p90']:.1f} ms, p99 {latency['p99']:.1f} ms")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,923 @@
+"""Benchmark the controller on a plain Linux machine.
+
+Supabase is replaced by local stand-ins (PostgREST over HTTP, Realtime over a
+Phoenix websocket), the 1-Wire bus by a generated sysfs tree and the pins by the
+simulated GPIO backend. Run from the repository root:
+
+    python -m benchmarks.run --output results.json
+
+Results are written as JSON so runs can be compared to track regressions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, UTC
+
+import psutil
+
+from benchmarks.fake_postgrest import FakePostgREST
+from benchmarks.fake_realtime import FakeRealtime
+from benchmarks.fake_w1 import make_w1_tree, write_temperature
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTROL_UNIT_ID = "bench-unit"
+# The Supabase client only accepts keys shaped like a JWT
+FAKE_KEY = "bench.bench.bench"
+
+# Intervals of the steady-state run, divided by --time-scale
+STEADY_STATE_INTERVALS = {
+    "DEVICE_SYNC_INTERVAL": 300,
+    "SENSOR_SAMPLE_INTERVAL": 90,
+    "KEEP_ALIVE_INTERVAL": 60,
+    "TELEMETRY_FLUSH_INTERVAL": 10,
+    "METRICS_SAMPLE_INTERVAL": 1,
+    "REALTIME_HEARTBEAT_INTERVAL": 25,
+    "OUTBOX_SYNC_INTERVAL": 30,
+    "METRICS_MAX_INTERVAL": 300,
+    "REPORT_MAX_INTERVAL": 900,
+}
+# Intervals parsed as integers by config.py
+INTEGER_INTERVALS = {"DEVICE_SYNC_INTERVAL", "SENSOR_SAMPLE_INTERVAL", "KEEP_ALIVE_INTERVAL"}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values, scale=1000.0):
+    """p50/p99/max/mean of a list of seconds, in milliseconds by default"""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 0.50) * scale, 3),
+        "p99": round(percentile(values, 0.99) * scale, 3),
+        "max": round(max(values) * scale, 3),
+        "mean": round(sum(values) / len(values) * scale, 3),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_devices(count, sensor_ids=(), now=None):
+    """Device rows of the control unit: one DS18B20 per sensor id, switches on distinct pins for the rest"""
+    now = now or datetime.now(UTC)
+    rows = []
+    for index, sensor_id in enumerate(sensor_ids):
+        rows.append({
+            "id": f"sensor-{index:05d}", "controller_id": CONTROL_UNIT_ID, "name": f"Sensor {index}",
+            "type": "temperature", "subtype": "DS18B20", "unit": "°C", "gpio_pin": 4, "sensor_id": sensor_id,
+            "is_active": False, "value": None,
+        })
+    for index in range(count - len(rows)):
+        rows.append({
+            "id": f"switch-{index:05d}", "controller_id": CONTROL_UNIT_ID, "name": f"Switch {index}",
+            "type": "switch", "gpio_pin": 5 + index, "is_active": False, "value": None,
+        })
+    # Distinct change times, as rows written one by one would have
+    for index, row in enumerate(rows):
+        row["updated_at"] = (now + timedelta(microseconds=index)).isoformat()
+    return rows
+
+
+def configure_environment(rest_url, realtime_url, workdir):
+    """Point config.py at the stand-ins, must run before any controller module is imported"""
+    os.environ.update({
+        "SUPABASE_URL": rest_url,
+        "SUPABASE_KEY": FAKE_KEY,
+        "SUPABASE_REALTIME_URL": realtime_url,
+        "CONTROL_UNIT_ID": CONTROL_UNIT_ID,
+        "GPIO_BACKEND": "sim",
+        "W1_DEVICES_PATH": os.path.join(workdir, "w1"),
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+        "CONSOLE_LOGGING": "false",
+    })
+
+
+def bench_register_devices(postgrest, sizes):
+    """Cost of a full sync, an unchanged incremental sync and a sync with 1% of the devices changed"""
+    from device_sync import DeviceSync
+    from gpio_backend import SimulatedGPIOBackend
+    from gpio_manager import GPIOManager
+    from supabase_client import SupabaseManager
+
+    supabase = SupabaseManager()
+    results = []
+
+    for size in sizes:
+        start_time = datetime.now(UTC) - timedelta(hours=1)
+        postgrest.seed("devices", make_devices(size, now=start_time))
+        sync = DeviceSync(supabase, GPIOManager(SimulatedGPIOBackend()))
+        result = {"devices": size}
+
+        for phase in ("full", "unchanged", "changed_1pct"):
+            if phase == "changed_1pct":
+                changed_at = datetime.now(UTC).isoformat()
+                postgrest.update_rows("devices", {
+                    row_id: {"is_active": True, "updated_at": changed_at}
+                    for row_id in list(postgrest.tables["devices"])[::100]
+                })
+
+            postgrest.reset_counters()
+            started = time.perf_counter()
+            stats = sync.sync(full=phase == "full")
+            elapsed = time.perf_counter() - started
+
+            result[phase] = {
+                "ms": round(elapsed * 1000, 3),
+                "http_requests": postgrest.total_requests(),
+                "rows_fetched": stats["rows_fetched"],
+                "pins_touched": stats["pins_touched"],
+            }
+
+        results.append(result)
+        print(f"register_devices {size:>6}: full {result['full']['ms']:.1f} ms, "
+              f"unchanged {result['unchanged']['ms']:.1f} ms, 1% changed {result['changed_1pct']['ms']:.1f} ms")
+
+    supabase.outbox.close()
+    return results
+
+
+def bench_sensor_sweep(workdir, counts, repeats=3):
+    """Time of one sweep over every probe, with and without a bulk conversion"""
+    from sensor_sampler import DS18B20Sampler
+
+    results = []
+    for count in counts:
+        for bulk_read in (False, True):
+            root = tempfile.mkdtemp(prefix="w1-", dir=workdir)
+            sensor_ids = make_w1_tree(root, count, bulk_read=bulk_read)
+            devices = [row for row in make_devices(count, sensor_ids) if row.get("sensor_id")]
+
+            sampler = DS18B20Sampler(devices_path=root)
+            durations = []
+            readings = {}
+            for _ in range(repeats):
+                started = time.perf_counter()
+                readings = sampler.sample(devices)
+                durations.append(time.perf_counter() - started)
+            sampler.close()
+            shutil.rmtree(root, ignore_errors=True)
+
+            result = {"sensors": count, "bulk_conversion": bulk_read, "readings": len(readings),
+                      "sweep_ms": summarize(durations)}
+            results.append(result)
+            print(f"sensor sweep {count:>3} probes (bulk={bulk_read}): p50 {result['sweep_ms']['p50']:.1f} ms")
+    return results
+
+
+def bench_rule_engine(rule_counts, sweeps=200):
+    """Time of evaluating a sweep of readings against the rules, including the pin write of the triggered ones"""
+    from gpio_backend import SimulatedGPIOBackend
+    from gpio_manager import GPIOManager
+    from rule_engine import RuleEngine
+
+    results = []
+    for count in rule_counts:
+        gpio = GPIOManager(SimulatedGPIOBackend())
+        devices = make_devices(count)
+        with gpio.batch():
+            for row in devices:
+                gpio.register_device(row["id"], row["gpio_pin"], row["type"])
+
+        # One thermostat-like rule per switch, every sensor watched by ten rules
+        engine = RuleEngine(gpio)
+        engine.load([
+            {"id": index, "sensor_device_id": f"sensor-{index // 10:05d}", "operator": ">", "threshold": 24,
+             "hysteresis": 0.5, "target_device_id": row["id"], "target_state": True}
+            for index, row in enumerate(devices)
+        ])
+        sensor_ids = sorted({f"sensor-{index // 10:05d}" for index in range(count)})
+
+        rng = random.Random(count)
+        durations = []
+        for _ in range(sweeps):
+            readings = {sensor_id: rng.uniform(22, 26) for sensor_id in sensor_ids}
+            started = time.perf_counter()
+            engine.evaluate(readings)
+            durations.append(time.perf_counter() - started)
+
+        result = {"rules": count, "sensors": len(sensor_ids), "sweep_ms": summarize(durations),
+                  "actions": engine.stats["actions"], "evaluations": engine.stats["evaluations"]}
+        results.append(result)
+        print(f"rule engine {count:>5} rules: sweep p50 {result['sweep_ms']['p50']:.3f} ms, "
+              f"p99 {result['sweep_ms']['p99']:.3f} ms ({result['actions']} actions)")
+    return results
+
+
+def bench_history(workdir, points, series=8):
+    """Append rate of the time-series store and the time of range, aggregate and rollup queries"""
+    from timeseries_store import TimeSeriesStore
+
+    store = TimeSeriesStore(os.path.join(workdir, "timeseries"))
+    names = [f"system.metric{index}" for index in range(series)]
+    rng = random.Random(points)
+    start_time = time.time() - points
+
+    started = time.perf_counter()
+    for index in range(points):
+        store.append_many({name: rng.uniform(0, 100) for name in names}, start_time + index)
+    append_elapsed = time.perf_counter() - started
+
+    def timed(func, repeats=5):
+        durations = []
+        for _ in range(repeats):
+            began = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - began)
+        return summarize(durations)
+
+    uploaded = []
+    result = {
+        "series": series,
+        "points_per_series": points,
+        "appends_per_second": round(points * series / append_elapsed),
+        "range_last_hour_ms": timed(lambda: store.range(names[0], start_time + points - 3600)),
+        "aggregate_all_ms": timed(lambda: store.aggregate(names[0])),
+        "rollup_1min_all_ms": timed(lambda: store.aggregate(names[0], bucket=60)),
+        "upload_ms": timed(lambda: store.upload(uploaded.extend, bucket=60, limit=1000000), repeats=1),
+        "rollup_rows": len(uploaded),
+    }
+    store.close()
+    shutil.rmtree(os.path.join(workdir, "timeseries"), ignore_errors=True)
+
+    print(f"history: {result['appends_per_second']} points/s appended, last hour of {points} points in "
+          f"{result['range_last_hour_ms']['p50']:.2f} ms, 1 min rollups in {result['rollup_1min_all_ms']['p50']:.1f} ms")
+    return result
+
+
+def bench_logging(workdir, records=20000):
+    """Cost of a log call on the calling thread: the former synchronous file handler with f-strings against the
+    queued pipeline with lazy formatting, with the level enabled and filtered out"""
+    import logging
+    from log_pipeline import LogPipeline, file_handler
+
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    record = {"id": "switch-00001", "type": "switch", "gpio_pin": 17, "is_active": True}
+
+    def measure(logger, level, lazy):
+        logger.setLevel(level)
+        durations = []
+        for index in range(records):
+            started = time.perf_counter()
+            if lazy:
+                logger.info("Device update %d: %s", index, record)
+            else:
+                logger.info(f"Device update {index}: {record}")
+            durations.append(time.perf_counter() - started)
+        return summarize(durations, scale=1e6)
+
+    def make_logger(name, handler):
+        logger = logging.getLogger(name)
+        logger.propagate = False
+        logger.addHandler(handler)
+        return logger
+
+    result = {"records": records}
+    sync_handler = logging.FileHandler(os.path.join(workdir, "sync.log"))
+    sync_handler.setFormatter(formatter)
+    logger = make_logger("bench-sync", sync_handler)
+    result["sync_file_us"] = measure(logger, logging.INFO, lazy=False)
+    result["sync_filtered_us"] = measure(logger, logging.ERROR, lazy=False)
+    sync_handler.close()
+
+    for name, burst in (("queued", 0), ("rate_limited", 20)):
+        handler = file_handler(os.path.join(workdir, f"{name}.log"), max_bytes=256 * 1024, backup_count=3)
+        handler.setFormatter(formatter)
+        pipeline = LogPipeline([handler], queue_size=records * 2, rate_limit_burst=burst)
+        pipeline.start()
+        logger = make_logger(f"bench-{name}", pipeline.handler)
+        result[f"{name}_us"] = measure(logger, logging.INFO, lazy=True)
+        if name == "queued":
+            result["queued_filtered_us"] = measure(logger, logging.ERROR, lazy=True)
+
+        started = time.perf_counter()
+        pipeline.stop()
+        result[f"{name}_drain_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result[f"{name}_stats"] = pipeline.stats
+        handler.close()
+    result["compressed_backups"] = len([entry for entry in os.listdir(workdir) if entry.endswith(".gz")])
+
+    print(f"logging: sync file {result['sync_file_us']['p50']:.1f} us/call (p99 {result['sync_file_us']['p99']:.1f}), "
+          f"queued {result['queued_us']['p50']:.1f} us/call (p99 {result['queued_us']['p99']:.1f}), "
+          f"rate limited {result['rate_limited_us']['p50']:.1f} us/call; filtered f-string "
+          f"{result['sync_filtered_us']['p50']:.2f} us vs lazy {result['queued_filtered_us']['p50']:.2f} us")
+    return result
+
+
+async def bench_inputs(input_count=8, edges=200, bounces=20):
+    """Edge to callback latency of debounced digital inputs and how a chattering contact is coalesced"""
+    from digital_inputs import DigitalInputs
+    from gpio_backend import SimulatedGPIOBackend
+    from gpio_manager import GPIOManager
+
+    loop = asyncio.get_running_loop()
+    backend = SimulatedGPIOBackend()
+    latencies = []
+    reports = []
+
+    def on_change(device_id, active, timestamp):
+        latencies.append(time.perf_counter() - timestamp)
+
+    inputs = DigitalInputs(GPIOManager(backend), on_change, reports.append, report_interval=0.1)
+    inputs.start(loop)
+    pins = {f"input-{index}": 5 + index for index in range(input_count)}
+    inputs.sync([{"id": device_id, "type": "sensor", "subtype": "button", "gpio_pin": pin,
+                  "input_debounce_ms": 10} for device_id, pin in pins.items()])
+    reporter = asyncio.create_task(inputs.run(None))
+    await asyncio.sleep(0.05)
+
+    # Clean presses and releases spaced beyond the debounce time, edges raised on a driver-like thread
+    for index in range(edges):
+        pin = pins[f"input-{index % input_count}"]
+        await loop.run_in_executor(None, backend.set_input, pin, index // input_count % 2 == 1)
+        await asyncio.sleep(0.012)
+    clean = summarize(latencies)
+
+    # A chattering release: every input bounces within the debounce time before settling high
+    await asyncio.sleep(0.2)
+    reports.clear()
+    accepted = inputs.stats["accepted"]
+    edges_before = inputs.stats["edges"]
+
+    def chatter():
+        for index in range(bounces):
+            for pin in pins.values():
+                backend.set_input(pin, index % 2 == 0)
+            time.sleep(0.0002)
+        for pin in pins.values():
+            backend.set_input(pin, True)
+
+    await loop.run_in_executor(None, chatter)
+    await asyncio.sleep(0.3)
+
+    reporter.cancel()
+    inputs.close()
+    result = {
+        "inputs": input_count,
+        "edge_to_callback_ms": clean,
+        "bounce_edges": inputs.stats["edges"] - edges_before,
+        "bounce_accepted": inputs.stats["accepted"] - accepted,
+        "bounce_reported_changes": sum(len(changes) for changes in reports),
+        "bounce_reports": len(reports),
+    }
+    print(f"inputs: edge to callback p50 {clean['p50']:.3f} ms, p99 {clean['p99']:.3f} ms; "
+          f"{result['bounce_edges']} bounce edges -> {result['bounce_accepted']} accepted, "
+          f"{result['bounce_reported_changes']} changes in {result['bounce_reports']} reports")
+    return result
+
+
+def bench_echo_filter(device_count=100, messages=5000):
+    """Cost per realtime message including applying it, and the events left to dispatch when most are echoes of
+    the controller's own writes"""
+    import realtime_manager
+    from event_filter import EventFilter
+    from gpio_backend import SimulatedGPIOBackend
+    from gpio_manager import GPIOManager
+
+    sensor_count = device_count // 2
+    rows = make_devices(device_count, [f"28-{index:012x}" for index in range(sensor_count)])
+    gpio = GPIOManager(SimulatedGPIOBackend())
+    with gpio.batch():
+        for row in rows:
+            gpio.register_device(row["id"], row["gpio_pin"], row["type"], row["is_active"], row["value"])
+    topic = f"realtime:public:devices:controller_id=eq.{CONTROL_UNIT_ID}"
+
+    # 90% echoes of sensor writes, 5% switch rows touched without a state change, 5% switch toggles
+    rng = random.Random(messages)
+    writes, frames = [], []
+    states = {row["id"]: False for row in rows[sensor_count:]}
+    for index in range(messages):
+        kind = rng.random()
+        if kind < 0.9:
+            row = dict(rng.choice(rows[:sensor_count]), value=round(rng.uniform(18, 26), 2))
+            writes.append({"id": row["id"], "value": row["value"], "unit": "°C", "last_updated": str(index)})
+        else:
+            row = dict(rng.choice(rows[sensor_count:]))
+            if kind >= 0.95:
+                states[row["id"]] = not states[row["id"]]
+            row["is_active"] = states[row["id"]]
+        row["updated_at"] = str(index)
+        frames.append(json.dumps({"topic": topic, "event": "UPDATE", "ref": None, "payload": {
+            "record": row, "old_record": {"id": row["id"]}, "type": "UPDATE",
+        }}))
+
+    decoders = {"json": json.loads}
+    try:
+        import orjson
+        decoders["orjson"] = orjson.loads
+    except ImportError:
+        pass
+
+    result = {"messages": messages}
+    original_loads = realtime_manager.json_loads
+    try:
+        for name, loads in decoders.items():
+            realtime_manager.json_loads = loads
+            for filtered in (False, True):
+                dispatched = []
+
+                def apply(event_type, record, received_at):
+                    # Applied right away, as the dispatcher's worker would
+                    dispatched.append(record)
+                    gpio.update_device_state(record["id"], record.get("is_active"), record.get("value"))
+
+                event_filter = EventFilter(gpio.registry)
+                manager = realtime_manager.RealtimeManager(apply, accept=event_filter.accept if filtered else None)
+                event_filter.remember(writes)
+
+                started = time.perf_counter()
+                for frame in frames:
+                    manager._on_message(frame)
+                elapsed = time.perf_counter() - started
+                key = f"{name}_{'filtered' if filtered else 'unfiltered'}"
+                result[key] = {"us_per_message": round(elapsed / messages * 1e6, 2), "dispatched": len(dispatched),
+                               **event_filter.stats}
+                with gpio.batch():
+                    for device_id in states:
+                        gpio.update_device_state(device_id, False)
+    finally:
+        realtime_manager.json_loads = original_loads
+
+    best = result[f"{'orjson' if 'orjson' in decoders else 'json'}_filtered"]
+    print(f"echo filter: {result['json_unfiltered']['us_per_message']:.1f} us/message, {messages} dispatched "
+          f"without filter; {best['us_per_message']:.1f} us/message, {best['dispatched']} dispatched "
+          f"({best['echoes']} echoes, {best['unchanged']} unchanged) with filter and {list(decoders)[-1]}")
+    return result
+
+
+async def bench_local_api(workdir, device_count=10, requests=2000):
+    """Round trip of a command over the local API socket and the time to read the shared-memory state view"""
+    from gpio_backend import SimulatedGPIOBackend
+    from gpio_manager import GPIOManager
+    from local_api import LocalAPIServer, LocalClient, StateReader
+
+    gpio = GPIOManager(SimulatedGPIOBackend())
+    rows = make_devices(device_count)
+    with gpio.batch():
+        for row in rows:
+            gpio.register_device(row["id"], row["gpio_pin"], row["type"])
+
+    changes = []
+    socket_path = os.path.join(workdir, "local-api.sock")
+    state_path = os.path.join(workdir, "local-api-state")
+    server = LocalAPIServer(gpio, lambda *change: changes.append(change), socket_path, state_path)
+    task = asyncio.create_task(server.run())
+    while not os.path.exists(state_path):
+        await asyncio.sleep(0.01)
+
+    def client():
+        api = LocalClient(socket_path)
+        reader = StateReader(state_path)
+        round_trips, reads, stale = [], [], 0
+        for index in range(requests):
+            device_id = rows[index % device_count]["id"]
+            state = index // device_count % 2 == 0
+            started = time.perf_counter()
+            api.request("set", device_id=device_id, state=state)
+            round_trips.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            devices = reader.read()["devices"]
+            reads.append(time.perf_counter() - started)
+            stale += devices[device_id]["state"] != state
+        api.close()
+        reader.close()
+        return round_trips, reads, stale
+
+    round_trips, reads, stale = await asyncio.get_running_loop().run_in_executor(None, client)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    result = {"devices": device_count, "set_round_trip_ms": summarize(round_trips), "state_read_ms": summarize(reads),
+              "stale_reads": stale, "changes_synced": len(changes)}
+    print(f"local api: set round trip p50 {result['set_round_trip_ms']['p50']:.3f} ms, "
+          f"p99 {result['set_round_trip_ms']['p99']:.3f} ms; state view read p50 "
+          f"{result['state_read_ms']['p50'] * 1000:.1f} us ({stale} stale reads)")
+    return result
+
+
+def bench_actuation(writes=1000, period=0.002, load_threads=2):
+    """Jitter of periodic pin writes, in the controller process and in the actuation process, idle and loaded
+
+    A writer thread toggles a pin every `period` seconds; the lateness is the time from
+    when the write was due until the pin was written (by the worker in process mode).
+    The load threads parse JSON and leave cyclic garbage, like the realtime and HTTP paths.
+    """
+    import threading
+    from actuation_process import ActuationProcessBackend
+    from gpio_backend import SimulatedGPIOBackend
+
+    document = json.dumps({"rows": [{"id": str(index), "value": index * 0.5, "tags": ["a", "b"]}
+                                    for index in range(2000)]})
+
+    def load(stop):
+        while not stop.is_set():
+            rows = json.loads(document)["rows"]
+            json.dumps(rows[:200])
+            for row in rows:
+                row["self"] = row
+
+    def run(backend, loaded):
+        stop = threading.Event()
+        threads = [threading.Thread(target=load, args=(stop,), daemon=True) for _ in range(loaded and load_threads)]
+        for thread in threads:
+            thread.start()
+        backend.setup_output(17, False)
+        lateness, write_times = [], []
+        due = time.perf_counter_ns() + 10_000_000
+        try:
+            for index in range(writes):
+                while time.perf_counter_ns() < due:
+                    time.sleep(max(0.0, (due - time.perf_counter_ns()) / 1e9 - 0.0002))
+                started = time.perf_counter_ns()
+                ack = backend.apply({17: index % 2 == 0})
+                finished = time.perf_counter_ns()
+                applied = ack.applied if ack is not None else finished
+                lateness.append((applied - due) / 1e9)
+                write_times.append((finished - started) / 1e9)
+                due += int(period * 1e9)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        return {"lateness_ms": summarize(lateness), "write_ms": summarize(write_times)}
+
+    cpus = str(os.cpu_count() - 1) if (os.cpu_count() or 1) > 1 else ""
+    result = {"writes": writes, "period_ms": period * 1000, "load_threads": load_threads, "worker_cpus": cpus}
+    for mode in ("in_process", "process"):
+        for loaded in (False, True):
+            if mode == "process":
+                backend = ActuationProcessBackend("sim", cpus=cpus, priority=50)
+            else:
+                backend = SimulatedGPIOBackend()
+            try:
+                result[f"{mode}_{'loaded' if loaded else 'idle'}"] = run(backend, loaded)
+            finally:
+                backend.close()
+
+    for name in ("in_process_idle", "in_process_loaded", "process_idle", "process_loaded"):
+        lateness = result[name]["lateness_ms"]
+        print(f"actuation {name:17}: lateness p50 {lateness['p50']:.3f} ms, p99 {lateness['p99']:.3f} ms, "
+              f"max {lateness['max']:.3f} ms; write p50 {result[name]['write_ms']['p50']:.3f} ms")
+    return result
+
+
+def recording_backend(loop, on_write):
+    """Simulated GPIO backend reporting the time of every pin write to the event loop"""
+    from gpio_backend import SimulatedGPIOBackend
+
+    class RecordingBackend(SimulatedGPIOBackend):
+        def apply(self, states):
+            super().apply(states)
+            written_at = time.perf_counter()
+            for pin, state in states.items():
+                loop.call_soon_threadsafe(on_write, pin, state, written_at)
+
+    return RecordingBackend()
+
+
+async def bench_event_latency(postgrest, realtime, device_count, events, burst):
+    """Time from a realtime UPDATE leaving the server until the pin is written"""
+    from main import RaspberryPiController
+
+    postgrest.seed("devices", make_devices(device_count))
+    postgrest.seed("control_units", [{"id": CONTROL_UNIT_ID}])
+
+    loop = asyncio.get_running_loop()
+    waiting = {}
+
+    def on_write(pin, state, written_at):
+        future = waiting.get((pin, state))
+        if future is not None and not future.done():
+            future.set_result(written_at)
+
+    controller = RaspberryPiController()
+    controller.gpio.backend = recording_backend(loop, on_write)
+    task = asyncio.create_task(controller.run())
+
+    await realtime.wait_for_join(controller.realtime.topic)
+    while not controller.realtime.subscribed or len(controller.gpio.devices) < device_count:
+        await asyncio.sleep(0.01)
+
+    switches = [row for row in postgrest.tables["devices"].values() if row["type"] == "switch"]
+    states = {row["id"]: False for row in switches}
+
+    async def toggle(row):
+        states[row["id"]] = not states[row["id"]]
+        future = loop.create_future()
+        waiting[(row["gpio_pin"], states[row["id"]])] = future
+        record = dict(row, is_active=states[row["id"]])
+        sent_at = await realtime.push(controller.realtime.topic, "UPDATE", record)
+        written_at = await asyncio.wait_for(future, 10)
+        return written_at - sent_at
+
+    # One event at a time: pure pipeline latency
+    sequential = []
+    for index in range(events):
+        sequential.append(await toggle(switches[index % len(switches)]))
+        await asyncio.sleep(0.002)
+
+    # Burst of events for different devices: queueing and batching behaviour
+    started = time.perf_counter()
+    burst_latencies = await asyncio.gather(*(toggle(row) for row in switches[:burst]))
+    burst_elapsed = time.perf_counter() - started
+
+    dispatcher_stats = dict(controller.dispatcher.stats)
+    controller.signal_handler(signal.SIGTERM)
+    await task
+
+    result = {
+        "devices": device_count,
+        "sequential_ms": summarize(sequential),
+        "burst": {"events": len(burst_latencies), "total_ms": round(burst_elapsed * 1000, 3),
+                  "latency_ms": summarize(burst_latencies)},
+        "dispatcher": dispatcher_stats,
+    }
+    print(f"event->pin latency: p50 {result['sequential_ms']['p50']:.2f} ms, "
+          f"p99 {result['sequential_ms']['p99']:.2f} ms; burst of {burst} in {result['burst']['total_ms']:.1f} ms")
+    return result
+
+
+async def bench_steady_state(postgrest, realtime, workdir, device_count, sensor_count, duration, time_scale):
+    """Run main.py with scaled-down intervals and measure HTTP requests, CPU and RSS"""
+    w1_root = os.path.join(workdir, "w1-steady")
+    sensor_ids = make_w1_tree(w1_root, sensor_count)
+    postgrest.seed("devices", make_devices(device_count, sensor_ids))
+    postgrest.seed("control_units", [{"id": CONTROL_UNIT_ID}])
+
+    env = dict(os.environ, W1_DEVICES_PATH=w1_root, OUTBOX_PATH=os.path.join(workdir, "outbox-steady.db"))
+    for name, interval in STEADY_STATE_INTERVALS.items():
+        scaled = interval / time_scale
+        env[name] = str(max(1, round(scaled))) if name in INTEGER_INTERVALS else str(scaled)
+
+    steady_dir = os.path.join(workdir, "steady")
+    os.makedirs(steady_dir, exist_ok=True)
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "main.py")], cwd=steady_dir, env=env)
+    proc = psutil.Process(process.pid)
+
+    try:
+        # Start-up (connect, first full sync) is not part of the steady state
+        while "GET devices" not in postgrest.requests and process.poll() is None:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(2)
+
+        postgrest.reset_counters()
+        pushed_before = realtime.stats["heartbeats"]
+        cpu_before = proc.cpu_times()
+        rss = []
+        rng = random.Random(1)
+
+        started = time.monotonic()
+        while time.monotonic() - started < duration and process.poll() is None:
+            # Half of the probes drift, the other half stays constant
+            for sensor_id in sensor_ids[::2]:
+                write_temperature(w1_root, sensor_id, round(rng.uniform(20.0, 22.0), 1))
+            rss.append(proc.memory_info().rss)
+            await asyncio.sleep(1)
+        elapsed = time.monotonic() - started
+
+        cpu_after = proc.cpu_times()
+        requests = dict(postgrest.requests)
+        heartbeats = realtime.stats["heartbeats"] - pushed_before
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, process.wait, 15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    cpu_seconds = (cpu_after.user + cpu_after.system) - (cpu_before.user + cpu_before.system)
+    simulated_hours = elapsed * time_scale / 3600
+    result = {
+        "devices": device_count,
+        "sensors": sensor_count,
+        "duration_s": round(elapsed, 1),
+        "time_scale": time_scale,
+        "http_requests_per_hour": {key: round(count / simulated_hours, 1) for key, count in sorted(requests.items())},
+        "http_requests_per_hour_total": round(sum(requests.values()) / simulated_hours, 1),
+        "realtime_heartbeats_per_hour": round(heartbeats / simulated_hours, 1),
+        # CPU is measured with every interval shortened by time_scale, the per-real-time figure is an estimate
+        "cpu_percent_scaled": round(cpu_seconds / elapsed * 100, 2),
+        "cpu_percent_estimate": round(cpu_seconds / elapsed * 100 / time_scale, 3),
+        "rss_mb": {
+            "mean": round(sum(rss) / len(rss) / 2 ** 20, 2) if rss else None,
+            "max": round(max(rss) / 2 ** 20, 2) if rss else None,
+        },
+        "exit_code": process.returncode,
+    }
+    print(f"steady state: {result['http_requests_per_hour_total']} HTTP requests/hour, "
+          f"CPU ~{result['cpu_percent_estimate']}%, RSS {result['rss_mb']['max']} MB")
+    return result
+
+
+async def bench_gateway(postgrest, realtime, workdir, unit_counts, devices_per_unit=10, duration=3.0):
+    """Run main.py serving several control units and measure RSS, sockets and requests per unit count"""
+    results = []
+    for count in unit_counts:
+        unit_ids = [f"gateway-{count}-{index:03d}" for index in range(count)]
+        rows = []
+        for unit_index, unit_id in enumerate(unit_ids):
+            for row in make_devices(devices_per_unit):
+                row.update(id=f"{unit_id}-{row['id']}", controller_id=unit_id,
+                           gpio_pin=row["gpio_pin"] + unit_index * devices_per_unit)
+                rows.append(row)
+        postgrest.seed("devices", rows)
+        postgrest.seed("control_units", [{"id": unit_id} for unit_id in unit_ids])
+
+        gateway_dir = os.path.join(workdir, f"gateway-{count}")
+        os.makedirs(gateway_dir, exist_ok=True)
+        env = dict(os.environ, CONTROL_UNIT_IDS=",".join(unit_ids), OUTBOX_PATH=os.path.join(gateway_dir, "outbox.db"),
+                   KEEP_ALIVE_INTERVAL="1", METRICS_MAX_INTERVAL="0.5", TELEMETRY_FLUSH_INTERVAL="0.5")
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "main.py")], cwd=gateway_dir, env=env)
+        proc = psutil.Process(process.pid)
+
+        try:
+            for unit_id in unit_ids:
+                await realtime.wait_for_join(f"realtime:public:devices:controller_id=eq.{unit_id}", timeout=30)
+            await asyncio.sleep(1)
+
+            postgrest.reset_counters()
+            await asyncio.sleep(duration)
+            requests = dict(postgrest.requests)
+            result = {
+                "units": count,
+                "devices": len(rows),
+                "rss_mb": round(proc.memory_info().rss / 2 ** 20, 2),
+                "sockets": len(proc.connections(kind="inet")),
+                "threads": proc.num_threads(),
+                "http_requests_per_second": round(sum(requests.values()) / duration, 2),
+                "heartbeat_requests_per_second": round(requests.get("PATCH control_units", 0) / duration, 2),
+            }
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, process.wait, 15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        results.append(result)
+        print(f"gateway {count:>3} units: RSS {result['rss_mb']} MB, {result['sockets']} sockets, "
+              f"{result['threads']} threads, {result['heartbeat_requests_per_second']} heartbeat requests/s")
+    return results
+
+
+async def bench_cold_boot(workdir, device_count, runs=3):
+    """Start main.py with a boot snapshot and no reachable Supabase, time until the pins are restored"""
+    boot_dir = os.path.join(workdir, "boot")
+    os.makedirs(boot_dir, exist_ok=True)
+    rows = make_devices(device_count)
+    for index, row in enumerate(rows):
+        row["is_active"] = index % 2 == 0
+
+    env = dict(os.environ, LOG_LEVEL="INFO", SUPABASE_URL=f"http://127.0.0.1:{free_port()}",
+               SUPABASE_REALTIME_URL=f"ws://127.0.0.1:{free_port()}", OUTBOX_PATH=os.path.join(boot_dir, "outbox.db"))
+    log_path = os.path.join(boot_dir, "controller.log")
+    marker = "first actuation "
+
+    reported, observed = [], []
+    for _ in range(runs):
+        with open(os.path.join(boot_dir, "boot_snapshot.json"), "w") as f:
+            json.dump({"version": 1, "devices": rows}, f)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "main.py")], cwd=boot_dir, env=env)
+        try:
+            line = None
+            while line is None and process.poll() is None and time.perf_counter() - started < 30:
+                await asyncio.sleep(0.005)
+                if os.path.exists(log_path):
+                    with open(log_path) as f:
+                        line = next((text for text in f if marker in text), None)
+            if line is None:
+                raise RuntimeError("Controller did not report its first actuation")
+            observed.append(time.perf_counter() - started)
+            reported.append(float(line.split(marker, 1)[1].split(" ms", 1)[0]) / 1000)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, process.wait, 15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    result = {
+        "devices": device_count,
+        # Measured by the controller from the start of main.py
+        "first_actuation_ms": summarize(reported),
+        # Including interpreter start-up and the log write, as seen from outside
+        "process_start_to_actuation_ms": summarize(observed),
+    }
+    print(f"cold boot: first actuation {result['first_actuation_ms']['p50']:.1f} ms after start "
+          f"({result['process_start_to_actuation_ms']['p50']:.1f} ms including interpreter start-up)")
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="raspberry-iot-bench-")
+    os.makedirs(os.path.join(workdir, "w1"), exist_ok=True)
+
+    postgrest = FakePostgREST(latency=args.http_latency / 1000).start()
+    realtime = await FakeRealtime(port=free_port()).start()
+    configure_environment(postgrest.url, realtime.url, workdir)
+    # config.py writes controller.log to the working directory
+    os.chdir(workdir)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(UTC).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+    }
+
+    try:
+        loop = asyncio.get_running_loop()
+        results["register_devices"] = await loop.run_in_executor(
+            None, bench_register_devices, postgrest, args.sizes)
+        results["sensor_sweep"] = await loop.run_in_executor(
+            None, bench_sensor_sweep, workdir, args.sensor_counts)
+        results["rule_engine"] = await loop.run_in_executor(None, bench_rule_engine, args.rule_counts)
+        results["history"] = await loop.run_in_executor(None, bench_history, workdir, args.history_points)
+        results["logging"] = await loop.run_in_executor(None, bench_logging, workdir)
+        results["echo_filter"] = await loop.run_in_executor(None, bench_echo_filter)
+        results["inputs"] = await bench_inputs()
+        results["local_api"] = await bench_local_api(workdir)
+        results["actuation"] = await loop.run_in_executor(None, bench_actuation)
+        results["event_latency"] = await bench_event_latency(
+            postgrest, realtime, args.latency_devices, args.events, args.burst)
+        results["gateway"] = await bench_gateway(postgrest, realtime, workdir, args.gateway_units)
+        results["cold_boot"] = await bench_cold_boot(workdir, args.latency_devices)
+        results["steady_state"] = await bench_steady_state(
+            postgrest, realtime, workdir, args.latency_devices, max(args.sensor_counts), args.duration,
+            args.time_scale)
+    finally:
+        await realtime.stop()
+        postgrest.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file receiving the results")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+                        help="device counts of the register_devices benchmark")
+    parser.add_argument("--sensor-counts", type=int, nargs="+", default=[1, 8, 32],
+                        help="probe counts of the sensor sweep benchmark")
+    parser.add_argument("--rule-counts", type=int, nargs="+", default=[10, 100, 1000],
+                        help="rule counts of the rule engine benchmark")
+    parser.add_argument("--history-points", type=int, default=86400,
+                        help="points per series of the time-series store benchmark")
+    parser.add_argument("--gateway-units", type=int, nargs="+", default=[1, 10, 50],
+                        help="control unit counts of the gateway benchmark")
+    parser.add_argument("--latency-devices", type=int, default=100, help="devices of the latency and steady runs")
+    parser.add_argument("--events", type=int, default=500, help="sequential realtime events")
+    parser.add_argument("--burst", type=int, default=50, help="realtime events sent at once")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of the steady-state run")
+    parser.add_argument("--time-scale", type=float, default=30, help="factor the steady-state intervals are shortened by")
+    parser.add_argument("--http-latency", type=float, default=0, help="milliseconds added to every HTTP request")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    results = asyncio.run(run(args))
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
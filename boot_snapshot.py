@@ -0,0 +1,73 @@
+import json
+import os
+import time
+
+from config import logger, BOOT_SNAPSHOT_PATH
+
+
+class BootSnapshot:
+    """Last known device rows and local rules kept on local storage, so pins can be restored
+    and rules run at boot before the network (or even the HTTP client) is available.
+
+    The snapshot is written to a temporary file, fsync'd and renamed over the old one,
+    so a power cut leaves either the previous or the new snapshot, never a torn one.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=BOOT_SNAPSHOT_PATH):
+        self.path = path
+        # Rule rows of the loaded snapshot, None when it has none
+        self.rules = None
+        self.stats = {"saves": 0, "last_save_duration": 0.0, "last_size": 0}
+
+    def load(self):
+        """Get the saved device rows, None when there is no usable snapshot"""
+        try:
+            with open(self.path, "rb") as f:
+                data = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load boot snapshot {self.path}: {e}")
+            return None
+
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            logger.warning(f"Ignoring boot snapshot {self.path} with unknown format")
+            return None
+
+        self.rules = data.get("rules")
+        return data.get("devices", [])
+
+    def save(self, devices, rules=None):
+        """Atomically replace the snapshot with the given device rows and rule rows"""
+        start = time.monotonic()
+        data = json.dumps(
+            {"version": self.VERSION, "saved_at": time.time(), "devices": devices, "rules": rules},
+            separators=(",", ":")
+        ).encode()
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._sync_directory()
+
+        self.stats["saves"] += 1
+        self.stats["last_save_duration"] = time.monotonic() - start
+        self.stats["last_size"] = len(data)
+
+    def _sync_directory(self):
+        """Make the rename itself durable"""
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -2,6 +2,8 @@ import os
 from dotenv import load_dotenv
 import logging
 
+from log_pipeline import LogPipeline, file_handler
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -9,23 +11,202 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 CONTROL_UNIT_ID = os.getenv("CONTROL_UNIT_ID")
+# Gateway mode: comma separated ids of all control units served by this process, sharing one HTTP pool,
+# one realtime socket and one heartbeat request (replaces CONTROL_UNIT_ID, the first id is the primary unit)
+CONTROL_UNIT_IDS = [unit_id.strip() for unit_id in os.getenv("CONTROL_UNIT_IDS", "").split(",") if unit_id.strip()]
 
 # Check if required environment variables are missing
 if not SUPABASE_URL:
     raise ValueError("SUPABASE_URL is not set in .env file")
 if not SUPABASE_KEY:
     raise ValueError("SUPABASE_KEY is not set in .env file")
-if not CONTROL_UNIT_ID:
+if not CONTROL_UNIT_ID and not CONTROL_UNIT_IDS:
     raise ValueError("CONTROL_UNIT_ID is not set in .env file")
+CONTROL_UNIT_IDS = CONTROL_UNIT_IDS or [CONTROL_UNIT_ID]
+CONTROL_UNIT_ID = CONTROL_UNIT_IDS[0]
+
+# PostgREST transport: connect and read timeouts (seconds), pooled keep-alive connections, HTTP/2 when the
+# h2 package is installed, and gzip for large request bodies (only if your gateway accepts compressed bodies)
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "3"))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "10"))
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", "4"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "True").lower() in ("true", "1", "t", "yes")
+SUPABASE_COMPRESS_REQUESTS = os.getenv("SUPABASE_COMPRESS_REQUESTS", "False").lower() in ("true", "1", "t", "yes")
+# Optional device columns, only fetched when enabled: sensor_id maps DS18B20 devices to the probes of a shared
+# bus, report_* override the reporting policy and input_* the input settings of a device
+DEVICE_SENSOR_ID_COLUMN = os.getenv("DEVICE_SENSOR_ID_COLUMN", "False").lower() in ("true", "1", "t", "yes")
+DEVICE_REPORT_COLUMNS = os.getenv("DEVICE_REPORT_COLUMNS", "False").lower() in ("true", "1", "t", "yes")
+DEVICE_INPUT_COLUMNS = os.getenv("DEVICE_INPUT_COLUMNS", "False").lower() in ("true", "1", "t", "yes")
+# Device columns fetched by the resync (the base columns and the enabled optional ones when empty), controller_id
+# and the watermark column are always added. Columns missing from the table fall back to all columns
+DEVICE_COLUMNS = os.getenv("DEVICE_COLUMNS", "") or ",".join(
+    ["id,name,type,subtype,unit,gpio_pin,is_active,value"]
+    + (["sensor_id"] if DEVICE_SENSOR_ID_COLUMN else [])
+    + (["report_deadband,report_deadband_pct,report_min_interval,report_max_interval"] if DEVICE_REPORT_COLUMNS else [])
+    + (["input_debounce_ms,input_glitch_ms,input_pull"] if DEVICE_INPUT_COLUMNS else [])
+)
+
+# Realtime websocket endpoint, derived from SUPABASE_URL when empty (set it for self-hosted or local stand-ins)
+SUPABASE_REALTIME_URL = os.getenv("SUPABASE_REALTIME_URL", "")
+
+# GPIO driver: "rpi" (RPi.GPIO), "gpiomem" (bank register writes) or "sim" (in-memory, no hardware needed)
+GPIO_BACKEND = os.getenv("GPIO_BACKEND", "rpi")
+# Actuation process: run the GPIO backend in a small worker process fed through a shared-memory ring, so the
+# controller's GIL and garbage collections don't delay pin writes. Optionally pinned to ACTUATION_CPUS (comma
+# separated, e.g. "3") and scheduled SCHED_FIFO with ACTUATION_PRIORITY (1-99, 0 keeps the normal scheduler,
+# needs root or CAP_SYS_NICE). ACTUATION_RING_SLOTS commands can be in flight, each is acknowledged within
+# ACTUATION_TIMEOUT seconds
+ACTUATION_PROCESS = os.getenv("ACTUATION_PROCESS", "False").lower() in ("true", "1", "t", "yes")
+ACTUATION_CPUS = os.getenv("ACTUATION_CPUS", "")
+ACTUATION_PRIORITY = int(os.getenv("ACTUATION_PRIORITY", "0"))
+ACTUATION_RING_SLOTS = int(os.getenv("ACTUATION_RING_SLOTS", "64"))
+ACTUATION_TIMEOUT = float(os.getenv("ACTUATION_TIMEOUT", "1"))
+
+# Boot snapshot: local file with the last known devices, restored before the network is up, and how often
+# (seconds) changes are written to it
+BOOT_SNAPSHOT_PATH = os.getenv("BOOT_SNAPSHOT_PATH", "boot_snapshot.json")
+BOOT_SNAPSHOT_INTERVAL = float(os.getenv("BOOT_SNAPSHOT_INTERVAL", "1"))
+
+# Device resync: column used as the incremental watermark and resync period (seconds)
+DEVICE_SYNC_WATERMARK_COLUMN = os.getenv("DEVICE_SYNC_WATERMARK_COLUMN", "updated_at")
+DEVICE_SYNC_INTERVAL = int(os.getenv("DEVICE_SYNC_INTERVAL", "300"))
+
+# DS18B20 sampling: 1-Wire sysfs directory (can point to a stand-in tree), per-read timeout and sweep period
+W1_DEVICES_PATH = os.getenv("W1_DEVICES_PATH", "/sys/bus/w1/devices")
+SENSOR_READ_TIMEOUT = float(os.getenv("SENSOR_READ_TIMEOUT", "2.0"))
+SENSOR_MAX_WORKERS = int(os.getenv("SENSOR_MAX_WORKERS", "8"))
+SENSOR_SAMPLE_INTERVAL = int(os.getenv("SENSOR_SAMPLE_INTERVAL", "90"))
+
+# Telemetry write-behind queue: flush period (seconds), size trigger, capacity and producer wait (seconds)
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "10"))
+TELEMETRY_FLUSH_SIZE = int(os.getenv("TELEMETRY_FLUSH_SIZE", "50"))
+TELEMETRY_MAX_PENDING = int(os.getenv("TELEMETRY_MAX_PENDING", "1000"))
+TELEMETRY_PUT_TIMEOUT = float(os.getenv("TELEMETRY_PUT_TIMEOUT", "0.5"))
+# Optional Postgres function taking the coalesced device rows as `updates` (see README), PATCH of the existing rows
+# otherwise, or a bulk upsert when enabled (needs an INSERT policy and defaults for every NOT NULL column)
+TELEMETRY_RPC = os.getenv("TELEMETRY_RPC", "")
+TELEMETRY_BULK_UPSERT = os.getenv("TELEMETRY_BULK_UPSERT", "false").lower() in ("true", "1", "t", "yes")
+
+# Durable outbox for undelivered writes: SQLite file, entry cap, fsync period (seconds) and replay pacing
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_MAX_ENTRIES = int(os.getenv("OUTBOX_MAX_ENTRIES", "50000"))
+OUTBOX_SYNC_INTERVAL = float(os.getenv("OUTBOX_SYNC_INTERVAL", "30"))
+OUTBOX_REPLAY_BATCH_SIZE = int(os.getenv("OUTBOX_REPLAY_BATCH_SIZE", "200"))
+OUTBOX_REPLAY_BATCHES = int(os.getenv("OUTBOX_REPLAY_BATCHES", "10"))
+OUTBOX_REPLAY_RATE = float(os.getenv("OUTBOX_REPLAY_RATE", "2"))
+
+# Event loop runtime: threads for blocking I/O and metrics update period (seconds)
+RUNTIME_WORKERS = int(os.getenv("RUNTIME_WORKERS", "3"))
+KEEP_ALIVE_INTERVAL = int(os.getenv("KEEP_ALIVE_INTERVAL", "60"))
+
+# System metrics: sampling period and rollup window (seconds), optional jsonb column of control_units
+# receiving min/max/mean/p95 of every metric with each update (disabled when empty)
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", "1"))
+METRICS_WINDOW = float(os.getenv("METRICS_WINDOW", str(KEEP_ALIVE_INTERVAL)))
+METRICS_ROLLUP_COLUMN = os.getenv("METRICS_ROLLUP_COLUMN", "")
+
+# Local time-series history of sensor readings and system metrics: directory of the memory-mapped segments
+# (disabled when empty, e.g. "timeseries"), points per segment file and seconds of history kept
+TIMESERIES_PATH = os.getenv("TIMESERIES_PATH", "")
+TIMESERIES_SEGMENT_POINTS = int(os.getenv("TIMESERIES_SEGMENT_POINTS", "16384"))
+TIMESERIES_RETENTION = float(os.getenv("TIMESERIES_RETENTION", "172800"))
+
+# Downsampled history upload: table receiving min/max/mean per series and bucket (disabled when empty),
+# bucket and upload period (seconds) and rows per request
+TIMESERIES_TABLE = os.getenv("TIMESERIES_TABLE", "")
+TIMESERIES_ROLLUP_INTERVAL = float(os.getenv("TIMESERIES_ROLLUP_INTERVAL", "60"))
+TIMESERIES_UPLOAD_INTERVAL = int(os.getenv("TIMESERIES_UPLOAD_INTERVAL", "300"))
+TIMESERIES_UPLOAD_BATCH = int(os.getenv("TIMESERIES_UPLOAD_BATCH", "1000"))
+
+# Opt-in Prometheus endpoint with latency histograms and queue/connection stats (disabled when the port is 0)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Sensor reporting policy defaults, overridable per device by the report_* columns of its row:
+# absolute and relative (%) deadband, minimum and maximum (forced heartbeat, 0 disables) seconds
+# between two reports, and reports per second allowed over all sensors (0 for no limit)
+REPORT_DEADBAND = float(os.getenv("REPORT_DEADBAND", "0"))
+REPORT_DEADBAND_PCT = float(os.getenv("REPORT_DEADBAND_PCT", "0"))
+REPORT_MIN_INTERVAL = float(os.getenv("REPORT_MIN_INTERVAL", "0"))
+REPORT_MAX_INTERVAL = float(os.getenv("REPORT_MAX_INTERVAL", "900"))
+REPORT_RATE_LIMIT = float(os.getenv("REPORT_RATE_LIMIT", "0"))
+
+# Control unit metrics reporting: deadband (percentage points) and forced heartbeat (seconds) keeping last_seen fresh
+METRICS_DEADBAND = float(os.getenv("METRICS_DEADBAND", "0"))
+METRICS_MAX_INTERVAL = float(os.getenv("METRICS_MAX_INTERVAL", "300"))
+
+# Digital inputs (devices of type sensor other than 1-Wire probes), overridable per device by the input_* columns:
+# debounce and glitch filter (milliseconds), pull resistor ("up", "down" or "none") and how often the coalesced
+# input changes are handed to the telemetry queue (seconds)
+INPUT_DEBOUNCE_MS = float(os.getenv("INPUT_DEBOUNCE_MS", "20"))
+INPUT_GLITCH_MS = float(os.getenv("INPUT_GLITCH_MS", "0"))
+INPUT_PULL = os.getenv("INPUT_PULL", "up")
+INPUT_REPORT_INTERVAL = float(os.getenv("INPUT_REPORT_INTERVAL", "1"))
+
+# Local rule engine: table of the rules of the control units (see README), disabled when empty
+RULES_TABLE = os.getenv("RULES_TABLE", "")
+
+# Local control API for processes on the same Pi (disabled when LOCAL_API_SOCKET is empty): Unix socket taking
+# newline-delimited JSON commands and its permissions (octal), shared-memory file receiving the device states (read
+# without locking, see README) and its size in bytes, and how often registry changes are published there (seconds)
+LOCAL_API_SOCKET = os.getenv("LOCAL_API_SOCKET", "")
+LOCAL_API_SOCKET_MODE = int(os.getenv("LOCAL_API_SOCKET_MODE", "660"), 8)
+LOCAL_API_STATE_PATH = os.getenv("LOCAL_API_STATE_PATH", "/dev/shm/raspberry-iot-state")
+LOCAL_API_STATE_SIZE = int(os.getenv("LOCAL_API_STATE_SIZE", str(256 * 1024)))
+LOCAL_API_PUBLISH_INTERVAL = float(os.getenv("LOCAL_API_PUBLISH_INTERVAL", "0.05"))
+
+# Diagnostics mode, also toggled at runtime with SIGUSR1: every DIAGNOSTICS_INTERVAL seconds the thread and file
+# descriptor counts, RSS and the DIAGNOSTICS_TOP allocation sites that grew most since the previous sample (tracemalloc,
+# tracebacks DIAGNOSTICS_FRAMES deep) are appended to diagnostics.jsonl in DIAGNOSTICS_PATH, rotated at
+# DIAGNOSTICS_MAX_BYTES with DIAGNOSTICS_BACKUP_COUNT backups. SIGUSR2 samples the stacks of the threads on CPU every
+# DIAGNOSTICS_PROFILE_INTERVAL seconds for DIAGNOSTICS_PROFILE_SECONDS into a folded-stacks file (flame graph input)
+DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS_ENABLED", "False").lower() in ("true", "1", "t", "yes")
+DIAGNOSTICS_PATH = os.getenv("DIAGNOSTICS_PATH", "diagnostics")
+DIAGNOSTICS_INTERVAL = float(os.getenv("DIAGNOSTICS_INTERVAL", "300"))
+DIAGNOSTICS_TOP = int(os.getenv("DIAGNOSTICS_TOP", "15"))
+DIAGNOSTICS_FRAMES = int(os.getenv("DIAGNOSTICS_FRAMES", "1"))
+DIAGNOSTICS_MAX_BYTES = int(os.getenv("DIAGNOSTICS_MAX_BYTES", str(1024 * 1024)))
+DIAGNOSTICS_BACKUP_COUNT = int(os.getenv("DIAGNOSTICS_BACKUP_COUNT", "5"))
+DIAGNOSTICS_PROFILE_SECONDS = float(os.getenv("DIAGNOSTICS_PROFILE_SECONDS", "30"))
+DIAGNOSTICS_PROFILE_INTERVAL = float(os.getenv("DIAGNOSTICS_PROFILE_INTERVAL", "0.02"))
+
+# Realtime dispatch: maximum devices with a pending event, workers applying events (more than one only
+# helps without a GPIO batch, batches are serialized by the GPIO manager) and events applied together
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", "1000"))
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "1"))
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "32"))
+
+# Realtime supervisor: Phoenix heartbeat period and reply timeout, reconnect backoff bounds (seconds)
+REALTIME_HEARTBEAT_INTERVAL = float(os.getenv("REALTIME_HEARTBEAT_INTERVAL", "25"))
+REALTIME_HEARTBEAT_TIMEOUT = float(os.getenv("REALTIME_HEARTBEAT_TIMEOUT", "10"))
+REALTIME_BACKOFF_BASE = float(os.getenv("REALTIME_BACKOFF_BASE", "1"))
+REALTIME_BACKOFF_MAX = float(os.getenv("REALTIME_BACKOFF_MAX", "60"))
+# Seconds a device write of this controller is remembered, so the UPDATE Supabase sends back for it is dropped
+REALTIME_ECHO_TTL = float(os.getenv("REALTIME_ECHO_TTL", "30"))
 
 # Configure logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "ERROR")
 CONSOLE_LOGGING = os.getenv("CONSOLE_LOGGING", "True").lower() in ("true", "1", "t", "yes")
+# Log file rotated at LOG_MAX_BYTES, or by time when LOG_ROTATE_WHEN is set (e.g. "midnight"), keeping
+# LOG_BACKUP_COUNT backups (gzipped unless LOG_COMPRESS is false)
+LOG_FILE = os.getenv("LOG_FILE", "controller.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "True").lower() in ("true", "1", "t", "yes")
+# Records are written by a background thread, at most LOG_QUEUE_SIZE records wait for it (more are dropped)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Each line of code logs at most LOG_RATE_LIMIT_BURST records per LOG_RATE_LIMIT_INTERVAL seconds (0 disables)
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "20"))
+LOG_RATE_LIMIT_INTERVAL = float(os.getenv("LOG_RATE_LIMIT_INTERVAL", "60"))
+# Level of the websockets and HTTP client libraries, whose debug output logs every frame and request
+LOG_LIBRARY_LEVEL = os.getenv("LOG_LIBRARY_LEVEL", "WARNING")
+
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
 # Set up logging with rotation in case logs grow large
-log_handler = logging.FileHandler("controller.log")
+log_handler = file_handler(LOG_FILE, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT, LOG_COMPRESS)
 log_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 log_handler.setFormatter(formatter)
 
 # Set up console logging if enabled
@@ -34,12 +215,15 @@ if console_handler:
     console_handler.setLevel(logging.DEBUG)
     console_handler.setFormatter(formatter)
 
-# Initialize logging with handlers
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[log_handler, console_handler] if console_handler else [log_handler]
+# Initialize logging: the handlers are written by the pipeline's thread, log calls only queue the records
+log_pipeline = LogPipeline(
+    [log_handler, console_handler] if console_handler else [log_handler],
+    LOG_QUEUE_SIZE, LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_INTERVAL
 )
+logging.basicConfig(level=getattr(logging, LOG_LEVEL), handlers=[log_pipeline.handler])
+for library in ("websockets", "httpx", "httpcore", "hpack"):
+    logging.getLogger(library).setLevel(max(getattr(logging, LOG_LIBRARY_LEVEL), getattr(logging, LOG_LEVEL)))
+log_pipeline.start()
 
 logger = logging.getLogger("raspberry-iot")  # before "rpi_controller"
 
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+
+import pytest
+
+# config.py refuses to load without a Supabase project, the tests never reach one
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+os.environ.setdefault("CONTROL_UNIT_ID", "test-unit")
+os.environ.setdefault("GPIO_BACKEND", "sim")
+os.environ.setdefault("CONSOLE_LOGGING", "false")
+
+# Files the modules create by default are kept out of the working tree
+_workdir = tempfile.mkdtemp(prefix="raspberry-iot-tests-")
+os.environ.setdefault("LOG_FILE", os.path.join(_workdir, "controller.log"))
+os.environ.setdefault("OUTBOX_PATH", os.path.join(_workdir, "outbox.db"))
+os.environ.setdefault("BOOT_SNAPSHOT_PATH", os.path.join(_workdir, "boot_snapshot.json"))
+os.environ.setdefault("TIMESERIES_PATH", "")
+
+
+class FakeClock:
+    """Monotonic clock of a test, only moves when advanced"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace time.monotonic() with a FakeClock"""
+    clock = FakeClock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
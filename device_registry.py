@@ -0,0 +1,188 @@
+import threading
+from enum import Enum
+from types import MappingProxyType
+
+
+class DeviceType(Enum):
+    SWITCH = "switch"
+    SENSOR = "sensor"
+    TEMPERATURE = "temperature"
+    HUMIDITY = "humidity"
+    THERMOSTAT = "thermostat"
+    UNKNOWN = "unknown"
+
+    @classmethod
+    def resolve(cls, device_type):
+        """Convert a device type name to a standard type regardless of language"""
+        if not device_type:
+            return cls.UNKNOWN
+        return DEVICE_TYPE_MAPPING.get(device_type.lower(), cls.UNKNOWN)
+
+    @property
+    def is_output(self):
+        return self is DeviceType.SWITCH
+
+
+# Dictionary to map device types in different languages to standard types
+DEVICE_TYPE_MAPPING = {
+    # English
+    "switch": DeviceType.SWITCH,
+    "light": DeviceType.SWITCH,
+    "relay": DeviceType.SWITCH,
+    "sensor": DeviceType.SENSOR,
+    "temperature": DeviceType.TEMPERATURE,
+    "humidity": DeviceType.HUMIDITY,
+    "thermostat": DeviceType.THERMOSTAT,
+    # Slovak/Czech
+    "spínač": DeviceType.SWITCH,
+    "svetlo": DeviceType.SWITCH,
+    "relé": DeviceType.SWITCH,
+    "senzor": DeviceType.SENSOR,
+    "teplota": DeviceType.TEMPERATURE,
+    "vlhkosť": DeviceType.HUMIDITY,
+    "termostat": DeviceType.THERMOSTAT,
+}
+
+
+class DeviceRecord:
+    """Registered device, treated as immutable: changes replace the record in the registry"""
+
+    __slots__ = ("device_id", "gpio_pin", "device_type", "state", "value")
+
+    def __init__(self, device_id, gpio_pin, device_type, state=None, value=None):
+        self.device_id = device_id
+        self.gpio_pin = gpio_pin
+        self.device_type = device_type
+        self.state = state
+        self.value = value
+
+    @property
+    def is_output(self):
+        return self.device_type.is_output
+
+    def replace(self, state=None, value=None):
+        """Get a copy with the given state and/or value changed"""
+        return DeviceRecord(
+            self.device_id,
+            self.gpio_pin,
+            self.device_type,
+            self.state if state is None else state,
+            self.value if value is None else value,
+        )
+
+    def __repr__(self):
+        return (f"DeviceRecord({self.device_id!r}, gpio_pin={self.gpio_pin}, type={self.device_type.value}, "
+                f"state={self.state}, value={self.value})")
+
+
+class PinConflictError(ValueError):
+    """Raised when a GPIO pin is already used by another device"""
+
+
+class DeviceRegistry:
+    """Registered devices indexed by id, GPIO pin and type.
+
+    Every change bumps `version`, state updates of input devices also bump
+    `input_state_updates`. `snapshot()` returns a read-only view that is
+    only rebuilt after a change, so readers can hold on to a consistent state.
+    Input devices may share a pin (e.g. several DS18B20 probes on one 1-Wire bus),
+    an output pin belongs to exactly one device.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        # State updates of input devices (e.g. debounced input edges) counted in `version`
+        self.input_state_updates = 0
+
+        # Key: device_id, Value: DeviceRecord
+        self.by_id = {}
+        # Key: gpio_pin, Value: dict of device_id -> DeviceRecord
+        self.by_pin = {}
+        # Key: DeviceType, Value: dict of device_id -> DeviceRecord
+        self.by_type = {device_type: {} for device_type in DeviceType}
+
+        self._snapshot = MappingProxyType({})
+        self._snapshot_version = 0
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, device_id):
+        return device_id in self.by_id
+
+    def get(self, device_id):
+        """Get the record of a device, None when it is not registered"""
+        return self.by_id.get(device_id)
+
+    def on_pin(self, gpio_pin):
+        """Get a read-only view of the devices using a GPIO pin"""
+        return MappingProxyType(self.by_pin.get(gpio_pin, {}))
+
+    def of_type(self, device_type):
+        """Get a read-only view of the devices of a standard type"""
+        return MappingProxyType(self.by_type[device_type])
+
+    def find_conflict(self, device_id, gpio_pin, device_type):
+        """Get a device that prevents `device_id` from using the pin, None when the pin can be used"""
+        for other in self.by_pin.get(gpio_pin, {}).values():
+            if other.device_id != device_id and (device_type.is_output or other.is_output):
+                return other
+        return None
+
+    def add(self, record):
+        """Register a device, replacing its previous record, returns the previous record or None
+
+        Raises:
+            PinConflictError: The pin is already used by another device
+        """
+        with self.lock:
+            owner = self.find_conflict(record.device_id, record.gpio_pin, record.device_type)
+            if owner is not None:
+                raise PinConflictError(f"GPIO {record.gpio_pin} is already used by device {owner.device_id}")
+
+            previous = self._discard(record.device_id)
+            self._index(record)
+            self.version += 1
+            return previous
+
+    def remove(self, device_id):
+        """Unregister a device, returns its record or None when it was not registered"""
+        with self.lock:
+            record = self._discard(device_id)
+            if record is not None:
+                self.version += 1
+            return record
+
+    def update(self, device_id, state=None, value=None):
+        """Replace the state and/or value of a device, returns the new record"""
+        with self.lock:
+            record = self.by_id[device_id].replace(state, value)
+            self._index(record)
+            self.version += 1
+            if value is None and not record.is_output:
+                self.input_state_updates += 1
+            return record
+
+    def snapshot(self):
+        """Get an immutable mapping of device_id -> DeviceRecord as of the current version"""
+        with self.lock:
+            if self._snapshot_version != self.version:
+                self._snapshot = MappingProxyType(dict(self.by_id))
+                self._snapshot_version = self.version
+            return self._snapshot
+
+    def _index(self, record):
+        self.by_id[record.device_id] = record
+        self.by_pin.setdefault(record.gpio_pin, {})[record.device_id] = record
+        self.by_type[record.device_type][record.device_id] = record
+
+    def _discard(self, device_id):
+        record = self.by_id.pop(device_id, None)
+        if record is not None:
+            devices_on_pin = self.by_pin[record.gpio_pin]
+            del devices_on_pin[device_id]
+            if not devices_on_pin:
+                del self.by_pin[record.gpio_pin]
+            del self.by_type[record.device_type][device_id]
+        return record
@@ -0,0 +1,185 @@
+import threading
+import time
+
+from config import logger, DEVICE_SYNC_WATERMARK_COLUMN
+
+
+class DeviceSync:
+    """Keep a versioned local snapshot of the control unit's devices in sync with Supabase.
+
+    Instead of re-registering every device on each resync, only rows changed since
+    the last watermark are fetched and only the pins whose configuration or state
+    actually changed are touched.
+
+    Locks are taken in the order sync_lock, the GPIO manager's batch lock, lock. The
+    dispatcher holds the batch lock while its handler records realtime changes here,
+    so a sync fetches without holding any lock but sync_lock and only takes `lock`
+    inside its batch.
+    """
+
+    # Fields that require the pin to be set up again when they change
+    CONFIG_FIELDS = ("gpio_pin", "type")
+
+    def __init__(self, supabase, gpio, watermark_column=DEVICE_SYNC_WATERMARK_COLUMN):
+        self.supabase = supabase
+        self.gpio = gpio
+        self.watermark_column = watermark_column
+
+        # Key: device_id, Value: last known device row
+        self.snapshot = {}
+        self.version = 0
+        self.watermark = None
+        # Guards the snapshot and version
+        self.lock = threading.Lock()
+        # Serializes whole syncs, guards the watermark
+        self.sync_lock = threading.Lock()
+
+        self.stats = {
+            "syncs": 0,
+            "rows_fetched": 0,
+            "pins_touched": 0,
+            "added": 0,
+            "changed": 0,
+            "removed": 0,
+            "duration": 0.0,
+        }
+
+        logger.info("Device sync initialized")
+
+    def sync(self, full=False):
+        """Fetch changed devices, apply the diff to the GPIO manager and return the sync stats"""
+        start = time.monotonic()
+
+        with self.sync_lock:
+            rows = self.supabase.get_devices_changed_since(None if full else self.watermark)
+            if rows is None:
+                return None
+
+            if full:
+                live_ids = {row["id"] for row in rows}
+            else:
+                # Deleted rows never show up in the incremental fetch, so compare ids instead
+                live_ids = self.supabase.get_device_ids()
+                if live_ids is None:
+                    return None
+
+            stats = {"rows_fetched": len(rows), "pins_touched": 0, "added": 0, "changed": 0, "removed": 0}
+
+            # State changes of all rows are committed as one pin write
+            with self.gpio.batch(), self.lock:
+                for row in rows:
+                    self._apply_row(row, stats)
+                    self._advance_watermark(row)
+
+                removed_ids = [device_id for device_id in self.snapshot if device_id not in live_ids]
+                for device_id in removed_ids:
+                    self._remove(device_id, stats)
+
+                if stats["added"] or stats["changed"] or stats["removed"]:
+                    self.version += 1
+
+            stats["duration"] = time.monotonic() - start
+            self._record(stats)
+
+        logger.info(
+            f"Device sync v{self.version}: fetched {stats['rows_fetched']} rows, "
+            f"touched {stats['pins_touched']} pins in {stats['duration'] * 1000:.1f} ms "
+            f"(+{stats['added']} ~{stats['changed']} -{stats['removed']})"
+        )
+        return stats
+
+    def restore(self, rows):
+        """Seed the snapshot with rows already applied to the GPIO manager (e.g. from the boot snapshot)
+
+        The first sync then only touches the devices that changed while offline.
+        """
+        with self.lock:
+            for row in rows:
+                self.snapshot[row["id"]] = row
+            self.version += 1
+
+    def get_devices(self):
+        """Get a copy of the known device rows"""
+        with self.lock:
+            return list(self.snapshot.values())
+
+    def note_realtime(self, event_type, device_data):
+        """Record a change already applied from a realtime event so the next sync skips it"""
+        device_id = device_data.get("id")
+        if device_id is None:
+            return
+
+        with self.lock:
+            if event_type == "device_deleted":
+                self.snapshot.pop(device_id, None)
+            elif event_type == "device_created":
+                self.snapshot[device_id] = device_data
+            elif device_id in self.snapshot:
+                # Updates only apply state and value, config changes are left for the next sync
+                known = dict(self.snapshot[device_id])
+                known["is_active"] = device_data.get("is_active")
+                known["value"] = device_data.get("value")
+                self.snapshot[device_id] = known
+            self.version += 1
+
+    def _apply_row(self, row, stats):
+        """Diff a fetched row against the snapshot and touch the GPIO manager only when needed"""
+        device_id = row["id"]
+        known = self.snapshot.get(device_id)
+
+        if known is not None and known == row:
+            return
+
+        # Pinless devices are kept in the snapshot so they are not reported again on every sync
+        self.snapshot[device_id] = row
+
+        if not row.get("gpio_pin"):
+            logger.warning(f"Device {device_id} ({row.get('name')}) has no GPIO pin assigned, skipping")
+            if known is not None and self.gpio.unregister_device(device_id):
+                stats["pins_touched"] += 1
+            return
+
+        is_active = row.get("is_active", False)
+
+        if known is None or any(known.get(field) != row.get(field) for field in self.CONFIG_FIELDS):
+            if known is not None and known.get("gpio_pin"):
+                self.gpio.unregister_device(device_id)
+                stats["changed"] += 1
+            else:
+                stats["added"] += 1
+
+            if self.gpio.register_device(device_id, row["gpio_pin"], row.get("type"), is_active, row.get("value")):
+                stats["pins_touched"] += 1
+            return
+
+        state_changed = known.get("is_active") != is_active
+        value_changed = known.get("value") != row.get("value")
+        if state_changed or value_changed:
+            self.gpio.update_device_state(
+                device_id,
+                is_active if state_changed else None,
+                row.get("value") if value_changed else None
+            )
+            stats["changed"] += 1
+            if state_changed:
+                stats["pins_touched"] += 1
+
+    def _remove(self, device_id, stats):
+        """Drop a device that was deleted or moved away from this control unit"""
+        self.snapshot.pop(device_id, None)
+        if self.gpio.unregister_device(device_id):
+            stats["pins_touched"] += 1
+        stats["removed"] += 1
+
+    def _advance_watermark(self, row):
+        """Move the watermark forward to the newest change seen"""
+        changed_at = row.get(self.watermark_column)
+        if changed_at is not None and (self.watermark is None or changed_at > self.watermark):
+            self.watermark = changed_at
+
+    def _record(self, stats):
+        """Accumulate the stats of a single sync into the running totals"""
+        self.stats["syncs"] += 1
+        for key in ("rows_fetched", "pins_touched", "added", "changed", "removed"):
+            self.stats[key] += stats[key]
+        self.stats["duration"] = stats["duration"]
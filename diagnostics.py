@@ -0,0 +1,251 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, UTC
+
+import psutil
+
+from config import (
+    logger, DIAGNOSTICS_PATH, DIAGNOSTICS_INTERVAL, DIAGNOSTICS_TOP, DIAGNOSTICS_FRAMES, DIAGNOSTICS_MAX_BYTES,
+    DIAGNOSTICS_BACKUP_COUNT, DIAGNOSTICS_PROFILE_SECONDS, DIAGNOSTICS_PROFILE_INTERVAL
+)
+from log_pipeline import file_handler
+
+# Allocations of the import machinery and of tracemalloc itself are not the controller's
+IGNORED_ALLOCATIONS = (
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+
+class StackSampler:
+    """Sampling CPU profiler.
+
+    Every `interval` seconds the stacks of the threads whose CPU time advanced since
+    the previous sample are counted; waiting threads cost nothing and are left out.
+    The counts are folded stacks ("thread;outer;...;inner count"), the input format
+    of flame graph tools.
+    """
+
+    def __init__(self, interval=DIAGNOSTICS_PROFILE_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+
+    def run(self, seconds):
+        """Sample for `seconds`, returns (folded stack -> samples, number of sampling rounds)"""
+        stacks = {}
+        cpu_times = {}
+        rounds = 0
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            threads = {thread.native_id: thread for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            for info in self.process.threads():
+                used = info.user_time + info.system_time
+                previous = cpu_times.get(info.id)
+                cpu_times[info.id] = used
+                thread = threads.get(info.id)
+                if previous is None or used <= previous or thread is None or thread.ident == me:
+                    continue
+                frame = frames.get(thread.ident)
+                if frame is None:
+                    continue
+                key = _fold(thread.name, frame)
+                stacks[key] = stacks.get(key, 0) + 1
+            rounds += 1
+            time.sleep(self.interval)
+        return stacks, rounds
+
+
+class Diagnostics:
+    """Leak and hot spot hunting on live controllers.
+
+    While enabled, `sample()` records the thread and file descriptor counts, RSS and
+    the allocation sites that grew most since the previous sample. `profile()`
+    runs the stack sampler on its own thread. Results go to rotating files in
+    `path`, so a unit can be inspected without restarting it.
+    """
+
+    OUTPUT_FILE = "diagnostics.jsonl"
+
+    def __init__(self, path=DIAGNOSTICS_PATH, interval=DIAGNOSTICS_INTERVAL, top=DIAGNOSTICS_TOP,
+                 frames=DIAGNOSTICS_FRAMES, max_bytes=DIAGNOSTICS_MAX_BYTES, backup_count=DIAGNOSTICS_BACKUP_COUNT):
+        """Initialize diagnostics, disabled until enable() is called
+
+        Args:
+            path: Directory of the output files, created when first written
+            interval: Seconds between two samples while enabled
+            top: Allocation sites listed per sample
+            frames: Frames of the traceback stored per allocation
+            max_bytes: Size at which diagnostics.jsonl is rotated
+            backup_count: Rotated files and profiles kept
+        """
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.process = psutil.Process()
+
+        self.enabled = False
+        self.snapshot = None
+        self.profiler = None
+        self.output = None
+
+        self.stats = {"samples": 0, "profiles": 0, "threads": 0, "open_fds": 0, "traced_bytes": 0}
+
+    def enable(self):
+        """Start tracing allocations, the first sample compares against this point"""
+        if self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_ALLOCATIONS)
+        self.enabled = True
+        logger.warning(f"Diagnostics enabled, sampling every {self.interval:.0f} seconds into {self.path}")
+
+    def disable(self):
+        """Stop tracing allocations"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.snapshot = None
+        tracemalloc.stop()
+        logger.warning("Diagnostics disabled")
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    async def run(self, executor):
+        """Sample every `interval` seconds while enabled, until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.enabled:
+                continue
+            try:
+                await loop.run_in_executor(executor, self.sample)
+            except Exception as e:
+                logger.error(f"Failed to record diagnostics: {e}")
+
+    def sample(self):
+        """Record the process counters and the allocation growth since the previous sample, returns the record"""
+        record = {"type": "sample", **self._counters()}
+
+        snapshot = self.snapshot
+        if self.enabled and snapshot is not None and tracemalloc.is_tracing():
+            current = tracemalloc.take_snapshot().filter_traces(IGNORED_ALLOCATIONS)
+            traced, peak = tracemalloc.get_traced_memory()
+            record["traced_bytes"] = traced
+            record["traced_peak_bytes"] = peak
+            record["growth"] = [
+                {"site": str(diff.traceback), "size_diff": diff.size_diff, "size": diff.size,
+                 "count_diff": diff.count_diff}
+                for diff in current.compare_to(snapshot, "traceback")[:self.top]
+                if diff.size_diff
+            ]
+            self.snapshot = current
+            self.stats["traced_bytes"] = traced
+
+        self.stats["samples"] += 1
+        self._write(record)
+        return record
+
+    def profile(self, seconds=DIAGNOSTICS_PROFILE_SECONDS):
+        """Run the stack sampler for `seconds` on its own thread, False when a profile is already running"""
+        if self.profiler is not None and self.profiler.is_alive():
+            logger.warning("Profile already running")
+            return False
+        self.profiler = threading.Thread(target=self._profile, args=(seconds,), name="diagnostics-profiler",
+                                         daemon=True)
+        self.profiler.start()
+        logger.warning(f"Profiling for {seconds:.0f} seconds")
+        return True
+
+    def close(self):
+        self.disable()
+        if self.output:
+            for handler in self.output.handlers:
+                handler.close()
+
+    def _counters(self):
+        with self.process.oneshot():
+            counters = {
+                "time": datetime.now(UTC).isoformat(),
+                "threads": threading.active_count(),
+                "native_threads": self.process.num_threads(),
+                "open_fds": self.process.num_fds(),
+                "rss_bytes": self.process.memory_info().rss,
+            }
+        self.stats["threads"] = counters["native_threads"]
+        self.stats["open_fds"] = counters["open_fds"]
+        return counters
+
+    def _profile(self, seconds):
+        try:
+            started = time.perf_counter()
+            stacks, rounds = StackSampler().run(seconds)
+            elapsed = time.perf_counter() - started
+
+            os.makedirs(self.path, exist_ok=True)
+            file_name = f"profile-{datetime.now(UTC).strftime('%Y%m%d-%H%M%S')}.folded"
+            with open(os.path.join(self.path, file_name), "w") as f:
+                for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                    f.write(f"{stack} {count}\n")
+            self._prune_profiles()
+
+            # Self time per function, the innermost frame of every sample
+            functions = {}
+            for stack, count in stacks.items():
+                function = stack.rsplit(";", 1)[-1]
+                functions[function] = functions.get(function, 0) + count
+            self.stats["profiles"] += 1
+            self._write({
+                "type": "profile", "time": datetime.now(UTC).isoformat(), "seconds": round(elapsed, 1),
+                "rounds": rounds, "samples": sum(stacks.values()), "file": file_name,
+                "top": sorted(functions.items(), key=lambda item: -item[1])[:self.top],
+            })
+            logger.warning(f"Profile of {sum(stacks.values())} samples written to {file_name}")
+        except Exception as e:
+            logger.error(f"Profiling failed: {e}")
+
+    def _prune_profiles(self):
+        profiles = sorted(entry for entry in os.listdir(self.path) if entry.startswith("profile-"))
+        for entry in profiles[:-self.backup_count or None]:
+            os.remove(os.path.join(self.path, entry))
+
+    def _write(self, record):
+        """Append a JSON line to the rotating output file"""
+        if self.output is None:
+            os.makedirs(self.path, exist_ok=True)
+            handler = file_handler(os.path.join(self.path, self.OUTPUT_FILE), self.max_bytes,
+                                   backup_count=self.backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            output = logging.getLogger("raspberry-iot.diagnostics")
+            output.propagate = False
+            output.setLevel(logging.INFO)
+            output.addHandler(handler)
+            self.output = output
+        self.output.info("%s", json.dumps(record, separators=(",", ":")))
+
+
+def _fold(thread_name, frame):
+    """Collapse a stack into "thread;outer;...;inner" with one module:function entry per frame"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
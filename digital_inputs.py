@@ -0,0 +1,230 @@
+import asyncio
+import threading
+import time
+
+from config import logger, INPUT_DEBOUNCE_MS, INPUT_GLITCH_MS, INPUT_PULL, INPUT_REPORT_INTERVAL
+from device_registry import DeviceType
+from instrumentation import INPUT_EDGE_SECONDS
+
+# Subtypes of sensor devices read over 1-Wire, their pin belongs to the w1-gpio driver
+ONE_WIRE_SUBTYPES = {"DS18B20"}
+
+PULLS = {"up": True, "down": False, "none": None}
+
+
+class DigitalInput:
+    """Debounced state of one input pin, only touched on the event loop
+
+    With a pull-up the input is active when pulled low (a contact closing to ground),
+    otherwise when high.
+    """
+
+    __slots__ = ("device_id", "gpio_pin", "pull_up", "debounce", "glitch", "level", "level_since", "active",
+                 "timer")
+
+    def __init__(self, device_id, gpio_pin, pull_up, debounce, glitch):
+        self.device_id = device_id
+        self.gpio_pin = gpio_pin
+        self.pull_up = pull_up
+        self.debounce = debounce
+        self.glitch = glitch
+        # Raw level of the last edge and when it was seen (perf_counter)
+        self.level = None
+        self.level_since = 0.0
+        self.active = None
+        # Pending debounce or glitch check, edges meanwhile only update the raw level
+        self.timer = None
+
+    @property
+    def config(self):
+        return self.gpio_pin, self.pull_up, self.debounce, self.glitch
+
+    def is_active(self, level):
+        return level != bool(self.pull_up)
+
+
+class DigitalInputs:
+    """Edge-triggered digital inputs (buttons, reed contacts, PIR sensors).
+
+    Edges are reported by the GPIO backend's interrupts and handed to the event loop
+    with their timestamp. A change is accepted on the leading edge, unless a glitch
+    filter requires the level to hold for `glitch` seconds first; edges within the
+    following `debounce` seconds are ignored and the level is checked again once it
+    ends. Accepted changes are passed to `on_change` right away and coalesced per
+    device for reporting, so a chattering contact costs at most one update per
+    device and report interval.
+    """
+
+    def __init__(self, gpio, on_change=None, on_report=None, report_interval=INPUT_REPORT_INTERVAL):
+        """Initialize the inputs
+
+        Args:
+            gpio: GPIOManager owning the backend
+            on_change: Non-blocking callback(device_id, active, timestamp) called on the event loop for every
+                accepted change, timestamp is the perf_counter() of the edge
+            on_report: Blocking callback(changes) getting device_id -> (active, timestamp, changes) of the
+                coalesced changes, run on the executor every `report_interval` seconds
+            report_interval: Seconds between two reports
+        """
+        self.gpio = gpio
+        self.on_change = on_change
+        self.on_report = on_report
+        self.report_interval = report_interval
+        self.loop = None
+        self.lock = threading.Lock()
+
+        # Key: device_id, Value: DigitalInput. Replaced as a whole, edge handlers look up by pin
+        self.inputs = {}
+        self.by_pin = {}
+        # Key: device_id, Value: (active, timestamp, changes) not reported yet
+        self.changed = {}
+
+        # Edges that were not accepted were filtered as bounces or glitches
+        self.stats = {"edges": 0, "accepted": 0, "reports": 0}
+
+    @staticmethod
+    def is_input(row):
+        """Whether a device row is a digital input, sensors with a 1-Wire address or subtype are not"""
+        return (
+            DeviceType.resolve(row.get("type")) is DeviceType.SENSOR
+            and bool(row.get("gpio_pin"))
+            and row.get("subtype") not in ONE_WIRE_SUBTYPES
+            and not row.get("sensor_id")
+        )
+
+    def start(self, loop):
+        """Attach to the event loop edges are handled on, must be called before sync()"""
+        self.loop = loop
+
+    async def run(self, executor):
+        """Hand the coalesced changes to `on_report` every `report_interval` seconds until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.report_interval)
+            if not self.changed or not self.on_report:
+                continue
+
+            changes, self.changed = self.changed, {}
+            self.stats["reports"] += 1
+            try:
+                await loop.run_in_executor(executor, self.on_report, changes)
+            except Exception as e:
+                logger.error(f"Failed to report {len(changes)} input changes: {e}")
+
+    def sync(self, rows):
+        """Watch the digital inputs among the device rows and release the ones that are gone or changed"""
+        if self.loop is None:
+            return
+
+        with self.lock:
+            inputs = dict(self.inputs)
+            wanted = {}
+            for row in rows:
+                if self.is_input(row):
+                    try:
+                        wanted[row["id"]] = self._configure(row)
+                    except (KeyError, TypeError, ValueError) as e:
+                        logger.error(f"Invalid input configuration of device {row.get('id')}: {e}")
+
+            for device_id, current in list(inputs.items()):
+                new = wanted.get(device_id)
+                if new is None or new.config != current.config:
+                    del inputs[device_id]
+                    self.gpio.unwatch_input(current.gpio_pin)
+                    logger.info(f"Stopped watching input {device_id} on GPIO {current.gpio_pin}")
+
+            for device_id, new in wanted.items():
+                if device_id in inputs:
+                    continue
+                try:
+                    level = self.gpio.watch_input(new.gpio_pin, self._on_edge_threadsafe, new.pull_up)
+                except Exception as e:
+                    logger.error(f"Failed to watch input {device_id} on GPIO {new.gpio_pin}: {e}")
+                    continue
+                self.loop.call_soon_threadsafe(self._initialize, new, level)
+                inputs[device_id] = new
+                logger.info(f"Watching input {device_id} on GPIO {new.gpio_pin}")
+
+            self.inputs = inputs
+            self.by_pin = {item.gpio_pin: item for item in inputs.values()}
+
+    def close(self):
+        """Stop watching every input"""
+        with self.lock:
+            for item in self.inputs.values():
+                if item.timer:
+                    item.timer.cancel()
+                self.gpio.unwatch_input(item.gpio_pin)
+            self.inputs = {}
+            self.by_pin = {}
+
+    def _configure(self, row):
+        """Build the input of a device row, input_* columns override the defaults"""
+        pull = row.get("input_pull") or INPUT_PULL
+        debounce = row.get("input_debounce_ms")
+        glitch = row.get("input_glitch_ms")
+        return DigitalInput(
+            row["id"],
+            int(row["gpio_pin"]),
+            PULLS[pull.lower()],
+            (INPUT_DEBOUNCE_MS if debounce is None else float(debounce)) / 1000,
+            (INPUT_GLITCH_MS if glitch is None else float(glitch)) / 1000,
+        )
+
+    def _initialize(self, item, level):
+        """Take the level read when the pin was set up as the initial state, without reporting it"""
+        if item.level is None:
+            item.level = level
+            item.level_since = time.perf_counter()
+            item.active = item.is_active(level)
+
+    def _on_edge_threadsafe(self, pin, level, timestamp):
+        """Edge callback of the backend, runs on a driver thread"""
+        self.loop.call_soon_threadsafe(self._on_edge, pin, level, timestamp)
+
+    def _on_edge(self, pin, level, timestamp):
+        item = self.by_pin.get(pin)
+        if item is None:
+            return
+
+        self.stats["edges"] += 1
+        item.level = level
+        item.level_since = timestamp
+        if item.active is None:
+            item.active = not item.is_active(level)
+
+        # A pending check looks at the final level once it runs
+        if item.timer is not None:
+            return
+        if item.glitch:
+            item.timer = self.loop.call_later(item.glitch, self._settle, item)
+        else:
+            self._settle(item)
+
+    def _settle(self, item):
+        """Accept the current level unless it is unchanged or hasn't held for the glitch filter yet"""
+        item.timer = None
+        if item.is_active(item.level) == item.active:
+            return
+
+        held = time.perf_counter() - item.level_since
+        if held < item.glitch:
+            item.timer = self.loop.call_later(item.glitch - held, self._settle, item)
+            return
+
+        active = item.active = item.is_active(item.level)
+        timestamp = item.level_since
+        self.stats["accepted"] += 1
+
+        _, _, changes = self.changed.get(item.device_id, (None, None, 0))
+        self.changed[item.device_id] = (active, timestamp, changes + 1)
+        if self.on_change:
+            try:
+                self.on_change(item.device_id, active, timestamp)
+            except Exception as e:
+                logger.error(f"Error handling input change of {item.device_id}: {e}")
+        INPUT_EDGE_SECONDS.observe(time.perf_counter() - timestamp)
+
+        # Bounces within the debounce time are ignored, the level is checked again afterwards
+        if item.debounce:
+            item.timer = self.loop.call_later(item.debounce, self._settle, item)
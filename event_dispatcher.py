@@ -0,0 +1,158 @@
+import asyncio
+import time
+from contextlib import nullcontext
+
+from config import logger, DISPATCH_MAX_PENDING, DISPATCH_WORKERS, DISPATCH_BATCH_SIZE
+from instrumentation import ACTUATION_SECONDS, DISPATCH_WAIT_SECONDS, ERRORS
+
+
+class EventDispatcher:
+    """Bounded, per-device coalescing dispatch stage between the realtime socket and the GPIO manager.
+
+    Only the latest pending event of each device is kept. Events of one device are
+    applied in order and never concurrently. A worker runs the blocking handler on an
+    executor, taking every event that is ready (up to `batch_size`) and applying them
+    inside one `batch` block, so a burst switches its pins in a single write. The
+    GPIOManager holds its batch lock for the whole block, so with a batch further
+    workers only wait for it; they run handlers in parallel without one.
+    """
+
+    def __init__(self, handler, executor=None, max_pending=DISPATCH_MAX_PENDING, workers=DISPATCH_WORKERS,
+                 batch=None, batch_size=DISPATCH_BATCH_SIZE):
+        """Initialize the dispatcher
+
+        Args:
+            handler: Blocking callback(event_type, device_data) applying an event
+            executor: Executor running the handler, the loop's default one if None
+            max_pending: Maximum number of devices with a pending event
+            workers: Number of workers applying events, serialized by the batch if there is one
+            batch: Context manager factory wrapping the events applied together, e.g. GPIOManager.batch
+            batch_size: Maximum number of events a worker applies together
+        """
+        self.handler = handler
+        self.executor = executor
+        self.max_pending = max_pending
+        self.workers = workers
+        self.batch = batch or nullcontext
+        self.batch_size = batch_size
+
+        # Key: device_id, Value: (event_type, device_data, received_at) waiting to be applied
+        self.pending = {}
+        # Devices currently being applied by a worker
+        self.in_flight = set()
+        # Devices whose pending event can be picked up, created in run() on the loop
+        self.ready = None
+
+        self.stats = {
+            "received": 0,
+            "applied": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "max_depth": 0,
+        }
+
+    @property
+    def depth(self):
+        """Number of devices with a pending event"""
+        return len(self.pending)
+
+    def is_pending(self, device_id):
+        """Whether an event of the device is waiting or being applied"""
+        return device_id in self.pending or device_id in self.in_flight
+
+    def submit(self, event_type, device_data, received_at=None):
+        """Queue an event without blocking, returns False when it had to be dropped
+
+        Must be called from the event loop thread. `received_at` is the perf_counter() time
+        the event arrived, used to measure the latency until it is applied.
+        """
+        self.stats["received"] += 1
+        device_id = device_data.get("id")
+        if received_at is None:
+            received_at = time.perf_counter()
+
+        if device_id in self.pending:
+            pending_type = self.pending[device_id][0]
+            # A device that is not created yet must still be registered with the latest row
+            if pending_type == "device_created" and event_type == "device_updated":
+                event_type = "device_created"
+            self.pending[device_id] = (event_type, device_data, received_at)
+            self.stats["coalesced"] += 1
+            return True
+
+        if len(self.pending) >= self.max_pending:
+            self.stats["dropped"] += 1
+            logger.warning(f"Dispatch queue full, dropping {event_type} of device {device_id}")
+            return False
+
+        self.pending[device_id] = (event_type, device_data, received_at)
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self.pending))
+
+        # A device already being applied is picked up again once its worker is done
+        if device_id not in self.in_flight and self.ready is not None:
+            self.ready.put_nowait(device_id)
+        return True
+
+    async def run(self):
+        """Apply queued events until cancelled"""
+        self.ready = asyncio.Queue()
+        for device_id in self.pending:
+            self.ready.put_nowait(device_id)
+
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            events = self._take(await self.ready.get())
+            while len(events) < self.batch_size and not self.ready.empty():
+                events.update(self._take(self.ready.get_nowait()))
+            if not events:
+                continue
+
+            self.in_flight.update(events)
+            try:
+                await loop.run_in_executor(self.executor, self._apply, events)
+            finally:
+                self.in_flight.difference_update(events)
+
+            # Newer events for the same devices arrived while these were applied
+            for device_id in events:
+                if device_id in self.pending:
+                    self.ready.put_nowait(device_id)
+
+    def _take(self, device_id):
+        event = self.pending.pop(device_id, None)
+        return {device_id: event} if event is not None else {}
+
+    def _apply(self, events):
+        """Apply events of different devices together, runs on the executor"""
+        self.stats["batches"] += 1
+        started = time.perf_counter()
+        try:
+            with self.batch():
+                for device_id, (event_type, device_data, received_at) in events.items():
+                    DISPATCH_WAIT_SECONDS.observe(started - received_at)
+                    try:
+                        self.handler(event_type, device_data)
+                        self.stats["applied"] += 1
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        ERRORS.labels("dispatch").inc()
+                        logger.error(f"Error applying {event_type} of device {device_id}: {e}")
+        except Exception as e:
+            ERRORS.labels("dispatch").inc()
+            logger.error(f"Error committing {len(events)} dispatched events: {e}")
+            return
+
+        # The batch is committed, so every pin of these events has been written
+        committed = time.perf_counter()
+        for _, _, received_at in events.values():
+            ACTUATION_SECONDS.observe(committed - received_at)
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from config import REALTIME_ECHO_TTL, DEVICE_SYNC_WATERMARK_COLUMN
+from device_registry import DeviceType
+
+# Columns set by every write, they never match between a write and its echo
+TIMESTAMP_FIELDS = {"last_updated", "last_seen", "updated_at", DEVICE_SYNC_WATERMARK_COLUMN}
+
+
+class EventFilter:
+    """Drop realtime device events that need no local work before they are dispatched.
+
+    Supabase sends every write of the controller back as an UPDATE. Written rows are
+    remembered by their values (time stamps left out) for `ttl` seconds and an UPDATE
+    carrying the same values is dropped as an echo. Other UPDATEs are dropped when
+    they change none of the fields the GPIO manager acts on: the pin, the type, and
+    the state and value of an output. Inserts and deletes always pass, as do events
+    of devices with an event still waiting to be applied.
+    """
+
+    def __init__(self, registry, is_pending=None, ttl=REALTIME_ECHO_TTL):
+        """Initialize the filter
+
+        Args:
+            registry: DeviceRegistry holding the applied state of the devices
+            is_pending: Predicate(device_id), true while an earlier event of the device is not applied yet
+            ttl: Seconds a write is expected to come back as an echo
+        """
+        self.registry = registry
+        self.is_pending = is_pending
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        # Key: device_id, Value: list of (expires_at, written fields), oldest first
+        self.writes = {}
+
+        self.stats = {"passed": 0, "echoes": 0, "unchanged": 0}
+
+    def remember(self, rows):
+        """Record device rows this controller is about to write (called right before the write)"""
+        now = time.monotonic()
+        expires_at = now + self.ttl
+        with self.lock:
+            for row in rows:
+                fields = {key: value for key, value in row.items() if key != "id" and key not in TIMESTAMP_FIELDS}
+                if fields:
+                    self.writes.setdefault(row["id"], []).append((expires_at, fields))
+
+            # Writes whose echo never came (e.g. filtered out by the subscription) are forgotten
+            for device_id in [device_id for device_id, writes in self.writes.items() if writes[-1][0] <= now]:
+                del self.writes[device_id]
+
+    def accept(self, event_type, record):
+        """Whether a realtime event has to be dispatched, called on the event loop for every device event"""
+        if event_type == "device_updated":
+            if self._is_echo(record):
+                self.stats["echoes"] += 1
+                return False
+            if not self._changes_device(record):
+                self.stats["unchanged"] += 1
+                return False
+
+        self.stats["passed"] += 1
+        return True
+
+    def _is_echo(self, record):
+        """Whether the record carries the values of a remembered write, which is consumed"""
+        device_id = record.get("id")
+        if device_id not in self.writes:
+            return False
+
+        now = time.monotonic()
+        with self.lock:
+            writes = self.writes.get(device_id, ())
+            for index, (expires_at, fields) in enumerate(writes):
+                if expires_at > now and all(record.get(key) == value for key, value in fields.items()):
+                    # Older writes were overwritten before their echo was seen
+                    del writes[:index + 1]
+                    if not writes:
+                        del self.writes[device_id]
+                    return True
+        return False
+
+    def _changes_device(self, record):
+        """Whether applying the record would change the registered device"""
+        device_id = record.get("id")
+        # The registry doesn't reflect the pending event yet, this one may undo it
+        if self.is_pending is not None and self.is_pending(device_id):
+            return True
+        known = self.registry.get(device_id)
+        if known is None:
+            return True
+        if record.get("gpio_pin") != known.gpio_pin or DeviceType.resolve(record.get("type")) is not known.device_type:
+            return True
+        if not known.is_output:
+            return False
+        return bool(record.get("is_active")) != bool(known.state) or record.get("value") != known.value
@@ -0,0 +1,252 @@
+import mmap
+import os
+import threading
+import time
+
+from config import logger, GPIO_BACKEND, ACTUATION_PROCESS
+
+
+class GPIOBackend:
+    """Driver interface used by the GPIOManager
+
+    Pins are BCM numbers, states are booleans. `apply` writes several output pins
+    at once and is the only write operation backends have to implement.
+    """
+
+    name = "base"
+
+    def setup_output(self, pin, state):
+        """Configure a pin as output driving the given initial state"""
+        raise NotImplementedError
+
+    def setup_input(self, pin, pull_up=None):
+        """Configure a pin as input, with pull-up (True), pull-down (False) or no pull (None)"""
+        raise NotImplementedError
+
+    def apply(self, states):
+        """Drive several output pins at once, `states` maps pin -> state"""
+        raise NotImplementedError
+
+    def write(self, pin, state):
+        """Drive a single output pin"""
+        self.apply({pin: state})
+
+    def read(self, pin):
+        """Read the level of a pin"""
+        raise NotImplementedError
+
+    def watch(self, pin, callback, pull_up=None):
+        """Configure a pin as input and report its edges through interrupts instead of polling
+
+        `callback(pin, level, timestamp)` is called from a driver thread on every edge, the
+        timestamp is the time.perf_counter() at which the edge was seen.
+        """
+        raise NotImplementedError
+
+    def unwatch(self, pin):
+        """Stop reporting the edges of a pin"""
+        raise NotImplementedError
+
+    def release(self, pin):
+        """Return a pin to its default (input) state"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the driver"""
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """RPi.GPIO driver, a batch is handed to the library in a single output call"""
+
+    name = "rpi"
+
+    def __init__(self):
+        # Imported here so the simulated backend runs on machines without RPi.GPIO
+        import RPi.GPIO as GPIO
+
+        self.GPIO = GPIO
+        # Set GPIO mode (BCM)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+    def setup_output(self, pin, state):
+        # Driving the initial level during setup avoids a glitch between setup and output
+        self.GPIO.setup(pin, self.GPIO.OUT, initial=self.GPIO.HIGH if state else self.GPIO.LOW)
+
+    def setup_input(self, pin, pull_up=None):
+        pull = {True: self.GPIO.PUD_UP, False: self.GPIO.PUD_DOWN, None: self.GPIO.PUD_OFF}[pull_up]
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=pull)
+
+    def apply(self, states):
+        if not states:
+            return
+        pins = list(states)
+        self.GPIO.output(pins, [self.GPIO.HIGH if states[pin] else self.GPIO.LOW for pin in pins])
+
+    def read(self, pin):
+        return bool(self.GPIO.input(pin))
+
+    def watch(self, pin, callback, pull_up=None):
+        GPIO = self.GPIO
+        self.setup_input(pin, pull_up)
+
+        def on_edge(channel):
+            timestamp = time.perf_counter()
+            callback(channel, bool(GPIO.input(channel)), timestamp)
+
+        # Debouncing is left to the caller, bouncetime would also swallow real edges
+        GPIO.add_event_detect(pin, GPIO.BOTH, callback=on_edge)
+
+    def unwatch(self, pin):
+        self.GPIO.remove_event_detect(pin)
+
+    def release(self, pin):
+        self.GPIO.cleanup(pin)
+
+
+class GPIOMemBackend(RPiGPIOBackend):
+    """Bank writes through the /dev/gpiomem registers of BCM283x/BCM2711 SoCs.
+
+    Pins are configured through RPi.GPIO, but a batch is applied with one write to
+    the set register and one to the clear register, so all pins of bank 0 (GPIO 0-31)
+    switch together instead of one after another. Not available on the Pi 5 (RP1).
+    """
+
+    name = "gpiomem"
+
+    GPSET0 = 0x1C
+    GPCLR0 = 0x28
+    GPLEV0 = 0x34
+    BANK_SIZE = 32
+
+    def __init__(self, path="/dev/gpiomem"):
+        super().__init__()
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self.registers = mmap.mmap(fd, 4096, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        # Peripheral registers need 32-bit accesses, index them as words
+        self.words = memoryview(self.registers).cast("I")
+
+    def apply(self, states):
+        set_mask = 0
+        clear_mask = 0
+        for pin, state in states.items():
+            if pin >= self.BANK_SIZE:
+                raise ValueError(f"GPIO {pin} is outside of bank 0")
+            if state:
+                set_mask |= 1 << pin
+            else:
+                clear_mask |= 1 << pin
+
+        if set_mask:
+            self.words[self.GPSET0 // 4] = set_mask
+        if clear_mask:
+            self.words[self.GPCLR0 // 4] = clear_mask
+
+    def read(self, pin):
+        return bool(self.words[self.GPLEV0 // 4] >> pin & 1)
+
+    def close(self):
+        self.words.release()
+        self.registers.close()
+
+
+class SimulatedGPIOBackend(GPIOBackend):
+    """In-memory GPIO so the controller can run and be benchmarked on any Linux machine"""
+
+    name = "sim"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Key: pin, Value: "out" or "in"
+        self.modes = {}
+        # Key: pin, Value: current level
+        self.levels = {}
+        # Key: pin, Value: edge callback of a watched input
+        self.watchers = {}
+        self.stats = {"setups": 0, "writes": 0, "pins_written": 0, "edges": 0}
+
+    def setup_output(self, pin, state):
+        with self.lock:
+            self.modes[pin] = "out"
+            self.levels[pin] = bool(state)
+            self.stats["setups"] += 1
+
+    def setup_input(self, pin, pull_up=None):
+        with self.lock:
+            self.modes[pin] = "in"
+            self.levels[pin] = bool(pull_up)
+            self.stats["setups"] += 1
+
+    def apply(self, states):
+        with self.lock:
+            for pin, state in states.items():
+                if self.modes.get(pin) != "out":
+                    raise RuntimeError(f"GPIO {pin} is not set up as output")
+                self.levels[pin] = bool(state)
+            self.stats["writes"] += 1
+            self.stats["pins_written"] += len(states)
+
+    def read(self, pin):
+        with self.lock:
+            return self.levels.get(pin, False)
+
+    def watch(self, pin, callback, pull_up=None):
+        self.setup_input(pin, pull_up)
+        with self.lock:
+            self.watchers[pin] = callback
+
+    def unwatch(self, pin):
+        with self.lock:
+            self.watchers.pop(pin, None)
+
+    def release(self, pin):
+        with self.lock:
+            self.modes.pop(pin, None)
+            self.levels.pop(pin, None)
+            self.watchers.pop(pin, None)
+
+    def set_input(self, pin, level):
+        """Change the level of a simulated input pin, an edge calls the pin's watcher like an interrupt would"""
+        timestamp = time.perf_counter()
+        level = bool(level)
+        with self.lock:
+            changed = self.levels.get(pin) != level
+            self.levels[pin] = level
+            callback = self.watchers.get(pin) if changed else None
+            if callback:
+                self.stats["edges"] += 1
+        if callback:
+            callback(pin, level, timestamp)
+
+
+BACKENDS = {
+    RPiGPIOBackend.name: RPiGPIOBackend,
+    GPIOMemBackend.name: GPIOMemBackend,
+    SimulatedGPIOBackend.name: SimulatedGPIOBackend,
+}
+
+
+def create_backend(name=GPIO_BACKEND, isolated=ACTUATION_PROCESS):
+    """Create the GPIO backend configured by name ("rpi", "gpiomem" or "sim")
+
+    Args:
+        name: Name of the backend
+        isolated: Run the backend in a dedicated actuation process
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown GPIO backend '{name}', expected one of {', '.join(BACKENDS)}")
+
+    if isolated:
+        # Imported here, the worker process creates its backend through this module
+        from actuation_process import ActuationProcessBackend
+
+        backend = ActuationProcessBackend(name)
+        logger.info(f"Using {name} GPIO backend in an actuation process")
+        return backend
+
+    backend = BACKENDS[name]()
+    logger.info(f"Using {name} GPIO backend")
+    return backend
@@ -1,48 +1,41 @@
-import RPi.GPIO as GPIO
-import logging
-from config import logger
+import threading
 import time
+from contextlib import contextmanager
+
+from config import logger
+from instrumentation import GPIO_WRITE_SECONDS
+from device_registry import DeviceRecord, DeviceRegistry, DeviceType, PinConflictError
+from gpio_backend import create_backend
 
 
 class GPIOManager:
-    def __init__(self):
-        # Set GPIO mode (BCM)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-
-        # Dictionary to store GPIO configuration for devices
-        # Key: device_id, Value: (gpio_pin, current_state)
-        self.devices = {}
-
-        # Dictionary to map device types in different languages to standard types
-        self.device_type_mapping = {
-            # English
-            "switch": "switch",
-            "light": "switch",
-            "relay": "switch",
-            "sensor": "sensor",
-            "temperature": "temperature",
-            "humidity": "humidity",
-            "thermostat": "thermostat",
-            # Slovak/Czech
-            "spínač": "switch",
-            "svetlo": "switch",
-            "relé": "switch",
-            "senzor": "sensor",
-            "teplota": "temperature",
-            "vlhkosť": "humidity",
-            "termostat": "thermostat",
-        }
+    def __init__(self, backend=None):
+        """Initialize the GPIO manager
+
+        Args:
+            backend: GPIOBackend driving the pins, the one configured by GPIO_BACKEND if None
+        """
+        self.backend = backend or create_backend()
+
+        # Pin states changed inside a batch, committed as one write when the batch ends
+        # Key: gpio_pin, Value: state
+        self.pending_states = {}
+        self.batch_depth = 0
+        self.batch_lock = threading.RLock()
+
+        # Registered devices indexed by id, pin and type
+        self.registry = DeviceRegistry()
 
         logger.info("GPIO Manager initialized")
 
+    @property
+    def devices(self):
+        """Read-only snapshot of the registered devices (device_id -> DeviceRecord)"""
+        return self.registry.snapshot()
+
     def get_standard_device_type(self, device_type):
         """Convert device type to standard type regardless of language"""
-        if not device_type:
-            return "unknown"
-
-        lowered_type = device_type.lower()
-        return self.device_type_mapping.get(lowered_type, "unknown")
+        return DeviceType.resolve(device_type).value
 
     def register_device(self, device_id, gpio_pin, device_type, initial_state=False, initial_value=None):
         """Register a device with its GPIO pin"""
@@ -54,29 +47,47 @@ class GPIOManager:
             gpio_pin = int(gpio_pin)
 
             # Standardize the device type
-            standard_type = self.get_standard_device_type(device_type)
+            standard_type = DeviceType.resolve(device_type)
 
-            if standard_type == "unknown":
+            if standard_type is DeviceType.UNKNOWN:
                 logger.error(f"Unknown device type '{device_type}' for device {device_id}")
                 return False
 
-            # Setup pin based on device type
-            if standard_type in ["switch"]:
-                GPIO.setup(gpio_pin, GPIO.OUT)
-                # Set initial state
-                GPIO.output(gpio_pin, GPIO.HIGH if initial_state else GPIO.LOW)
-                self.devices[device_id] = (gpio_pin, initial_state, standard_type, None)
-                logger.info(
-                    f"Registered output device {device_id} to GPIO {gpio_pin} with initial state {initial_state}")
-
-            elif standard_type in ["sensor", "temperature", "humidity", "thermostat"]:
+            if standard_type.is_output:
+                record = DeviceRecord(device_id, gpio_pin, standard_type, initial_state)
+            else:
                 # For sensors, we would need to implement specific reading logic
                 # For now, we'll just register them
-                self.devices[device_id] = (gpio_pin, None, standard_type, initial_value)
+                record = DeviceRecord(device_id, gpio_pin, standard_type, None, initial_value)
+
+            with self.batch_lock:
+                # Claim the pin before touching the hardware, the registry detects duplicate pins under its lock
+                previous = self.registry.add(record)
+                try:
+                    # Release the output pin the device is moving away from
+                    if previous is not None and previous.is_output and (
+                            not record.is_output or previous.gpio_pin != gpio_pin):
+                        self.pending_states.pop(previous.gpio_pin, None)
+                        self.backend.release(previous.gpio_pin)
+
+                    if record.is_output:
+                        # Set up with the initial state driven right away
+                        self.pending_states.pop(gpio_pin, None)
+                        self.backend.setup_output(gpio_pin, bool(initial_state))
+                except Exception:
+                    self.registry.remove(device_id)
+                    raise
+
+            if record.is_output:
+                logger.info(
+                    f"Registered output device {device_id} to GPIO {gpio_pin} with initial state {initial_state}")
+            else:
                 logger.info(f"Registered sensor device {device_id} to GPIO {gpio_pin}")
-
             return True
 
+        except PinConflictError as e:
+            logger.error(f"Cannot register device {device_id}: {e}")
+            return False
         except ValueError:
             logger.error(f"Invalid GPIO pin number for device {device_id}: {gpio_pin}")
             return False
@@ -84,10 +95,60 @@ class GPIOManager:
             logger.error(f"Error registering device {device_id} to GPIO {gpio_pin}: {e}")
             return False
 
-    def set_gpio_state(self, gpio_pin, state):
-        """Set GPIO pin state for output devices."""
-        GPIO.output(gpio_pin, GPIO.HIGH if state else GPIO.LOW)
+    def unregister_device(self, device_id):
+        """Forget a device and release its GPIO pin"""
+        record = self.registry.remove(device_id)
+        if record is None:
+            return False
+
+        gpio_pin = record.gpio_pin
+        try:
+            # Only outputs were set up by us, input pins may be shared (e.g. the 1-Wire bus)
+            if record.is_output:
+                with self.batch_lock:
+                    self.pending_states.pop(gpio_pin, None)
+                    self.backend.release(gpio_pin)
+        except Exception as e:
+            logger.error(f"Error releasing GPIO {gpio_pin} of device {device_id}: {e}")
+        logger.info(f"Unregistered device {device_id} from GPIO {gpio_pin}")
+        return True
 
+    def set_gpio_state(self, gpio_pin, state):
+        """Set GPIO pin state for output devices, deferred to the end of a running batch."""
+        with self.batch_lock:
+            if self.batch_depth:
+                self.pending_states[gpio_pin] = bool(state)
+            else:
+                started = time.perf_counter()
+                self.backend.write(gpio_pin, bool(state))
+                GPIO_WRITE_SECONDS.observe(time.perf_counter() - started)
+
+    @contextmanager
+    def batch(self):
+        """Group the pin changes made inside the block and commit them as one write
+
+        Other threads changing pins wait until the batch is committed.
+        """
+        with self.batch_lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if not self.batch_depth:
+                    self.commit()
+
+    def commit(self):
+        """Write the pending pin states at once"""
+        with self.batch_lock:
+            if not self.pending_states:
+                return
+
+            states, self.pending_states = self.pending_states, {}
+            started = time.perf_counter()
+            self.backend.apply(states)
+            GPIO_WRITE_SECONDS.observe(time.perf_counter() - started)
+            logger.debug("Committed %d pin states in one write", len(states))
 
     def update_device_state(self, device_id, state=None, value=None):
         """Update a device's GPIO state or value
@@ -97,21 +158,20 @@ class GPIOManager:
             state: ON/OFF state for output devices
             value: Value for sensors/thermostats
         """
-        if device_id not in self.devices:
+        record = self.registry.get(device_id)
+        if record is None:
             logger.warning(f"Device {device_id} not registered, cannot update state")
             return False
 
-        gpio_pin, current_state, device_type, current_value = self.devices[device_id]
-
         try:
-            if device_type.lower() in ["switch", "relay", "light"] and state is not None:
-                GPIO.output(gpio_pin, GPIO.HIGH if state else GPIO.LOW)
-                self.devices[device_id] = (gpio_pin, state, device_type, current_value)
-                logger.info(f"Updated device {device_id} on GPIO {gpio_pin} to {'ON' if state else 'OFF'}")
+            if record.is_output and state is not None:
+                self.set_gpio_state(record.gpio_pin, state)
+                self.registry.update(device_id, state=state)
+                logger.info("Updated device %s on GPIO %s to %s", device_id, record.gpio_pin, "ON" if state else "OFF")
 
             if value is not None:
-                self.devices[device_id] = (gpio_pin, current_state, device_type, value)
-                logger.info(f"Updated device {device_id} on GPIO {gpio_pin} to value {value}")
+                self.registry.update(device_id, value=value)
+                logger.info("Updated device %s on GPIO %s to value %s", device_id, record.gpio_pin, value)
 
             return True
 
@@ -119,8 +179,28 @@ class GPIOManager:
             logger.error(f"Error updating device {device_id}: {e}")
             return False
 
+    def watch_input(self, gpio_pin, callback, pull_up=None):
+        """Set up an input pin with edge detection, returns its current level
+
+        Args:
+            gpio_pin: BCM pin of the input
+            callback: Callable(pin, level, timestamp) called from a driver thread on every edge
+            pull_up: Pull-up (True), pull-down (False) or no pull resistor (None)
+        """
+        self.backend.watch(gpio_pin, callback, pull_up)
+        return self.backend.read(gpio_pin)
+
+    def unwatch_input(self, gpio_pin):
+        """Stop the edge detection of an input pin and release it"""
+        try:
+            self.backend.unwatch(gpio_pin)
+            self.backend.release(gpio_pin)
+        except Exception as e:
+            logger.error(f"Error releasing input GPIO {gpio_pin}: {e}")
+
     def cleanup(self):
         """Clean up GPIO resources for registered devices."""
-        for device_id, (gpio_pin, _, _, _) in self.devices.items():
-            GPIO.cleanup(gpio_pin)  # Clean specific GPIO pins
+        for record in self.registry.of_type(DeviceType.SWITCH).values():
+            self.backend.release(record.gpio_pin)  # Clean specific GPIO pins
+        self.backend.close()
         logger.info("GPIO cleanup completed")
@@ -0,0 +1,280 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import logger, METRICS_PORT, METRICS_HOST
+
+PREFIX = "raspberry_iot_"
+
+# Seconds, from sub-millisecond pin writes up to HTTP calls running into their timeout
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class HistogramValue:
+    """Bucket counts preallocated once, observing only increments existing slots"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """Metric family, one value per combination of label values.
+
+    The value of a label combination is created on first use and reused afterwards,
+    hot paths keep the value returned by `labels()` to skip the lookup. Metrics with
+    a `callback` hold no values, the callback is called when the metrics are scraped
+    and returns a number or a dict of label values tuple -> number.
+    Updates are not locked: a rare lost increment is cheaper than a lock per event.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), callback=None, registry=None):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.lock = threading.Lock()
+
+        # Key: tuple of label values, Value: CounterValue, GaugeValue or HistogramValue
+        self.values = {}
+        self.default = self.labels() if not self.labelnames and callback is None else None
+
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        """Get the value of a label combination, created on first use"""
+        value = self.values.get(values)
+        if value is None:
+            with self.lock:
+                value = self.values.setdefault(values, self._new_value())
+        return value
+
+    def samples(self):
+        """Get (suffix, label pairs, value) tuples of every sample of the family"""
+        if self.callback is not None:
+            result = self.callback()
+            items = result.items() if isinstance(result, dict) else [((), result)]
+            return [("", self._label_pairs(values), value) for values, value in items]
+
+        return [("", self._label_pairs(values), value.value) for values, value in list(self.values.items())]
+
+    def _label_pairs(self, values):
+        return list(zip(self.labelnames, values))
+
+    def _new_value(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_value(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_value(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.default.set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry=registry)
+
+    def _new_value(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def samples(self):
+        samples = []
+        for values, histogram in list(self.values.items()):
+            labels = self._label_pairs(values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                samples.append(("_bucket", labels + [("le", _format_number(bound))], cumulative))
+            samples.append(("_sum", labels, histogram.sum))
+            samples.append(("_count", labels, histogram.count))
+        return samples
+
+
+class Registry:
+    """Collection of metric families rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Key: metric name, Value: Metric. Registering a name again replaces the family
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """Get every metric in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"Failed to collect metric {metric.name}: {e}")
+                continue
+
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{name}="{_escape(label)}"' for name, label in labels)
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format_number(value)}"
+                             if label_text else f"{metric.name}{suffix} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+_process = None
+
+
+def _process_info():
+    """psutil handle of this process, imported on first scrape to keep it off the boot path"""
+    global _process
+    if _process is None:
+        import psutil
+        _process = psutil.Process()
+    return _process
+
+
+# Boot
+FIRST_ACTUATION_SECONDS = Gauge(
+    "boot_first_actuation_seconds", "Time from start until the pins of the boot snapshot were restored")
+
+# Supabase REST calls
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "Duration of Supabase REST calls", ("table", "operation"))
+HTTP_ERRORS = Counter("http_errors_total", "Failed Supabase REST calls", ("table", "operation"))
+
+# Realtime changes from the socket to the pin
+REALTIME_MESSAGES = Counter("realtime_messages_total", "Realtime messages received")
+REALTIME_DECODE_SECONDS = Histogram("realtime_decode_seconds", "Time spent decoding a realtime message")
+DISPATCH_WAIT_SECONDS = Histogram(
+    "dispatch_wait_seconds", "Time a realtime change waited in the dispatch queue before it was applied")
+ACTUATION_SECONDS = Histogram(
+    "realtime_to_actuation_seconds", "Time from receiving a realtime change until its pin write was committed")
+GPIO_WRITE_SECONDS = Histogram("gpio_write_seconds", "Duration of a (batched) pin write by the GPIO backend")
+ACTUATION_PROCESS_SECONDS = Histogram(
+    "actuation_process_delay_seconds", "Time from sending a command to the actuation process until it applied it")
+
+# 1-Wire sensors
+SENSOR_READ_SECONDS = Histogram("sensor_read_seconds", "Duration of a single DS18B20 read")
+
+# Local control API
+LOCAL_API_SECONDS = Histogram(
+    "local_api_request_seconds", "Time from reading a local API request until its response was written")
+
+# Digital inputs
+INPUT_EDGE_SECONDS = Histogram(
+    "input_edge_to_callback_seconds", "Time from an input edge until its debounced change reached the local callback")
+
+# Local rules
+RULE_EVAL_SECONDS = Histogram(
+    "rule_evaluation_seconds", "Time from handing sensor readings to the rule engine until its pin writes were committed")
+
+ERRORS = Counter("errors_total", "Errors by component", ("component",))
+
+# Process, collected when scraped
+Gauge("threads", "Number of running threads", callback=threading.active_count)
+Gauge("open_fds", "Number of open file descriptors", callback=lambda: _process_info().num_fds())
+Gauge("resident_memory_bytes", "Resident set size of the controller", callback=lambda: _process_info().memory_info().rss)
+Counter("cpu_seconds_total", "CPU time used by the controller", callback=lambda: sum(_process_info().cpu_times()[:2]))
+
+
+def start_server(port=METRICS_PORT, host=METRICS_HOST, registry=REGISTRY):
+    """Serve the metrics over HTTP at /metrics, returns the server or None when disabled (port 0)"""
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+
+            data = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.error(f"Failed to start metrics endpoint on {host}:{port}: {e}")
+        return None
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import mmap
+import os
+import socket
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    logger, LOCAL_API_SOCKET, LOCAL_API_SOCKET_MODE, LOCAL_API_STATE_PATH, LOCAL_API_STATE_SIZE,
+    LOCAL_API_PUBLISH_INTERVAL
+)
+from instrumentation import LOCAL_API_SECONDS
+
+# Magic, capacity, sequence (odd while a write is in progress), payload length and CRC-32 of the payload
+HEADER = struct.Struct("<4sIQII")
+SEQUENCE = struct.Struct("<Q")
+MAGIC = b"DEV1"
+
+
+class StateView:
+    """Device states in a shared-memory file, readable by other processes without any lock.
+
+    The JSON payload follows a seqlock header: the writer makes the sequence odd,
+    writes the payload, its length and checksum and makes the sequence even again.
+    Readers retry while the sequence is odd or changed during their copy, the
+    checksum also catches writes they saw out of order.
+    """
+
+    def __init__(self, path=LOCAL_API_STATE_PATH, size=LOCAL_API_STATE_SIZE):
+        self.path = path
+        self.capacity = size - HEADER.size
+        self.sequence = 0
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, 0, 0, 0)
+
+    def publish(self, payload):
+        """Replace the published states, returns False when they don't fit"""
+        data = json.dumps(payload, separators=(",", ":")).encode()
+        if len(data) > self.capacity:
+            logger.error(f"Device states ({len(data)} bytes) exceed LOCAL_API_STATE_SIZE, not published")
+            return False
+
+        SEQUENCE.pack_into(self.map, 8, self.sequence + 1)
+        self.map[HEADER.size:HEADER.size + len(data)] = data
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.sequence + 1, len(data), zlib.crc32(data))
+        self.sequence += 2
+        SEQUENCE.pack_into(self.map, 8, self.sequence)
+        return True
+
+    def close(self):
+        self.map.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class StateReader:
+    """Reader of a StateView for co-located processes, e.g. StateReader().read()["devices"]
+
+    The file is mapped again when the controller restarted and created a new one.
+    """
+
+    def __init__(self, path=LOCAL_API_STATE_PATH):
+        self.path = path
+        self.map = None
+        self.inode = None
+
+    def read(self, retries=1000):
+        """Get the latest published states, raises RuntimeError when no consistent copy could be taken"""
+        inode = os.stat(self.path).st_ino
+        if inode != self.inode:
+            self.close()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = inode
+
+        for _ in range(retries):
+            magic, _, sequence, length, checksum = HEADER.unpack_from(self.map)
+            if magic != MAGIC:
+                raise RuntimeError("not a device state file")
+            if sequence and not sequence & 1:
+                data = self.map[HEADER.size:HEADER.size + length]
+                if SEQUENCE.unpack_from(self.map, 8)[0] == sequence and zlib.crc32(data) == checksum:
+                    return json.loads(data)
+            time.sleep(0)
+        raise RuntimeError("device states kept changing while being read")
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class LocalAPIServer:
+    """Control API for processes on the same Pi, without the round trip through Supabase.
+
+    Clients send one JSON object per line over a Unix socket and get one line back:
+
+        {"op": "set", "device_id": "...", "state": true}  ->  {"ok": true, "device": {...}}
+
+    Operations are "list", "get" and "set" (state and/or value). Commands go through
+    the GPIO manager on a thread of their own, so they never queue behind HTTP
+    calls, and changes are handed to `on_change` to be synced to Supabase later.
+    Reads don't need the socket: the device states are published to a StateView.
+    """
+
+    def __init__(self, gpio, on_change=None, socket_path=LOCAL_API_SOCKET, state_path=LOCAL_API_STATE_PATH,
+                 publish_interval=LOCAL_API_PUBLISH_INTERVAL):
+        """Initialize the server, started by run()
+
+        Args:
+            gpio: GPIOManager applying the commands
+            on_change: Blocking callback(device_id, state, value) called after a command changed a device
+            socket_path: Path of the Unix socket
+            state_path: Path of the shared-memory state file, None to not publish the states
+            publish_interval: Seconds between two checks of the registry for changes to publish
+        """
+        self.gpio = gpio
+        self.on_change = on_change
+        self.socket_path = socket_path
+        self.state_path = state_path
+        self.publish_interval = publish_interval
+
+        self.view = None
+        self.server = None
+        self.published_version = None
+        # One thread, commands of all clients are applied in the order they arrive
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-api")
+
+        self.stats = {"connections": 0, "requests": 0, "errors": 0, "publishes": 0}
+
+    async def run(self):
+        """Serve clients and publish registry changes until cancelled"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = await asyncio.start_unix_server(self._serve, self.socket_path)
+        os.chmod(self.socket_path, LOCAL_API_SOCKET_MODE)
+        if self.state_path:
+            self.view = StateView(self.state_path)
+        logger.info(f"Local API listening on {self.socket_path}")
+
+        try:
+            while True:
+                self.publish()
+                await asyncio.sleep(self.publish_interval)
+        finally:
+            self.close()
+
+    def publish(self):
+        """Publish the device states when the registry changed since the last publish"""
+        registry = self.gpio.registry
+        if self.view is None or registry.version == self.published_version:
+            return
+        version = registry.version
+        if self.view.publish({"version": version, "devices": _devices(registry.snapshot())}):
+            self.published_version = version
+            self.stats["publishes"] += 1
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+        if self.view is not None:
+            self.view.close()
+            self.view = None
+        self.executor.shutdown(wait=False)
+
+    async def _serve(self, reader, writer):
+        self.stats["connections"] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                started = time.perf_counter()
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("a request must be a JSON object")
+                    response = await loop.run_in_executor(self.executor, self._handle, request)
+                    # Published before answering, so the client reads its own change from the state view
+                    if request.get("op") == "set":
+                        self.publish()
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    response = {"ok": False, "error": str(e)}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+
+                writer.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+                await writer.drain()
+                LOCAL_API_SECONDS.observe(time.perf_counter() - started)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.warning(f"Local API connection closed: {e}")
+        finally:
+            writer.close()
+
+    def _handle(self, request):
+        """Run one request, runs on the API thread"""
+        self.stats["requests"] += 1
+        op = request.get("op")
+        registry = self.gpio.registry
+
+        if op == "list":
+            return {"ok": True, "version": registry.version, "devices": _devices(registry.snapshot())}
+
+        device_id = request.get("device_id")
+        record = registry.get(device_id)
+        if record is None:
+            raise ValueError(f"device {device_id} is not registered")
+
+        if op == "set":
+            state = request.get("state")
+            value = request.get("value")
+            if state is not None and not record.is_output:
+                raise ValueError(f"device {device_id} is not an output")
+            if state is None and value is None:
+                raise ValueError("set needs a state or a value")
+            if not self.gpio.update_device_state(device_id, None if state is None else bool(state), value):
+                raise RuntimeError(f"failed to update device {device_id}")
+            record = registry.get(device_id)
+            if self.on_change:
+                self.on_change(device_id, None if state is None else bool(state), value)
+        elif op != "get":
+            raise ValueError(f"unknown op {op!r}")
+
+        return {"ok": True, "device": _device(record)}
+
+
+class LocalClient:
+    """Blocking client of the local API, e.g. LocalClient().request("set", device_id="...", state=True)"""
+
+    def __init__(self, socket_path=LOCAL_API_SOCKET, timeout=5):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socket_path)
+        self.reader = self.socket.makefile("rb")
+
+    def request(self, op, **params):
+        """Send a request and return its response, raises RuntimeError with the error of a failed one"""
+        self.socket.sendall(json.dumps({"op": op, **params}).encode() + b"\n")
+        response = json.loads(self.reader.readline())
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error"))
+        return response
+
+    def close(self):
+        self.reader.close()
+        self.socket.close()
+
+
+def _device(record):
+    return {"id": record.device_id, "type": record.device_type.value, "gpio_pin": record.gpio_pin,
+            "state": record.state, "value": record.value}
+
+
+def _devices(snapshot):
+    return {device_id: _device(record) for device_id, record in snapshot.items()}
@@ -0,0 +1,145 @@
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+
+class RateLimitFilter(logging.Filter):
+    """Let each call site log at most `burst` records per `interval` seconds.
+
+    Keyed by source line rather than message, so a reconnect storm logging a new
+    error text every time is still limited. The first record of the next window
+    carries the number of records suppressed in between.
+    """
+
+    def __init__(self, burst, interval):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.lock = threading.Lock()
+        # Key: (pathname, lineno), Value: [window start, records passed, records suppressed]
+        self.sites = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or record.created - site[0] >= self.interval:
+                skipped = site[2] if site else 0
+                self.sites[key] = [record.created, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                skipped = 0
+            else:
+                site[2] += 1
+                self.suppressed += 1
+                return False
+
+        if skipped:
+            record.msg = f"{record.getMessage()} ({skipped} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue records for the writer thread without ever blocking the logging thread
+
+    Only the message arguments are merged on the calling thread; time stamps,
+    tracebacks and the write itself are left to the writer. Records are dropped
+    when the queue is full.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.queued = 0
+        self.dropped = 0
+
+    def handle(self, record):
+        # The queue is thread-safe, the handler lock is not needed
+        if self.filter(record):
+            self.enqueue(self.prepare(record))
+            return True
+        return False
+
+    def prepare(self, record):
+        # Arguments may change once the call returns, the formatted line may not
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Logging off the calling threads.
+
+    Loggers hand their records to a bounded queue; a single writer thread formats
+    them and writes them to the handlers (log file, console). A log call on the
+    websocket reader or GPIO path costs a rate limit check and a queue put.
+    """
+
+    def __init__(self, handlers, queue_size=10000, rate_limit_burst=0, rate_limit_interval=60):
+        """Initialize the pipeline
+
+        Args:
+            handlers: Handlers written by the writer thread, their levels are respected
+            queue_size: Records waiting for the writer, further records are dropped
+            rate_limit_burst: Records per call site and `rate_limit_interval`, 0 disables the limit
+            rate_limit_interval: Seconds of a rate limit window
+        """
+        self.handler = NonBlockingQueueHandler(queue_size)
+        self.rate_limit = RateLimitFilter(rate_limit_burst, rate_limit_interval) if rate_limit_burst else None
+        if self.rate_limit:
+            self.handler.addFilter(self.rate_limit)
+        self.listener = QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.running = False
+
+    @property
+    def stats(self):
+        return {
+            "queued": self.handler.queued,
+            "dropped": self.handler.dropped,
+            "suppressed": self.rate_limit.suppressed if self.rate_limit else 0,
+        }
+
+    def start(self):
+        """Start the writer thread, records queued at exit are written before the process ends"""
+        if not self.running:
+            self.listener.start()
+            self.running = True
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Write the queued records and stop the writer thread"""
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+
+def file_handler(path, max_bytes=0, when="", backup_count=5, compress=True):
+    """Log file rotated by time when `when` is set (e.g. "midnight"), else by size, with gzipped backups"""
+    if when:
+        handler = TimedRotatingFileHandler(path, when=when, backupCount=backup_count, delay=True)
+    else:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    if compress:
+        handler.namer = lambda name: f"{name}.gz"
+        handler.rotator = _compress
+    return handler
+
+
+def _compress(source, destination):
+    """Rotate a log file into a gzipped backup (runs on the writer thread)"""
+    with open(source, "rb") as f_in, gzip.open(destination, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
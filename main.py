@@ -1,90 +1,367 @@
 import time
+
+# Time to first actuation is measured from here, before anything else is imported
+STARTED = time.monotonic()
+
+import asyncio
 import signal
-import sys
-import schedule
-import logging
-import RPi.GPIO as GPIO
+from concurrent.futures import ThreadPoolExecutor
 
-from config import logger
-from supabase_client import SupabaseManager
+import instrumentation
+from boot_snapshot import BootSnapshot
+from config import (
+    logger, log_pipeline, DEVICE_SYNC_INTERVAL, SENSOR_SAMPLE_INTERVAL, KEEP_ALIVE_INTERVAL, RUNTIME_WORKERS, BOOT_SNAPSHOT_INTERVAL,
+    TIMESERIES_PATH, TIMESERIES_TABLE, TIMESERIES_UPLOAD_INTERVAL, DIAGNOSTICS_ENABLED, LOCAL_API_SOCKET
+)
+from instrumentation import Counter, Gauge, FIRST_ACTUATION_SECONDS
 from gpio_manager import GPIOManager
-from system_monitor import SystemMonitor
-from realtime_manager import RealtimeManager
 
 
 class RaspberryPiController:
     def __init__(self):
         logger.info("Initializing Raspberry Pi Controller")
 
-        self.supabase = SupabaseManager()
+        # Drive the pins to their last known states before anything touches the network
         self.gpio = GPIOManager()
-        self.system = SystemMonitor()
+        self.boot_snapshot = BootSnapshot()
+        restored = self.restore_pins()
+
+        # Imported only after the pins are restored, loading the HTTP and websocket clients, psutil and
+        # SQLite takes a while on a Pi Zero
+        from device_sync import DeviceSync
+        from diagnostics import Diagnostics
+        from digital_inputs import DigitalInputs
+        from event_dispatcher import EventDispatcher
+        from event_filter import EventFilter
+        from local_api import LocalAPIServer
+        from realtime_manager import RealtimeManager
+        from rule_engine import RuleEngine
+        from sensor_sampler import DS18B20Sampler
+        from supabase_client import SupabaseManager
+        from system_monitor import SystemMonitor
+        from timeseries_store import TimeSeriesStore
+
+        # Local history of sensor readings and system metrics, uploaded as rollups
+        self.history = TimeSeriesStore() if TIMESERIES_PATH else None
+
+        self.system = SystemMonitor(history=self.history)
+        self.supabase = SupabaseManager(self.system)
+        self.device_sync = DeviceSync(self.supabase, self.gpio)
+        self.sensors = DS18B20Sampler()
+
+        # Edge-triggered digital inputs, changes are reported in coalesced batches
+        self.inputs = DigitalInputs(self.gpio, self.handle_input, self.report_inputs)
+
+        # Local closed-loop control, actions are reported through the telemetry queue
+        self.rules = RuleEngine(self.gpio, self.report_rule_action)
+        # The rules of the boot snapshot run until the first sync brings the current ones
+        if self.boot_snapshot.rules:
+            self.rules.load(self.boot_snapshot.rules)
+
+        # The first sync only touches what changed while we were offline
+        self.device_sync.restore(restored)
+        self.record_owners(restored)
+        self.snapshot_version = self._snapshot_version()
+
+        # Small pool for blocking work (HTTP, GPIO, 1-Wire), everything else runs on the event loop
+        self.executor = ThreadPoolExecutor(max_workers=RUNTIME_WORKERS, thread_name_prefix="io")
 
         # Flag to control main loop
         self.running = False
+        self.stop_event = None
+
+        # Realtime events are coalesced per device and applied off the socket reader
+        self.dispatcher = EventDispatcher(self.handle_device_update, self.executor, batch=self.gpio.batch)
+
+        # Echoes of our own writes and events changing nothing are dropped before dispatch
+        self.event_filter = EventFilter(self.gpio.registry, self.dispatcher.is_pending)
+        self.supabase.on_device_write = self.event_filter.remember
 
         # Initialize realtime listener with callback
-        self.realtime = RealtimeManager(self.handle_device_update)
+        self.realtime = RealtimeManager(self.dispatcher.submit, self.catch_up, self.event_filter.accept)
+        self.catch_up_task = None
 
-        # Set up signal handlers for graceful shutdown
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+        # Commands of co-located processes, synced to Supabase through the telemetry queue
+        self.local_api = LocalAPIServer(self.gpio, self.report_local_change) if LOCAL_API_SOCKET else None
+
+        # Leak and hot spot hunting, enabled by DIAGNOSTICS_ENABLED or SIGUSR1, profiles on SIGUSR2
+        self.diagnostics = Diagnostics()
+
+        # Opt-in metrics endpoint (METRICS_PORT), started with the event loop
+        self.metrics_server = None
+        self._register_metrics()
 
         logger.info("Controller initialized")
 
     def start(self):
         """Start the controller"""
+        asyncio.run(self.run())
+
+    async def run(self):
+        """Run local control, sensor sampling and telemetry right away and the Supabase connection in the background"""
         logger.info("Starting controller")
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
 
-        # Connect to Supabase
-        if not self.supabase.connect():
-            logger.error("Failed to connect to Supabase, retrying in 10 seconds")
-            time.sleep(10)
-            return self.start()
+        # Set up signal handlers for graceful shutdown
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.signal_handler, sig)
+        loop.add_signal_handler(signal.SIGUSR1, self.diagnostics.toggle)
+        loop.add_signal_handler(signal.SIGUSR2, self.diagnostics.profile)
+        if DIAGNOSTICS_ENABLED:
+            self.diagnostics.enable()
 
-        # Fetch and register devices
-        self.register_devices()
+        self.metrics_server = instrumentation.start_server()
+        self.inputs.start(loop)
 
-        # Schedule periodic tasks
-        schedule.every(5).minutes.do(self.register_devices)  # Re-sync devices periodically
+        try:
+            # Local control works from the restored devices and rules on, Supabase is reached in the background
+            await self._run_blocking(self.inputs.sync, self.device_sync.get_devices())
 
-        # Start realtime listener for immediate updates
-        self.realtime.start()
+            tasks = [
+                asyncio.create_task(self.connect(), name="connect"),
+                asyncio.create_task(self.dispatcher.run(), name="dispatcher"),
+                asyncio.create_task(self.supabase.telemetry.run_async(self.executor), name="telemetry"),
+                # Sweep all DS18B20 probes at once
+                asyncio.create_task(self._every(SENSOR_SAMPLE_INTERVAL, self.sample_sensors), name="sensors"),
+                asyncio.create_task(self.system.run(), name="metrics-sampler"),
+                asyncio.create_task(self.inputs.run(self.executor), name="inputs"),
+                asyncio.create_task(self.diagnostics.run(self.executor), name="diagnostics"),
+                asyncio.create_task(self._every(BOOT_SNAPSHOT_INTERVAL, self.save_snapshot), name="boot-snapshot"),
+            ]
+            if self.local_api is not None:
+                tasks.append(asyncio.create_task(self.local_api.run(), name="local-api"))
+            if self.history is not None:
+                tasks.append(asyncio.create_task(
+                    self._every(TIMESERIES_UPLOAD_INTERVAL, self.maintain_history), name="history"))
 
-        # Main loop
-        self.running = True
-        logger.info("Controller started")
+            self.running = True
+            logger.info("Controller started")
+
+            try:
+                await self.stop_event.wait()
+            finally:
+                self.running = False
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
 
-        try:
-            while self.running:
-                schedule.run_pending()
-                time.sleep(1)
         except Exception as e:
             logger.error(f"Error in main loop: {e}")
         finally:
-            self.cleanup()
+            await self._run_blocking(self.cleanup)
+            self.executor.shutdown()
+
+    async def connect(self):
+        """Connect to Supabase, then run the device sync, realtime and keep-alive until cancelled"""
+        while not await self._run_blocking(self.supabase.connect):
+            logger.error("Failed to connect to Supabase, retrying in 10 seconds")
+            await asyncio.sleep(10)
+
+        await asyncio.gather(
+            # The first sync fetches every device right away, later ones the changes every DEVICE_SYNC_INTERVAL
+            self._every(DEVICE_SYNC_INTERVAL, self.register_devices, now=True),
+            self.realtime.run(),
+            self._every(KEEP_ALIVE_INTERVAL, self.supabase.keep_alive),
+        )
+
+    def _register_metrics(self):
+        """Expose the stats the components already keep, read only when the metrics are scraped"""
+        Gauge("registered_devices", "Devices registered with the GPIO manager",
+              callback=lambda: len(self.gpio.registry))
+        Gauge("dispatch_queue_depth", "Devices with a pending realtime event",
+              callback=lambda: self.dispatcher.depth)
+        Counter("dispatch_events_total", "Realtime events by outcome", ("outcome",), callback=lambda: {
+            (outcome,): self.dispatcher.stats[outcome]
+            for outcome in ("received", "applied", "coalesced", "dropped", "failed")
+        })
+        Counter("realtime_device_events_total", "Realtime device events dispatched or suppressed as echo or unchanged",
+                ("outcome",), callback=lambda: {
+                    ("dispatched",): self.event_filter.stats["passed"],
+                    ("echo",): self.event_filter.stats["echoes"],
+                    ("unchanged",): self.event_filter.stats["unchanged"],
+                })
+        Gauge("telemetry_pending", "Devices with telemetry waiting to be flushed",
+              callback=lambda: len(self.supabase.telemetry.pending))
+        Gauge("outbox_entries", "Undelivered writes kept in the outbox",
+              callback=lambda: len(self.supabase.outbox))
+        Counter("outbox_quarantined_total", "Writes rejected by Supabase for good and moved to the outbox quarantine",
+                callback=lambda: self.supabase.outbox.stats["quarantined"])
+        Gauge("realtime_subscribed", "Whether the realtime subscription is active",
+              callback=lambda: self.realtime.subscribed)
+        Counter("realtime_connection_events_total", "Realtime connects, reconnects, failures and heartbeat timeouts",
+                ("event",), callback=lambda: {
+                    (event,): self.realtime.stats[event]
+                    for event in ("connects", "reconnects", "failed_attempts", "heartbeat_timeouts", "rejoins")
+                })
+        Counter("input_edges_total", "Digital input edges, accepted or filtered by debounce and glitch filters",
+                ("outcome",), callback=lambda: {
+                    ("accepted",): self.inputs.stats["accepted"],
+                    ("filtered",): max(0, self.inputs.stats["edges"] - self.inputs.stats["accepted"]),
+                })
+        Counter("log_records_total", "Log records written, dropped on a full queue or suppressed by the rate limit",
+                ("outcome",), callback=lambda: {
+                    ("written",): log_pipeline.stats["queued"],
+                    ("dropped",): log_pipeline.stats["dropped"],
+                    ("suppressed",): log_pipeline.stats["suppressed"],
+                })
+        if self.local_api is not None:
+            Counter("local_api_requests_total", "Local API requests by outcome", ("outcome",), callback=lambda: {
+                ("ok",): self.local_api.stats["requests"] - self.local_api.stats["errors"],
+                ("error",): self.local_api.stats["errors"],
+            })
+        Gauge("rules", "Loaded local rules", callback=lambda: self.rules.stats["rules"])
+        Counter("rule_actions_total", "Devices switched by local rules by outcome", ("outcome",), callback=lambda: {
+            ("applied",): self.rules.stats["actions"], ("failed",): self.rules.stats["failed_actions"]
+        })
+        if self.history is not None:
+            Counter("history_points_total", "Points appended to the local time-series history",
+                    callback=lambda: self.history.stats["appended"])
+            Counter("history_rollups_uploaded_total", "Time-series rollups uploaded",
+                    callback=lambda: self.history.stats["rows_uploaded"])
+        Counter("reports_total", "Sensor and metrics reports by reporting policy decision", ("policy", "decision"),
+                callback=lambda: {
+                    (name, decision): policy.stats[decision]
+                    for name, policy in (
+                        ("sensors", self.supabase.sensor_policy), ("metrics", self.supabase.metrics_policy))
+                    for decision in ("sent", "suppressed")
+                })
+
+    async def _run_blocking(self, func, *args):
+        """Run a blocking call on the I/O executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _every(self, interval, func, now=False):
+        """Run a blocking function every `interval` seconds until cancelled"""
+        if not now:
+            await asyncio.sleep(interval)
+
+        while True:
+            try:
+                await self._run_blocking(func)
+            except Exception as e:
+                logger.error(f"Error in periodic task {func.__name__}: {e}")
+            await asyncio.sleep(interval)
 
     def register_devices(self):
-        """Fetch devices from Supabase and register them with GPIO manager"""
-        devices = self.supabase.get_devices()
-        logger.info(f"Found {len(devices)} devices for this control unit")
-
-        for device in devices:
-            if not device.get('gpio_pin'):
-                logger.warning(f"Device {device['id']} ({device['name']}) has no GPIO pin assigned, skipping")
-                continue
-
-            # Register with GPIO manager
-            self.gpio.register_device(
-                device['id'],
-                device['gpio_pin'],
-                device['type'],
-                device.get('is_active', False),
-                device.get('value')
-            )
+        """Sync changed devices from Supabase and apply them to the GPIO manager"""
+        # The first sync after start fetches every device, later ones only the changes
+        stats = self.device_sync.sync(full=self.device_sync.stats["syncs"] == 0)
+        if stats is None:
+            logger.warning("Device sync failed, keeping the current device configuration")
+            return False
 
+        logger.info(f"Found {len(self.device_sync.snapshot)} devices for this control unit")
+        devices = self.device_sync.get_devices()
+        self.inputs.sync(devices)
+        self.record_owners(devices)
+
+        rules = self.supabase.get_rules()
+        if rules is not None:
+            self.rules.load(rules)
+        return True
+
+    def restore_pins(self):
+        """Register the devices of the boot snapshot with their last known states, returns the restored rows"""
+        rows = self.boot_snapshot.load()
+        if not rows:
+            logger.info("No boot snapshot, pins stay untouched until the first sync")
+            return []
+
+        # All restored output states are written at once
+        with self.gpio.batch():
+            for row in rows:
+                if row.get("gpio_pin"):
+                    self.gpio.register_device(
+                        row["id"], row["gpio_pin"], row.get("type"), row.get("is_active", False), row.get("value")
+                    )
+
+        elapsed = time.monotonic() - STARTED
+        FIRST_ACTUATION_SECONDS.set(elapsed)
+        logger.info(f"Restored {len(self.gpio.devices)} devices from the boot snapshot, "
+                    f"first actuation {elapsed * 1000:.1f} ms after start")
+        return rows
+
+    def save_snapshot(self):
+        """Persist the known devices and rules for the next boot when they changed since the last save
+
+        Every committed change of a device or output state counts, whether it came from Supabase, a rule
+        or the local API, and the registered state and value win over the synced rows. Input edges alone
+        don't make the snapshot dirty, they would rewrite it on every press.
+        """
+        version = self._snapshot_version()
+        if version == self.snapshot_version:
+            return
+
+        records = self.gpio.devices
+        rows = []
+        for row in self.device_sync.get_devices():
+            record = records.get(row["id"])
+            if record is not None:
+                row = dict(row)
+                if record.state is not None:
+                    row["is_active"] = record.state
+                if record.value is not None:
+                    row["value"] = record.value
+            rows.append(row)
+
+        self.boot_snapshot.save(rows, self.rules.rows())
+        self.snapshot_version = version
+        logger.debug("Saved boot snapshot v%s.%s (%d bytes)", *version, self.boot_snapshot.stats["last_size"])
+
+    def _snapshot_version(self):
+        """Get the version of what the boot snapshot follows: devices, their values, output states and rules"""
+        registry = self.gpio.registry
+        return registry.version - registry.input_state_updates, self.rules.version
+
+    def catch_up(self):
+        """Resync the devices changed while the realtime connection was down (called on the event loop)"""
+        if self.catch_up_task is None or self.catch_up_task.done():
+            self.catch_up_task = asyncio.create_task(self._run_blocking(self.register_devices))
+
+    def sample_sensors(self):
+        """Sample the DS18B20 sensors of the known devices and report their readings"""
+        self.supabase.check_and_send_sensor_data(self.device_sync.get_devices(), self.sensors, self.handle_readings)
         return True
 
+    def handle_readings(self, readings):
+        """Run the local rules on fresh sensor readings and keep the readings in the history"""
+        self.rules.evaluate(readings)
+        if self.history is not None:
+            self.history.append_many(readings)
+
+    def record_owners(self, devices):
+        """Keep the control unit of each device with its history, rollups are uploaded under it"""
+        if self.history is not None:
+            self.history.set_owners({row["id"]: row["controller_id"] for row in devices if row.get("controller_id")})
+
+    def maintain_history(self):
+        """Drop history past the retention and upload the rollups not uploaded yet"""
+        self.history.maintain()
+        if TIMESERIES_TABLE:
+            self.history.upload(self.supabase.upload_history)
+
+    def handle_input(self, device_id, active, timestamp):
+        """Record the debounced state of a digital input (called on the event loop)"""
+        if device_id in self.gpio.registry:
+            self.gpio.registry.update(device_id, state=active)
+
+    def report_inputs(self, changes):
+        """Report the coalesced input changes and keep them in the history"""
+        self.supabase.report_inputs(changes)
+        if self.history is not None:
+            offset = time.time() - time.perf_counter()
+            for device_id, (active, timestamp, _) in changes.items():
+                self.history.append(device_id, float(active), timestamp + offset)
+
+    def report_local_change(self, device_id, state, value):
+        """Sync a change made through the local API back to Supabase"""
+        self.supabase.report_device_state(device_id, state, value)
+
+    def report_rule_action(self, device_id, state, rule_id, value):
+        """Report a device switched by a local rule, the pin is already written"""
+        self.supabase.report_device_state(device_id, state)
+
     def handle_device_update(self, event_type, device_data):
         """Handle realtime device updates"""
         device_id = device_data.get('id')
@@ -110,14 +387,19 @@ class RaspberryPiController:
             )
 
         elif event_type == 'device_deleted':
-            # Device deleted, we might want to clean up
-            # For now, just log it
+            # Device deleted, release its pin
+            self.gpio.unregister_device(device_id)
             logger.info(f"Device {device_id} has been deleted")
 
-    def signal_handler(self, sig, frame):
+        self.device_sync.note_realtime(event_type, device_data)
+        if event_type != 'device_updated':
+            self.inputs.sync(self.device_sync.get_devices())
+
+    def signal_handler(self, sig):
         """Handle termination signals"""
         logger.info(f"Received signal {sig}, shutting down")
         self.running = False
+        self.stop_event.set()
 
     def cleanup(self):
         """Clean up resources"""
@@ -126,12 +408,32 @@ class RaspberryPiController:
         # Stop realtime listener
         self.realtime.stop()
 
+        # Keep the latest states for the next boot
+        try:
+            self.save_snapshot()
+        except Exception as e:
+            logger.error(f"Failed to save boot snapshot: {e}")
+
         # Set control unit to offline
         self.supabase.disconnect()
 
+        # Stop sensor sampling threads
+        self.sensors.close()
+
+        # Stop the edge detection of the inputs
+        self.inputs.close()
+
+        if self.history is not None:
+            self.history.close()
+
         # Clean up GPIO
         self.gpio.cleanup()
 
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+
+        self.diagnostics.close()
+
         logger.info("Shutdown complete")
 
 
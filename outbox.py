@@ -0,0 +1,204 @@
+import json
+import sqlite3
+import threading
+import time
+
+from config import (
+    logger, OUTBOX_PATH, OUTBOX_MAX_ENTRIES, OUTBOX_SYNC_INTERVAL, OUTBOX_REPLAY_BATCH_SIZE, OUTBOX_REPLAY_RATE
+)
+from postgrest_client import is_retryable
+
+
+class Outbox:
+    """Durable append-only outbox for writes that could not be delivered.
+
+    Entries are kept in memory and written to a SQLite database in WAL mode in one
+    transaction every `sync_interval` seconds, so the SD card sees one fsync per
+    interval instead of one per reading. The oldest entries are evicted once
+    `max_entries` is exceeded. After reconnecting, entries are replayed oldest
+    first in batches at a limited rate.
+
+    Only network errors and server errors keep an entry for another attempt. A
+    batch rejected for good (e.g. a 400) is sent again one entry at a time and
+    the entries that are still rejected are moved to the `outbox_quarantine`
+    table with the error, so they don't hold up everything queued behind them.
+    """
+
+    def __init__(self, path=OUTBOX_PATH, max_entries=OUTBOX_MAX_ENTRIES, sync_interval=OUTBOX_SYNC_INTERVAL,
+                 replay_batch_size=OUTBOX_REPLAY_BATCH_SIZE, replay_rate=OUTBOX_REPLAY_RATE):
+        self.path = path
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval
+        self.replay_batch_size = replay_batch_size
+        self.replay_rate = replay_rate
+
+        # Entries appended since the last sync as (kind, payload, created_at)
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.last_sync = time.monotonic()
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Every (batched) commit is fsync'd
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_quarantine ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+            "error TEXT NOT NULL, quarantined_at REAL NOT NULL)"
+        )
+
+        # Entries in the database, counted once and kept up to date by every insert and delete
+        self.stored = self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+        self.stats = {"appended": 0, "synced": 0, "evicted": 0, "replayed": 0, "syncs": 0, "quarantined": 0}
+
+        logger.info(f"Outbox opened at {path} with {self.stored} undelivered entries")
+
+    def append(self, kind, payload):
+        """Buffer an undelivered write, it reaches the disk on the next sync"""
+        with self.lock:
+            self.buffer.append((kind, json.dumps(payload, separators=(",", ":")), time.time()))
+            self.stats["appended"] += 1
+
+    def __len__(self):
+        with self.lock:
+            return len(self.buffer) + self.stored
+
+    def maybe_sync(self):
+        """Sync the buffer if `sync_interval` seconds have passed since the last sync"""
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """Write the buffered entries in one transaction and evict the oldest beyond the cap"""
+        with self.lock:
+            self.last_sync = time.monotonic()
+            if not self.buffer:
+                return
+
+            entries, self.buffer = self.buffer, []
+            try:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT INTO outbox (kind, payload, created_at) VALUES (?, ?, ?)", entries)
+                evicted = self.db.execute(
+                    "DELETE FROM outbox WHERE seq <= (SELECT MAX(seq) FROM outbox) - ?", (self.max_entries,)
+                ).rowcount
+                self.db.execute("COMMIT")
+            except sqlite3.Error as e:
+                self.db.execute("ROLLBACK")
+                self.buffer = entries + self.buffer
+                logger.error(f"Failed to sync {len(entries)} outbox entries: {e}")
+                return
+
+            self.stored += len(entries) - evicted
+            self.stats["syncs"] += 1
+            self.stats["synced"] += len(entries)
+            if evicted:
+                self.stats["evicted"] += evicted
+                logger.warning(f"Outbox full, evicted {evicted} oldest entries")
+
+    def replay(self, send_fn, max_batches=None):
+        """Send stored entries oldest first in batches, deleting each batch once delivered
+
+        Args:
+            send_fn: Callable receiving a list of (kind, payload) tuples, raises on failure
+            max_batches: Maximum number of batches to send in this call, entries sent one at a time
+                to find a rejected one count as batches as well
+
+        Returns:
+            Number of entries replayed
+        """
+        # Replay what is still only in memory as well
+        self.sync()
+
+        replayed = 0
+        batches = 0
+        # Entries up to this seq belong to a rejected batch and are sent one at a time
+        isolate_until = 0
+        while max_batches is None or batches < max_batches:
+            with self.lock:
+                rows = self.db.execute(
+                    "SELECT seq, kind, payload FROM outbox ORDER BY seq LIMIT ?", (self.replay_batch_size,)
+                ).fetchall()
+            if not rows:
+                break
+            if rows[0][0] <= isolate_until:
+                rows = rows[:1]
+
+            batches += 1
+            try:
+                send_fn([(kind, json.loads(payload)) for _, kind, payload in rows])
+            except Exception as e:
+                if is_retryable(e):
+                    logger.error(f"Failed to replay {len(rows)} outbox entries, retrying later: {e}")
+                    break
+                if len(rows) > 1:
+                    # Find the rejected entries by sending the batch again one entry at a time
+                    logger.warning(f"Outbox batch of {len(rows)} entries rejected, replaying them one by one: {e}")
+                    isolate_until = rows[-1][0]
+                    continue
+                if not self._quarantine(rows[0][0], e):
+                    break
+                continue
+
+            with self.lock:
+                self.stored -= self.db.execute("DELETE FROM outbox WHERE seq <= ?", (rows[-1][0],)).rowcount
+
+            replayed += len(rows)
+            self.stats["replayed"] += len(rows)
+
+            # Rate limit so a long backlog doesn't saturate the uplink
+            if self.replay_rate > 0:
+                time.sleep(1.0 / self.replay_rate)
+
+        if replayed:
+            logger.info(f"Replayed {replayed} outbox entries, {len(self)} left")
+        return replayed
+
+    def close(self):
+        """Sync the buffer and close the database"""
+        self.sync()
+        with self.lock:
+            self.db.close()
+
+    def quarantine(self, kind, payload, error):
+        """Keep a write that was rejected for good in the quarantine table instead of retrying it"""
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO outbox_quarantine (kind, payload, created_at, error, quarantined_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, separators=(",", ":")), time.time(), str(error), time.time())
+            )
+            self._trim_quarantine()
+            self.stats["quarantined"] += 1
+        logger.error(f"Write of {kind} rejected, moved to the outbox quarantine: {error}")
+
+    def _quarantine(self, seq, error):
+        """Move a stored entry that was rejected for good to the quarantine table, returns False on failure"""
+        with self.lock:
+            try:
+                self.db.execute("BEGIN")
+                self.db.execute(
+                    "INSERT INTO outbox_quarantine (kind, payload, created_at, error, quarantined_at) "
+                    "SELECT kind, payload, created_at, ?, ? FROM outbox WHERE seq = ?", (str(error), time.time(), seq)
+                )
+                self.stored -= self.db.execute("DELETE FROM outbox WHERE seq = ?", (seq,)).rowcount
+                self._trim_quarantine()
+                self.db.execute("COMMIT")
+            except sqlite3.Error as e:
+                self.db.execute("ROLLBACK")
+                self.stored = self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+                logger.error(f"Failed to quarantine outbox entry {seq}: {e}")
+                return False
+            self.stats["quarantined"] += 1
+        logger.error(f"Outbox entry {seq} rejected, moved to the outbox quarantine: {error}")
+        return True
+
+    def _trim_quarantine(self):
+        self.db.execute(
+            "DELETE FROM outbox_quarantine WHERE seq <= (SELECT MAX(seq) FROM outbox_quarantine) - ?",
+            (self.max_entries,)
+        )
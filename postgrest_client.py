@@ -0,0 +1,144 @@
+import gzip
+import json
+import time
+
+import httpx
+
+from config import (
+    logger, SUPABASE_URL, SUPABASE_KEY, SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT, SUPABASE_POOL_SIZE,
+    SUPABASE_HTTP2, SUPABASE_COMPRESS_REQUESTS
+)
+from instrumentation import HTTP_REQUEST_SECONDS, HTTP_ERRORS
+
+# Request bodies smaller than this are sent uncompressed, gzip would not pay off
+COMPRESS_MIN_SIZE = 1024
+
+
+class PostgrestError(Exception):
+    """Raised when PostgREST answers with an error status"""
+
+    def __init__(self, status, message, code=None, details=None):
+        super().__init__(f"{status} {message}" + (f" ({details})" if details else ""))
+        self.status = status
+        self.code = code
+        self.details = details
+
+    @property
+    def retryable(self):
+        """Whether the request may succeed when sent again (server errors, timeouts, rate limits)"""
+        return self.status >= 500 or self.status in (408, 429)
+
+
+def is_retryable(error):
+    """Whether a failed request is worth retrying: network errors and retryable PostgREST answers"""
+    if isinstance(error, PostgrestError):
+        return error.retryable
+    return isinstance(error, (httpx.TransportError, OSError))
+
+
+class PostgrestClient:
+    """Thin PostgREST client for the few tables the controller uses.
+
+    One pooled keep-alive connection (HTTP/2 when `h2` is installed), strict
+    connect and read timeouts, compressed responses and only the requested
+    columns. Filters are (column, operator, value) tuples, e.g. ("id", "eq", 5) or
+    ("id", "in", [5, 6]).
+    """
+
+    def __init__(self, url=SUPABASE_URL, key=SUPABASE_KEY, connect_timeout=SUPABASE_CONNECT_TIMEOUT,
+                 read_timeout=SUPABASE_READ_TIMEOUT, pool_size=SUPABASE_POOL_SIZE, http2=SUPABASE_HTTP2,
+                 compress_requests=SUPABASE_COMPRESS_REQUESTS):
+        self.compress_requests = compress_requests
+
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+
+        self.client = httpx.Client(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+            },
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            http2=http2,
+        )
+        logger.info(f"PostgREST client for {url} ({'HTTP/2' if http2 else 'HTTP/1.1'})")
+
+    def select(self, table, columns, filters=()):
+        """Get the given columns (comma separated) of the rows matching all filters"""
+        params = [("select", columns)] + self._filter_params(filters)
+        return self._request("GET", table, "select", params=params) or []
+
+    def update(self, table, values, filters):
+        """Update the rows matching all filters, nothing is returned"""
+        self._request("PATCH", table, "update", params=self._filter_params(filters), body=values,
+                      prefer="return=minimal")
+
+    def upsert(self, table, rows, on_conflict="id"):
+        """Insert rows or merge them into the existing ones with the same `on_conflict` column"""
+        self._request("POST", table, "upsert", params=[("on_conflict", on_conflict)], body=rows,
+                      prefer="resolution=merge-duplicates,return=minimal")
+
+    def rpc(self, function, params):
+        """Call a Postgres function, returns its result"""
+        return self._request("POST", f"rpc/{function}", "rpc", body=params, metric_table=function)
+
+    def close(self):
+        self.client.close()
+
+    def _request(self, method, path, operation, params=None, body=None, prefer=None, metric_table=None):
+        headers = {}
+        content = None
+        if prefer:
+            headers["Prefer"] = prefer
+        if body is not None:
+            content = json.dumps(body, separators=(",", ":")).encode()
+            headers["Content-Type"] = "application/json"
+            if self.compress_requests and len(content) >= COMPRESS_MIN_SIZE:
+                content = gzip.compress(content, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+
+        table = metric_table or path
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, params=params, content=content, headers=headers)
+            return self._parse(response)
+        except Exception:
+            HTTP_ERRORS.labels(table, operation).inc()
+            raise
+        finally:
+            HTTP_REQUEST_SECONDS.labels(table, operation).observe(time.perf_counter() - started)
+
+    @staticmethod
+    def _parse(response):
+        """Decode a response body, raising PostgrestError with PostgREST's message on error statuses"""
+        if response.status_code >= 400:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {"message": response.text or response.reason_phrase}
+            if not isinstance(error, dict):
+                error = {"message": str(error)}
+            raise PostgrestError(response.status_code, error.get("message"), error.get("code"), error.get("details"))
+
+        if response.status_code == 204 or not response.content:
+            return None
+        return response.json()
+
+    @staticmethod
+    def _filter_params(filters):
+        params = []
+        for column, operator, value in filters:
+            if value is None or isinstance(value, bool):
+                value = json.dumps(value)  # null, true, false
+            elif isinstance(value, (list, tuple, set)):
+                # Values are quoted so commas and parentheses inside them are kept
+                value = "(" + ",".join(json.dumps(str(item)) for item in value) + ")"
+            params.append((column, f"{operator}.{value}"))
+        return params
@@ -1,137 +1,300 @@
-import threading
-import logging
+import asyncio
 import json
+import random
 import time
-from config import logger, SUPABASE_URL, SUPABASE_KEY, CONTROL_UNIT_ID
-import websocket
+from config import (
+    logger, SUPABASE_URL, SUPABASE_KEY, SUPABASE_REALTIME_URL, CONTROL_UNIT_IDS, REALTIME_HEARTBEAT_INTERVAL,
+    REALTIME_HEARTBEAT_TIMEOUT, REALTIME_BACKOFF_BASE, REALTIME_BACKOFF_MAX, DEVICE_COLUMNS,
+    DEVICE_SYNC_WATERMARK_COLUMN
+)
+import websockets
+try:
+    # Optional, several times faster than the json module; its decode errors subclass json.JSONDecodeError
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+from instrumentation import ERRORS, REALTIME_MESSAGES, REALTIME_DECODE_SECONDS
 
 
 class RealtimeManager:
-    def __init__(self, on_device_update):
+    """Supervised connection to Supabase Realtime.
+
+    Reconnects with jittered exponential backoff, detects dead connections through
+    Phoenix heartbeat replies, rejoins the device topic when the server drops the
+    subscription and asks for a catch-up of missed changes after every reconnect.
+    In gateway mode the device topics of all control units share the one socket.
+    """
+
+    # Postgres change events mapped to the event types of the device update callback
+    EVENT_TYPES = {"INSERT": "device_created", "UPDATE": "device_updated", "DELETE": "device_deleted"}
+
+    def __init__(self, on_device_update, on_reconnect=None, accept=None):
         """Initialize the realtime listener for Supabase
 
         Args:
-            on_device_update: Callback function to handle device updates
+            on_device_update: Non-blocking callback(event_type, record, received_at) handling device updates,
+                called on the event loop with the perf_counter() time the message was received
+            on_reconnect: Non-blocking callback called on the event loop once a reconnect is subscribed again,
+                used to catch up on changes missed while disconnected
+            accept: Non-blocking predicate(event_type, record), events it rejects are dropped before dispatch
         """
         self.on_device_update = on_device_update
+        self.on_reconnect = on_reconnect
+        self.accept = accept
+
+        # Columns kept of the records, the ones the device sync fetches (all when DEVICE_COLUMNS is "*")
+        self.record_fields = None
+        if DEVICE_COLUMNS != "*":
+            self.record_fields = set(DEVICE_COLUMNS.split(",")) | {"controller_id", DEVICE_SYNC_WATERMARK_COLUMN}
         self.ws = None
         self.connected = False
+        self.subscribed = False
         self.stop_requested = False
-        self.thread = None
+        self.ref = 0
+
+        # Key: device topic, Value: control unit id. Events are routed by their topic
+        self.topics = {f"realtime:public:devices:controller_id=eq.{unit_id}": unit_id for unit_id in CONTROL_UNIT_IDS}
+        self.topic = next(iter(self.topics))
+        self.joined = set()
+        self.rejoin_topics = set()
+        # Key: control unit id, Value: device events received
+        self.unit_events = dict.fromkeys(CONTROL_UNIT_IDS, 0)
+
+        # Refs of the outstanding joins (ref -> topic) and heartbeat, replies are matched against them
+        self.join_refs = {}
+        self.heartbeat_ref = None
+        self.heartbeat_replied = None
+        self.healthy = False
+        self.rejoin_task = None
+
+        # Monotonic time the last connection was lost, None while connected or before the first connect
+        self.disconnected_at = None
+
+        self.stats = {
+            "connects": 0,
+            "reconnects": 0,
+            "failed_attempts": 0,
+            "heartbeat_timeouts": 0,
+            "rejoins": 0,
+            "last_recovery_time": None,
+            "max_recovery_time": 0.0,
+        }
 
         # Use Supabase API key as access token
         self.access_token = SUPABASE_KEY
 
         logger.info("Realtime manager initialized")
 
-    def start(self):
-        """Start the realtime listener in a separate thread"""
-        if self.thread and self.thread.is_alive():
-            logger.warning("Realtime manager already running")
-            return
-
-        self.stop_requested = False
-        self.thread = threading.Thread(target=self._connect_and_listen)
-        self.thread.daemon = True
-        self.thread.start()
-        logger.info("Realtime manager thread started")
-
     def stop(self):
-        """Stop the realtime listener"""
+        """Stop the realtime listener, the running task is cancelled by the controller"""
         self.stop_requested = True
-        if self.ws:
-            self.ws.close()  # Close WebSocket connection
-            logger.info("WebSocket connection closed.")
-        if self.thread:
-            self.thread.join()  # Ensure the thread has finished
+        self.connected = False
+        self.subscribed = False
         logger.info("Realtime manager stopped.")
 
-    def _connect_and_listen(self):
-        """Connect to Supabase Realtime and listen for device changes"""
-        realtime_url = SUPABASE_URL.replace(
+    async def run(self):
+        """Connect to Supabase Realtime and listen for device changes until cancelled"""
+        realtime_url = SUPABASE_REALTIME_URL or SUPABASE_URL.replace(
             "https://", "wss://"
         ).replace(".supabase.co", ".supabase.co/realtime/v1/websocket")
-        realtime_url += f"?apikey={self.access_token}"
+        realtime_url += f"?apikey={self.access_token}&vsn=1.0.0"
 
-        websocket.enableTrace(logger.level <= logging.DEBUG)
+        attempt = 0
+        self.stop_requested = False
 
-        def on_message(ws, message):
+        # Reconnect in a loop instead of recursing from the close callback
+        while not self.stop_requested:
+            self.healthy = False
             try:
-                data = json.loads(message)
-                event = data.get("event")
-                topic = data.get("topic")
-                payload = data.get("payload", {})
-
-                if event in {"INSERT", "UPDATE", "DELETE"}:
-                    record = payload.get("record") if event != "DELETE" else payload.get("old_record")
-                    if record:
-                        logger.info(f"Device {event.lower()}: {record.get('id')}")
-                        self.on_device_update(f"device_{event.lower()}", record)
-                    else:
-                        logger.warning(f"Record missing in {event} event: {data}")
-
-                elif event in {"phx_reply", "system", "presence_state"}:
-                    logger.debug(f"Control message: {data}")
+                async with websockets.connect(realtime_url, ping_interval=None) as ws:
+                    self.ws = ws
+                    await self._on_open(ws)
 
-                else:
-                    logger.warning(f"Unhandled message: {data}")
+                    heartbeat = asyncio.create_task(self._send_heartbeats(ws))
+                    try:
+                        async for message in ws:
+                            self._on_message(message)
+                    finally:
+                        heartbeat.cancel()
+                        if self.rejoin_task:
+                            self.rejoin_task.cancel()
+
+                logger.info(f"Realtime connection closed: {ws.close_reason} (Code: {ws.close_code})")
 
-            except json.JSONDecodeError:
-                logger.error("Failed to decode realtime message")
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Error processing message: {e}")
-
-        def on_error(ws, error):
-            logger.error(f"Realtime connection error: {error}")
-            self.connected = False
-
-        def on_close(ws, close_status_code, close_msg):
-            logger.info(f"Realtime connection closed: {close_msg} (Code: {close_status_code})")
-            self.connected = False
-
-            if not self.stop_requested:
-                retry_delay = 5
-                attempt = 0
-                while not self.stop_requested and attempt < 5:
-                    attempt += 1
-                    logger.info(f"Reconnecting in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    self._connect_and_listen()
-
-        def on_open(ws):
-            logger.info("Realtime connection established")
-            self.connected = True
-
-            # Send a ping message every 30 seconds to keep the connection alive
-            def send_ping():
-                while self.connected:
-                    time.sleep(30)
-                    if self.ws:
-                        self.ws.send(json.dumps({"event": "ping"}))
-                        logger.debug("Ping sent to keep connection alive")
-
-            threading.Thread(target=send_ping, daemon=True).start()
+                self.stats["failed_attempts"] += 1
+                ERRORS.labels("realtime").inc()
+                logger.error(f"Realtime connection error: {e}")
+            finally:
+                if self.connected and self.disconnected_at is None:
+                    self.disconnected_at = time.monotonic()
+                self.connected = False
+                self.subscribed = False
+                self.joined.clear()
+                self.join_refs.clear()
+                self.rejoin_topics.clear()
+                self.ws = None
+
+            if self.stop_requested:
+                break
 
+            # Start over from the shortest delay only after a connection proved healthy
+            attempt = 0 if self.healthy else attempt + 1
+            delay = self._backoff_delay(attempt)
+            logger.info(f"Reconnecting in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+    def _backoff_delay(self, attempt):
+        """Exponential backoff with full jitter, so a fleet doesn't reconnect in lockstep"""
+        ceiling = min(REALTIME_BACKOFF_MAX, REALTIME_BACKOFF_BASE * 2 ** min(attempt, 16))
+        return random.uniform(REALTIME_BACKOFF_BASE, ceiling)
+
+    async def _on_open(self, ws):
+        """Subscribe to the device changes of this control unit"""
+        logger.info("Realtime connection established")
+        self.connected = True
+        self.stats["connects"] += 1
+        await self._join(ws)
+
+    async def _join(self, ws, topics=None):
+        """Send the phx_join of the device topics, the replies are handled in _on_message"""
+        for topic in topics or list(self.topics):
+            ref = self._next_ref()
+            self.join_refs[ref] = topic
             subscription_msg = {
-                "topic": f"realtime:public:devices:controller_id=eq.{CONTROL_UNIT_ID}",
+                "topic": topic,
                 "event": "phx_join",
                 "payload": {},
-                "ref": "1"
+                "ref": ref
             }
-            ws.send(json.dumps(subscription_msg))
-            logger.info(f"Subscribed to device changes for control unit {CONTROL_UNIT_ID}")
+            await ws.send(json.dumps(subscription_msg))
+            logger.info(f"Subscribing to device changes for control unit {self.topics[topic]}")
+
+    async def _rejoin(self, ws):
+        """Join the device topics again after the server closed or rejected their subscription"""
+        await asyncio.sleep(self._backoff_delay(0))
+        topics, self.rejoin_topics = self.rejoin_topics, set()
+        self.stats["rejoins"] += 1
+        await self._join(ws, topics)
+
+    async def _send_heartbeats(self, ws):
+        """Send Phoenix heartbeats and close the connection when one is not answered in time"""
+        while True:
+            await asyncio.sleep(REALTIME_HEARTBEAT_INTERVAL)
 
-        self.ws = websocket.WebSocketApp(
-            realtime_url,
-            on_open=on_open,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close,
-        )
+            self.heartbeat_ref = self._next_ref()
+            self.heartbeat_replied = asyncio.Event()
+            await ws.send(json.dumps({"topic": "phoenix", "event": "heartbeat", "payload": {}, "ref": self.heartbeat_ref}))
+            logger.debug("Heartbeat sent to keep connection alive")
 
+            try:
+                await asyncio.wait_for(self.heartbeat_replied.wait(), REALTIME_HEARTBEAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stats["heartbeat_timeouts"] += 1
+                logger.warning(f"No heartbeat reply within {REALTIME_HEARTBEAT_TIMEOUT} seconds, reconnecting")
+                await ws.close()
+                return
+
+    def _on_message(self, message):
+        """Decode a realtime message and hand device changes to the callback"""
+        received_at = time.perf_counter()
+        REALTIME_MESSAGES.inc()
         try:
-            self.ws.run_forever()
+            data = json_loads(message)
+            REALTIME_DECODE_SECONDS.observe(time.perf_counter() - received_at)
+            event = data.get("event")
+            topic = data.get("topic")
+            payload = data.get("payload", {})
+
+            if event in self.EVENT_TYPES:
+                unit_id = self.topics.get(topic)
+                if unit_id is None:
+                    logger.warning(f"Ignoring {event} event of unknown topic {topic}")
+                    return
+                self.unit_events[unit_id] += 1
+
+                record = payload.get("record") if event != "DELETE" else payload.get("old_record")
+                if record:
+                    if self.record_fields is not None:
+                        record = {key: value for key, value in record.items() if key in self.record_fields}
+                    event_type = self.EVENT_TYPES[event]
+                    if self.accept is not None and not self.accept(event_type, record):
+                        return
+                    logger.info("Device %s: %s", event.lower(), record.get("id"))
+                    # Only queues the event, the socket reader never waits for GPIO writes
+                    self.on_device_update(event_type, record, received_at)
+                else:
+                    logger.warning(f"Record missing in {event} event: {data}")
+
+            elif event == "phx_reply":
+                self._on_reply(data.get("ref"), payload)
+
+            elif event in {"phx_error", "phx_close"} and topic in self.topics:
+                logger.warning(f"Subscription of control unit {self.topics[topic]} closed by server ({event}), rejoining")
+                self.joined.discard(topic)
+                self.subscribed = False
+                self._schedule_rejoin(topic)
+
+            elif event in {"system", "presence_state"}:
+                logger.debug("Control message: %s", data)
+
+            else:
+                logger.warning(f"Unhandled message: {data}")
+
+        except json.JSONDecodeError:
+            logger.error("Failed to decode realtime message")
         except Exception as e:
-            logger.error(f"Error in websocket connection: {e}")
-            self.connected = False
\ No newline at end of file
+            logger.error(f"Error processing message: {e}")
+
+    def _on_reply(self, ref, payload):
+        """Match a phx_reply against the outstanding heartbeat and join"""
+        status = payload.get("status")
+
+        if ref is not None and ref == self.heartbeat_ref:
+            self.heartbeat_ref = None
+            self.healthy = True
+            self.heartbeat_replied.set()
+            logger.debug("Heartbeat reply received")
+
+        elif ref is not None and ref in self.join_refs:
+            topic = self.join_refs.pop(ref)
+            if status != "ok":
+                logger.error(f"Failed to subscribe to device changes of control unit {self.topics[topic]}: "
+                             f"{payload.get('response')}")
+                self._schedule_rejoin(topic)
+                return
+
+            self.joined.add(topic)
+            logger.info(f"Subscribed to device changes for control unit {self.topics[topic]}")
+            if len(self.joined) == len(self.topics):
+                self.subscribed = True
+                self._on_recovered()
+
+        else:
+            logger.debug("Control message: %s", payload)
+
+    def _on_recovered(self):
+        """Record the time to recovery and catch up on changes missed while disconnected"""
+        if self.disconnected_at is None:
+            return
+
+        recovery_time = time.monotonic() - self.disconnected_at
+        self.disconnected_at = None
+        self.stats["reconnects"] += 1
+        self.stats["last_recovery_time"] = recovery_time
+        self.stats["max_recovery_time"] = max(self.stats["max_recovery_time"], recovery_time)
+        logger.info(f"Realtime recovered after {recovery_time:.1f} seconds (reconnect #{self.stats['reconnects']})")
+
+        if self.on_reconnect:
+            self.on_reconnect()
+
+    def _schedule_rejoin(self, topic):
+        self.rejoin_topics.add(topic)
+        if self.ws is not None and (self.rejoin_task is None or self.rejoin_task.done()):
+            self.rejoin_task = asyncio.create_task(self._rejoin(self.ws))
+
+    def _next_ref(self):
+        self.ref += 1
+        return str(self.ref)
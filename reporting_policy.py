@@ -0,0 +1,139 @@
+import threading
+import time
+
+
+class ReportingSettings:
+    """Deadbands and intervals deciding when a value has to be reported"""
+
+    __slots__ = ("abs_deadband", "rel_deadband", "min_interval", "max_interval")
+
+    # Device row columns overriding the defaults
+    ROW_FIELDS = {
+        "abs_deadband": "report_deadband",
+        "rel_deadband": "report_deadband_pct",
+        "min_interval": "report_min_interval",
+        "max_interval": "report_max_interval",
+    }
+
+    def __init__(self, abs_deadband=0.0, rel_deadband=0.0, min_interval=0.0, max_interval=0.0):
+        """Initialize the settings
+
+        Args:
+            abs_deadband: Changes up to this absolute amount are not reported
+            rel_deadband: Changes up to this percentage of the last reported value are not reported
+            min_interval: Seconds that must pass between two reports
+            max_interval: Seconds after which the value is reported even if unchanged, 0 disables the heartbeat
+        """
+        self.abs_deadband = abs_deadband
+        self.rel_deadband = rel_deadband
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def with_row(self, row):
+        """Get a copy with the values set in a device row applied"""
+        values = {}
+        for name, column in self.ROW_FIELDS.items():
+            value = row.get(column)
+            values[name] = float(value) if value is not None else getattr(self, name)
+        return ReportingSettings(**values)
+
+
+class ReportingPolicy:
+    """Change-driven reporting: suppress values within the deadband, force a heartbeat
+    after `max_interval` and rate-limit the reports of all keys together.
+
+    Values can be numbers, tuples of numbers (reported when any component changes
+    enough) or anything else (reported when not equal).
+    """
+
+    def __init__(self, defaults=None, rate_limit=0.0, burst=10):
+        """Initialize the policy
+
+        Args:
+            defaults: ReportingSettings of keys without their own settings
+            rate_limit: Reports per second allowed over all keys, 0 for no limit
+            burst: Number of reports that may exceed the rate limit at once
+        """
+        self.defaults = defaults or ReportingSettings()
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+        # Key: report key, Value: ReportingSettings
+        self.settings = {}
+        # Key: report key, Value: (last reported value, monotonic time it was reported)
+        self.last_reported = {}
+
+        self.stats = {"sent": 0, "suppressed": 0, "forced": 0, "rate_limited": 0}
+        # Key: report key, Value: [sent, suppressed]
+        self.key_stats = {}
+
+    def configure(self, key, row):
+        """Use the reporting columns of a device row for a key"""
+        self.settings[key] = self.defaults.with_row(row)
+
+    def should_report(self, key, value, now=None):
+        """Decide whether a new value of a key has to be reported, recording it as reported if so"""
+        now = time.monotonic() if now is None else now
+        settings = self.settings.get(key, self.defaults)
+
+        with self.lock:
+            last = self.last_reported.get(key)
+            forced = False
+
+            if last is not None:
+                last_value, reported_at = last
+                elapsed = now - reported_at
+
+                if elapsed < settings.min_interval:
+                    return self._suppress(key)
+
+                forced = 0 < settings.max_interval <= elapsed
+                if not forced and not self._changed(last_value, value, settings):
+                    return self._suppress(key)
+
+            # Heartbeats are bounded by max_interval already, only changes use up the rate budget
+            if not forced and not self._take_token(now):
+                self.stats["rate_limited"] += 1
+                return self._suppress(key)
+
+            self.last_reported[key] = (value, now)
+            self.stats["sent"] += 1
+            if forced:
+                self.stats["forced"] += 1
+            self.key_stats.setdefault(key, [0, 0])[0] += 1
+            return True
+
+    def forget(self, key):
+        """Drop the state of a key so its next value is reported"""
+        with self.lock:
+            self.last_reported.pop(key, None)
+            self.settings.pop(key, None)
+
+    def _suppress(self, key):
+        self.stats["suppressed"] += 1
+        self.key_stats.setdefault(key, [0, 0])[1] += 1
+        return False
+
+    def _changed(self, last_value, value, settings):
+        if isinstance(value, tuple) and isinstance(last_value, tuple) and len(value) == len(last_value):
+            return any(self._changed(old, new, settings) for old, new in zip(last_value, value))
+
+        if isinstance(value, (int, float)) and isinstance(last_value, (int, float)):
+            delta = abs(value - last_value)
+            return delta > settings.abs_deadband and delta > abs(last_value) * settings.rel_deadband / 100.0
+
+        return value != last_value
+
+    def _take_token(self, now):
+        if self.rate_limit <= 0:
+            return True
+
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.last_refill) * self.rate_limit)
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
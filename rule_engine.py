@@ -0,0 +1,193 @@
+import operator
+import threading
+import time
+
+from config import logger
+from instrumentation import RULE_EVAL_SECONDS
+
+# Trigger comparisons and the comparison releasing the rule again once past the hysteresis band
+OPERATORS = {
+    ">": (operator.gt, operator.lt, -1),
+    ">=": (operator.ge, operator.lt, -1),
+    "<": (operator.lt, operator.gt, 1),
+    "<=": (operator.le, operator.gt, 1),
+}
+
+# Columns of a rule row that define its behaviour, a change recompiles the rule and resets its latch
+RULE_FIELDS = ("sensor_device_id", "operator", "threshold", "hysteresis", "target_device_id", "target_state")
+
+
+class CompiledRule:
+    """Rule compiled into a closure, `evaluate(value)` returns the target state to drive or None"""
+
+    __slots__ = ("rule_id", "sensor_id", "target_id", "definition", "evaluate")
+
+    def __init__(self, rule_id, sensor_id, target_id, definition, evaluate):
+        self.rule_id = rule_id
+        self.sensor_id = sensor_id
+        self.target_id = target_id
+        self.definition = definition
+        self.evaluate = evaluate
+
+
+def compile_rule(row):
+    """Compile a rule row, e.g. "sensor > 24 then target on, off again below 23.5"
+
+    Raises KeyError or ValueError when the row is incomplete or invalid.
+    """
+    trigger, release, direction = OPERATORS[row["operator"]]
+    threshold = float(row["threshold"])
+    release_at = threshold + direction * abs(float(row.get("hysteresis") or 0))
+    active_state = bool(row.get("target_state", True))
+    inactive_state = not active_state
+
+    # None until the first reading, then whether the condition currently holds
+    latched = None
+
+    def evaluate(value):
+        nonlocal latched
+        if trigger(value, threshold):
+            triggered = True
+        elif latched is not True or release(value, release_at):
+            triggered = False
+        else:
+            # Inside the hysteresis band, keep the current state
+            return None
+
+        if triggered is latched:
+            return None
+        latched = triggered
+        return active_state if triggered else inactive_state
+
+    definition = tuple(row.get(field) for field in RULE_FIELDS)
+    return CompiledRule(row["id"], row["sensor_device_id"], row["target_device_id"], definition, evaluate)
+
+
+class RuleEngine:
+    """Local closed-loop control: sensor readings drive output pins without a cloud round trip.
+
+    Rules are compiled once when loaded and indexed by sensor, so a reading only runs
+    the closures of the rules watching that sensor. Pin changes of one sensor sweep are
+    committed as one write, the resulting actions are reported afterwards through
+    `on_action` so the network never delays the pins.
+    """
+
+    def __init__(self, gpio, on_action=None):
+        """Initialize the rule engine
+
+        Args:
+            gpio: GPIOManager driving the target devices
+            on_action: Callback(device_id, state, rule_id, value) called after a rule switched a device
+        """
+        self.gpio = gpio
+        self.on_action = on_action
+
+        # Key: sensor device id, Value: tuple of CompiledRule. Replaced as a whole when rules are loaded
+        self.rules_by_sensor = {}
+        # Key: rule id, Value: CompiledRule, kept across loads so unchanged rules keep their latch
+        self.rules = {}
+        # Bumped whenever the loaded rules change
+        self.version = 0
+        self.lock = threading.Lock()
+
+        self.stats = {
+            "rules": 0,
+            "evaluations": 0,
+            "actions": 0,
+            "failed_actions": 0,
+            "last_duration": 0.0,
+            "max_duration": 0.0,
+        }
+
+        logger.info("Rule engine initialized")
+
+    def load(self, rows):
+        """Compile the enabled rule rows, replacing the current rules"""
+        with self.lock:
+            rules = {}
+            changed = False
+            for row in rows:
+                if not row.get("is_enabled", True):
+                    continue
+
+                known = self.rules.get(row.get("id"))
+                if known is not None and known.definition == tuple(row.get(field) for field in RULE_FIELDS):
+                    rules[known.rule_id] = known
+                    continue
+
+                try:
+                    rule = compile_rule(row)
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.error(f"Invalid rule {row.get('id')}: {e}")
+                    continue
+                rules[rule.rule_id] = rule
+                changed = True
+
+            by_sensor = {}
+            for rule in rules.values():
+                by_sensor.setdefault(rule.sensor_id, []).append(rule)
+
+            if changed or rules.keys() != self.rules.keys():
+                self.version += 1
+            self.rules = rules
+            self.rules_by_sensor = {sensor_id: tuple(items) for sensor_id, items in by_sensor.items()}
+            self.stats["rules"] = len(rules)
+
+        logger.info(f"Loaded {len(rules)} rules for {len(self.rules_by_sensor)} sensors")
+
+    def rows(self):
+        """Get rows of the loaded rules, enough to compile them again (e.g. from the boot snapshot)"""
+        return [{"id": rule.rule_id, **dict(zip(RULE_FIELDS, rule.definition))} for rule in self.rules.values()]
+
+    def evaluate(self, readings):
+        """Run the rules of every reading (sensor device id -> value) and apply the resulting states
+
+        Returns the (device_id, state, rule_id, value) actions taken.
+        """
+        rules_by_sensor = self.rules_by_sensor
+        if not rules_by_sensor:
+            return []
+
+        started = time.perf_counter()
+        actions = []
+        with self.gpio.batch():
+            for sensor_id, value in readings.items():
+                rules = rules_by_sensor.get(sensor_id)
+                if rules is None or value is None:
+                    continue
+                for rule in rules:
+                    self.stats["evaluations"] += 1
+                    state = rule.evaluate(value)
+                    if state is not None:
+                        self._apply(rule, state, value, actions)
+
+        duration = time.perf_counter() - started
+        RULE_EVAL_SECONDS.observe(duration)
+        self.stats["last_duration"] = duration
+        self.stats["max_duration"] = max(self.stats["max_duration"], duration)
+
+        # Reported only once the pins are written
+        for action in actions:
+            logger.info("Rule %s switched device %s %s at %s", action[2], action[0], "ON" if action[1] else "OFF", action[3])
+            if self.on_action:
+                try:
+                    self.on_action(*action)
+                except Exception as e:
+                    logger.error(f"Failed to report action of rule {action[2]}: {e}")
+        return actions
+
+    def _apply(self, rule, state, value, actions):
+        """Drive the target of a rule unless it is already in that state"""
+        record = self.gpio.registry.get(rule.target_id)
+        if record is None or not record.is_output:
+            self.stats["failed_actions"] += 1
+            logger.warning(f"Target {rule.target_id} of rule {rule.rule_id} is not a registered output")
+            return
+        if record.state == state:
+            return
+
+        if self.gpio.update_device_state(rule.target_id, state):
+            self.stats["actions"] += 1
+            actions.append((rule.target_id, state, rule.rule_id, value))
+        else:
+            self.stats["failed_actions"] += 1
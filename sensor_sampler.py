@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from config import logger, W1_DEVICES_PATH, SENSOR_READ_TIMEOUT, SENSOR_MAX_WORKERS
+from instrumentation import ERRORS, SENSOR_READ_SECONDS
+
+
+class DS18B20Sensor:
+    """Cached handle of a single DS18B20 probe on the 1-Wire bus"""
+
+    # Scratchpad value after power-up, read when the conversion never ran (e.g. a brown-out of the probe)
+    POWER_ON_RESET = 85.0
+
+    def __init__(self, sensor_id, path):
+        self.sensor_id = sensor_id
+        self.path = path
+        self.reads = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.last_duration = None
+        self.last_temperature = None
+
+    def read(self):
+        """Read the temperature in °C, triggering a conversion when no bulk read is pending"""
+        start = time.monotonic()
+        try:
+            # Newer kernels expose the already converted value in "temperature"
+            temperature_file = os.path.join(self.path, "temperature")
+            if os.path.exists(temperature_file):
+                with open(temperature_file) as f:
+                    temperature = int(f.read().strip()) / 1000.0
+            else:
+                temperature = self._read_w1_slave()
+
+            if temperature == self.POWER_ON_RESET:
+                raise ValueError(f"Sensor {self.sensor_id} returned its power-on reset value")
+            self.last_temperature = temperature
+            return temperature
+        finally:
+            self.reads += 1
+            self.last_duration = time.monotonic() - start
+            SENSOR_READ_SECONDS.observe(self.last_duration)
+
+    def _read_w1_slave(self):
+        """Parse the legacy w1_slave file ("... crc=xx YES" / "... t=21437")"""
+        with open(os.path.join(self.path, "w1_slave")) as f:
+            lines = f.read().splitlines()
+
+        if len(lines) < 2 or not lines[0].strip().endswith("YES"):
+            raise ValueError(f"CRC check failed for sensor {self.sensor_id}")
+
+        _, separator, raw_value = lines[1].partition("t=")
+        if not separator:
+            raise ValueError(f"No temperature in reading of sensor {self.sensor_id}")
+
+        return int(raw_value) / 1000.0
+
+
+class DS18B20Sampler:
+    """Sample all DS18B20 probes concurrently within a single conversion window.
+
+    The 1-Wire bus is discovered once and the sensor handles are cached. When the
+    bus master supports it, one bulk conversion is started for every probe at once,
+    otherwise the per-sensor conversions run in parallel on a small thread pool.
+    """
+
+    FAMILY_PREFIX = "28-"
+    CONVERSION_TIME = 0.75
+
+    def __init__(self, devices_path=W1_DEVICES_PATH, read_timeout=SENSOR_READ_TIMEOUT, max_workers=SENSOR_MAX_WORKERS):
+        self.devices_path = devices_path
+        self.read_timeout = read_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="w1")
+        self.lock = threading.Lock()
+
+        # Key: sensor_id (e.g. "28-0316a2795aff"), Value: DS18B20Sensor
+        self.sensors = {}
+        self.bulk_read_files = []
+        self.discover()
+
+        logger.info(f"DS18B20 sampler initialized with {len(self.sensors)} sensors")
+
+    def discover(self):
+        """Scan the 1-Wire bus for DS18B20 probes and cache their handles"""
+        with self.lock:
+            try:
+                entries = sorted(os.listdir(self.devices_path))
+            except OSError as e:
+                logger.error(f"Failed to scan 1-Wire bus at {self.devices_path}: {e}")
+                return self.sensors
+
+            for entry in entries:
+                if entry.startswith(self.FAMILY_PREFIX) and entry not in self.sensors:
+                    self.sensors[entry] = DS18B20Sensor(entry, os.path.join(self.devices_path, entry))
+                    logger.info(f"Discovered DS18B20 sensor {entry}")
+
+            self.bulk_read_files = [
+                os.path.join(self.devices_path, entry, "therm_bulk_read")
+                for entry in entries
+                if entry.startswith("w1_bus_master")
+                and os.path.exists(os.path.join(self.devices_path, entry, "therm_bulk_read"))
+            ]
+
+        return self.sensors
+
+    def resolve(self, device):
+        """Map a device row to the handle of its sensor"""
+        sensor_id = device.get("sensor_id")
+        if sensor_id:
+            if sensor_id not in self.sensors:
+                # Probe may have been hot-plugged since the last scan
+                self.discover()
+            return self.sensors.get(sensor_id)
+
+        # Without an explicit sensor id only an unambiguous bus can be used
+        if len(self.sensors) == 1:
+            return next(iter(self.sensors.values()))
+
+        logger.warning(f"Device {device.get('id')} has no sensor_id and {len(self.sensors)} sensors are on the bus")
+        return None
+
+    def sample(self, devices):
+        """Read every given device concurrently and return a dict of device_id -> temperature"""
+        handles = {}
+        for device in devices:
+            sensor = self.resolve(device)
+            if sensor is not None:
+                handles[device["id"]] = sensor
+
+        if not handles:
+            return {}
+
+        self._start_bulk_conversion()
+
+        futures = {}
+        for sensor in set(handles.values()):
+            futures[sensor.sensor_id] = self.executor.submit(sensor.read)
+
+        # Every conversion runs in parallel, so one window plus the timeout covers them all
+        done, _ = wait(futures.values(), timeout=self.read_timeout)
+
+        readings = {}
+        for device_id, sensor in handles.items():
+            future = futures[sensor.sensor_id]
+            if future not in done:
+                sensor.timeouts += 1
+                ERRORS.labels("sensor").inc()
+                logger.warning(f"Timed out reading DS18B20 sensor {sensor.sensor_id}")
+                continue
+
+            try:
+                readings[device_id] = future.result()
+            except Exception as e:
+                sensor.errors += 1
+                ERRORS.labels("sensor").inc()
+                logger.error(f"Failed to read DS18B20 sensor {sensor.sensor_id}: {e}")
+
+        return readings
+
+    def _start_bulk_conversion(self):
+        """Start a simultaneous conversion on every probe of the bus masters that support it"""
+        if not self.bulk_read_files:
+            return
+
+        try:
+            for bulk_read_file in self.bulk_read_files:
+                with open(bulk_read_file, "w") as f:
+                    f.write("trigger\n")
+            time.sleep(self.CONVERSION_TIME)
+        except OSError as e:
+            logger.error(f"Failed to start bulk conversion: {e}")
+
+    def get_stats(self):
+        """Get read, error and timeout counters for every sensor"""
+        return {
+            sensor_id: {
+                "reads": sensor.reads,
+                "errors": sensor.errors,
+                "timeouts": sensor.timeouts,
+                "last_duration": sensor.last_duration,
+                "last_temperature": sensor.last_temperature,
+            }
+            for sensor_id, sensor in self.sensors.items()
+        }
+
+    def close(self):
+        """Stop the worker threads"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,30 +1,50 @@
 import platform
 import socket
-import threading
 import time
 import uuid
 from datetime import datetime, UTC
 
-from supabase import create_client, Client
-from w1thermsensor import W1ThermSensor
-
-from config import SUPABASE_URL, SUPABASE_KEY, CONTROL_UNIT_ID, logger
+from config import (
+    SUPABASE_URL, SUPABASE_KEY, CONTROL_UNIT_ID, CONTROL_UNIT_IDS, DEVICE_SYNC_WATERMARK_COLUMN, DEVICE_COLUMNS, TELEMETRY_RPC,
+    TELEMETRY_BULK_UPSERT, METRICS_ROLLUP_COLUMN, REPORT_DEADBAND, REPORT_DEADBAND_PCT, REPORT_MIN_INTERVAL, REPORT_MAX_INTERVAL,
+    REPORT_RATE_LIMIT, METRICS_DEADBAND, METRICS_MAX_INTERVAL, RULES_TABLE,
+    TIMESERIES_TABLE, logger
+)
+from outbox import Outbox
+from postgrest_client import PostgrestClient, PostgrestError
+from reporting_policy import ReportingPolicy, ReportingSettings
 from system_monitor import SystemMonitor
+from telemetry_queue import TelemetryQueue
 
 
 class SupabaseManager:
-    def __init__(self):
+    def __init__(self, system_monitor=None):
         if not SUPABASE_URL or not SUPABASE_KEY:
             raise ValueError("Supabase URL and API key must be set in .env file")
 
         if not CONTROL_UNIT_ID:
             raise ValueError("Control unit ID must be set in .env file")
 
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self.db = PostgrestClient(SUPABASE_URL, SUPABASE_KEY)
         self.control_unit_id = CONTROL_UNIT_ID
+        # Every unit served by this process (gateway mode), they share all requests and heartbeats
+        self.control_unit_ids = CONTROL_UNIT_IDS
+        # Columns of the devices the controller works with, "*" once the table turned out to lack one of them
+        self.device_columns = DEVICE_COLUMNS
         self.connected = False
-        self.keep_alive_thread = None  # Thread for updating is_online
-        logger.info(f"Initialized Supabase client for control unit: {self.control_unit_id}")
+        self.system_monitor = system_monitor or SystemMonitor()
+        self.outbox = Outbox()  # Durable store for writes that could not be delivered
+        self.telemetry = TelemetryQueue(self.flush_telemetry, outbox=self.outbox)  # Write-behind queue for sensor data and metrics
+        # Callback(rows) called right before device rows are written, e.g. to recognize their realtime echoes
+        self.on_device_write = None
+
+        # Change-driven reporting: unchanged values are only re-sent as heartbeats
+        self.sensor_policy = ReportingPolicy(
+            ReportingSettings(REPORT_DEADBAND, REPORT_DEADBAND_PCT, REPORT_MIN_INTERVAL, REPORT_MAX_INTERVAL),
+            rate_limit=REPORT_RATE_LIMIT,
+        )
+        self.metrics_policy = ReportingPolicy(ReportingSettings(METRICS_DEADBAND, max_interval=METRICS_MAX_INTERVAL))
+        logger.info(f"Initialized Supabase client for control units: {', '.join(self.control_unit_ids)}")
 
     def get_system_info(self):
         """Retrieve system information (runs once at startup)"""
@@ -49,7 +69,7 @@ class SupabaseManager:
         try:
             system_info = self.get_system_info()
             if system_info:
-                self.supabase.table("control_units").update(system_info).eq("id", self.control_unit_id).execute()
+                self.db.update("control_units", system_info, [self._unit_filter("id")])
                 logger.info(f"Updated system info: {system_info}")
         except Exception as e:
             logger.error(f"Failed to update system info: {e}")
@@ -61,95 +81,152 @@ class SupabaseManager:
             self.update_system_info()
 
             # Mark as online
-            self.supabase.table("control_units").update({
+            self.db.update("control_units", {
                 "is_online": True,
                 "last_seen": datetime.now(UTC).isoformat(),
                 "cpu_usage": 0,
                 "memory_usage": 0,
                 "storage_usage": 0
-            }).eq("id", self.control_unit_id).execute()
+            }, [self._unit_filter("id")])
 
-            logger.info(f"Control unit {self.control_unit_id} is now online")
+            logger.info(f"Control units {', '.join(self.control_unit_ids)} are now online")
             self.connected = True
 
-            # Start background thread to keep metrics updated
-            self.keep_alive_thread = threading.Thread(target=self.keep_alive, daemon=True)
-            self.keep_alive_thread.start()
-
+            # Metrics updates and telemetry flushes are run by the controller's event loop
             return True
         except Exception as e:
             logger.error(f"Failed to connect to Supabase: {e}")
             self.connected = False
             return False
 
-    # In SupabaseManager, update the `keep_alive` method:
     def keep_alive(self):
-        """Continuously update metrics every 60 seconds"""
-        system_monitor = SystemMonitor()  # Create an instance of SystemMonitor
-        while self.connected:
-            try:
-                # Use SystemMonitor to get metrics
-                metrics = system_monitor.get_metrics()
+        """Queue the current metrics and online status (the controller calls this every 60 seconds)
+
+        Skipped while the metrics stay within METRICS_DEADBAND, until METRICS_MAX_INTERVAL forces a heartbeat.
+        """
+        if not self.connected:
+            return
 
-                update_data = {
-                    "cpu_usage": metrics["cpu_usage"],
-                    "memory_usage": metrics["memory_usage"],
-                    "storage_usage": metrics["storage_usage"],
-                    "is_online": True,
-                    "last_seen": datetime.now(UTC).isoformat()
-                }
+        try:
+            # Use SystemMonitor to get metrics (means over the sampled window)
+            metrics = self.system_monitor.get_metrics()
+
+            values = (metrics["cpu_usage"], metrics["memory_usage"], metrics["storage_usage"])
+            if not self.metrics_policy.should_report("control_unit", values):
+                logger.debug("Control unit metrics unchanged, reporting stats: %s", self.metrics_policy.stats)
+                return
 
-                self.supabase.table("control_units").update(update_data).eq("id", self.control_unit_id).execute()
-                logger.debug(f"Updated control unit metrics: {update_data}")
+            update_data = {
+                "cpu_usage": metrics["cpu_usage"],
+                "memory_usage": metrics["memory_usage"],
+                "storage_usage": metrics["storage_usage"],
+                "is_online": True,
+                "last_seen": datetime.now(UTC).isoformat()
+            }
+            if METRICS_ROLLUP_COLUMN:
+                update_data[METRICS_ROLLUP_COLUMN] = self.system_monitor.get_rollups()
 
-            except Exception as e:
-                logger.error(f"Failed to update control unit metrics: {e}")
+            # Sent together with the pending sensor data on the next telemetry flush
+            self.telemetry.put_control_unit(update_data)
+            logger.debug("Queued control unit metrics: %s", update_data)
 
-            time.sleep(60)  # Wait 60 seconds before next update
+        except Exception as e:
+            logger.error(f"Failed to update control unit metrics: {e}")
 
     def disconnect(self):
         """Update control unit status to offline"""
-        if not self.connected:
-            return
+        # Deliver whatever telemetry is still pending, it goes to the outbox when Supabase was never reached
+        self.telemetry.stop()
+
+        offline_data = {
+            "is_online": False,
+            "last_seen": datetime.now(UTC).isoformat()
+        }
 
         try:
-            self.supabase.table("control_units").update({
-                "is_online": False,
-                "last_seen": datetime.now(UTC).isoformat()
-            }).eq("id", self.control_unit_id).execute()
+            if self.connected:
+                self.db.update("control_units", offline_data, [self._unit_filter("id")])
 
-            logger.info(f"Control unit {self.control_unit_id} is now offline")
-            self.connected = False
+                logger.info(f"Control units {', '.join(self.control_unit_ids)} are now offline")
+                self.connected = False
         except Exception as e:
             logger.error(f"Failed to update offline status: {e}")
+            self.outbox.append("control_unit", offline_data)
+        finally:
+            self.outbox.close()
+            self.db.close()
 
     def get_devices(self):
         """Get devices associated with this control unit using the new controller_id field"""
         try:
-            response = self.supabase.table("devices").select("*").eq(
-                "controller_id", self.control_unit_id
-            ).execute()
-
-            if isinstance(response, dict) and "data" in response:
-                devices = response["data"]
-                logger.info(f"Retrieved {len(devices)} devices for control unit")
-                return devices
-            else:
-                logger.warning("No data returned when fetching devices")
-                return []
+            devices = self._select_devices([self._unit_filter("controller_id")])
+            logger.info(f"Retrieved {len(devices)} devices for control unit")
+            return devices
         except Exception as e:
             logger.error(f"Failed to fetch devices: {e}")
             return []
 
-    def read_ds18b20(self, gpio_pin=4):
-        """Read temperature from DS18B20 sensor."""
-        sensor = W1ThermSensor()
-        temperature = sensor.get_temperature()
-        logger.info(f"DS18B20 Temperature: {temperature}°C")
-        return temperature
+    def get_devices_changed_since(self, watermark=None, column=DEVICE_SYNC_WATERMARK_COLUMN):
+        """Get devices of this control unit changed at or after the watermark
+
+        Returns None when the request fails so callers can keep their snapshot.
+        """
+        try:
+            filters = [self._unit_filter("controller_id")]
+            if watermark is not None:
+                filters.append((column, "gte", watermark))
+            return self._select_devices(filters, column)
+        except Exception as e:
+            logger.error(f"Failed to fetch changed devices: {e}")
+            return None
+
+    def get_device_ids(self):
+        """Get the ids of all devices of this control unit (cheap tombstone check)"""
+        try:
+            rows = self.db.select("devices", "id", [self._unit_filter("controller_id")])
+            return {row["id"] for row in rows}
+        except Exception as e:
+            logger.error(f"Failed to fetch device ids: {e}")
+            return None
+
+    def get_rules(self):
+        """Get the rules of this control unit, None when the request fails or no RULES_TABLE is set"""
+        if not RULES_TABLE:
+            return None
+
+        try:
+            return self.db.select(RULES_TABLE, "*", [self._unit_filter("controller_id")])
+        except Exception as e:
+            logger.error(f"Failed to fetch rules: {e}")
+            return None
+
+    def report_device_state(self, device_id, state, value=None):
+        """Queue the state and/or value of a device changed locally (e.g. by a rule or the local API)"""
+        fields = {"last_updated": datetime.now(UTC).isoformat()}
+        if state is not None:
+            fields["is_active"] = bool(state)
+        if value is not None:
+            fields["value"] = value
+        if not self.telemetry.put(device_id, fields):
+            logger.error(f"Failed to queue state of device {device_id}")
+
+    def report_inputs(self, changes):
+        """Queue the coalesced changes of digital inputs, device_id -> (active, perf_counter() timestamp, changes)"""
+        offset = time.time() - time.perf_counter()
+        for device_id, (active, timestamp, _) in changes.items():
+            fields = {
+                "is_active": active,
+                "last_updated": datetime.fromtimestamp(timestamp + offset, UTC).isoformat(),
+            }
+            if not self.telemetry.put(device_id, fields):
+                logger.error(f"Failed to queue state of input {device_id}")
 
     def update_sensor_data(self, device_id, temperature=None, humidity=None):
-        """Update sensor data in Supabase."""
+        """Update sensor data in Supabase, unless the reporting policy suppresses the value."""
+        value = temperature if temperature is not None else humidity
+        if not self.sensor_policy.should_report(device_id, value):
+            return
+
         try:
             update_data = {
                 "last_updated": datetime.now(UTC).isoformat(),
@@ -161,29 +238,102 @@ class SupabaseManager:
                 update_data["value"] = humidity  # if you want to store humidity separately
                 update_data["unit"] = "%"
 
-            response = self.supabase.table("devices").update(update_data).eq("id", device_id).execute()
-            logger.info(f"Updated sensor {device_id} data: temperature={temperature}, humidity={humidity}")
+            # Coalesced with other pending updates and written in bulk by the telemetry queue
+            if self.telemetry.put(device_id, update_data):
+                logger.info("Queued sensor %s data: temperature=%s, humidity=%s", device_id, temperature, humidity)
+            else:
+                # Not delivered, so the next value must not be compared against this one
+                self.sensor_policy.forget(device_id)
         except Exception as e:
+            self.sensor_policy.forget(device_id)
             logger.error(f"Failed to update sensor data for {device_id}: {e}")
 
-    def check_and_send_sensor_data(self):
-        """Check devices and send sensor data to Supabase if applicable."""
+    def flush_telemetry(self, rows, control_unit_update):
+        """Write coalesced device rows and the control unit metrics, raises when a write fails"""
+        if rows:
+            if self.on_device_write:
+                self.on_device_write(rows)
+            if TELEMETRY_RPC:
+                self.db.rpc(TELEMETRY_RPC, {"updates": rows})
+            elif TELEMETRY_BULK_UPSERT:
+                # Every object of a bulk upsert must have the same keys (PGRST102), so sensor values and
+                # switched states are written in one upsert per set of columns
+                groups = {}
+                for row in rows:
+                    groups.setdefault(tuple(sorted(row)), []).append(row)
+                for group in groups.values():
+                    self.db.upsert("devices", group, on_conflict="id")
+            else:
+                # Only existing rows are updated: no INSERT policy or NOT NULL defaults needed and deleted
+                # devices stay deleted. Devices getting the same values share one request
+                groups = {}
+                for row in rows:
+                    fields = {key: value for key, value in row.items() if key != "id"}
+                    groups.setdefault(tuple(sorted(fields.items())), (fields, []))[1].append(row["id"])
+                for fields, ids in groups.values():
+                    self.db.update("devices", fields, [("id", "in", ids) if len(ids) > 1 else ("id", "eq", ids[0])])
+
+        if control_unit_update:
+            self.db.update("control_units", control_unit_update, [self._unit_filter("id")])
+
+    def upload_history(self, rows):
+        """Write time-series rollups in bulk under the unit owning each series, raises when the write fails"""
+        for row in rows:
+            # System metrics and devices of unknown owner go under the primary unit
+            row["controller_id"] = row.pop("owner", None) or self.control_unit_id
+            row["bucket_start"] = datetime.fromtimestamp(row["bucket_start"], UTC).isoformat()
+        self.db.upsert(TIMESERIES_TABLE, rows, on_conflict="controller_id,series,bucket_start")
+
+    def check_and_send_sensor_data(self, devices, sampler, on_readings=None):
+        """Sample the DS18B20 devices of the given list and send their readings to Supabase.
+
+        Args:
+            devices: Device rows of this control unit
+            sampler: DS18B20Sampler reading the probes
+            on_readings: Optional callback(readings) getting device_id -> temperature before anything is sent
+        """
         try:
-            devices = self.get_devices()
-
-            if devices:
-                for device in devices:
-                    # Check if the device is a temperature sensor with '°C' as the unit and has a GPIO pin
-                    if device.get("unit") == "°C" and device.get("gpio_pin"):
-                        # Only process DS18B20 devices
-                        if device.get("subtype") == "DS18B20":
-                            temperature = self.read_ds18b20(device["gpio_pin"])  # Read temperature from DS18B20 sensor
-                            if temperature is not None:
-                                # Call update_sensor_data with temperature value
-                                self.update_sensor_data(device["id"], temperature=temperature)  # Corrected call
-
-            # Sleep for 90 seconds before checking again
-            time.sleep(90)
+            # Only temperature sensors in °C with a GPIO pin and the DS18B20 subtype are sampled
+            sensors = [
+                device for device in devices
+                if device.get("unit") == "°C" and device.get("gpio_pin") and device.get("subtype") == "DS18B20"
+            ]
+            for device in sensors:
+                self.sensor_policy.configure(device["id"], device)
+
+            readings = sampler.sample(sensors)
+            if on_readings:
+                on_readings(readings)
+
+            for device_id, temperature in readings.items():
+                logger.info("DS18B20 Temperature of %s: %s°C", device_id, temperature)
+                self.update_sensor_data(device_id, temperature=temperature)
+
+            logger.debug("Sensor reporting stats: %s", self.sensor_policy.stats)
 
         except Exception as e:
-            logger.error(f"Error fetching devices or updating sensor data: {e}")
+            logger.error(f"Error sampling or updating sensor data: {e}")
+
+    def _unit_filter(self, column):
+        """Filter matching the rows of every control unit served, one request however many units there are"""
+        if len(self.control_unit_ids) == 1:
+            return column, "eq", self.control_unit_id
+        return column, "in", self.control_unit_ids
+
+    def _select_devices(self, filters, watermark_column=DEVICE_SYNC_WATERMARK_COLUMN):
+        """Fetch the device columns the controller uses, falling back to all columns if some don't exist"""
+        columns = self.device_columns
+        if columns != "*":
+            # The owning unit tells the devices of a gateway apart
+            missing = [column for column in ("controller_id", watermark_column) if column not in columns.split(",")]
+            columns = ",".join([columns, *missing])
+
+        try:
+            return self.db.select("devices", columns, filters)
+        except PostgrestError as e:
+            # 42703: undefined column, e.g. the optional sensor_id or report_* columns
+            if e.code != "42703" or columns == "*":
+                raise
+            logger.warning(f"Devices table lacks some of the columns {columns}, fetching all columns: {e}")
+            self.device_columns = "*"
+            return self.db.select("devices", "*", filters)
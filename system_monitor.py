@@ -1,30 +1,139 @@
+import asyncio
 import os
 import time
+from array import array
+
 import psutil
-import logging
-from config import logger
+from config import logger, METRICS_SAMPLE_INTERVAL, METRICS_WINDOW
+
+
+class RingBuffer:
+    """Fixed-size, array-backed ring buffer of float samples"""
+
+    __slots__ = ("values", "size", "count", "index")
+
+    def __init__(self, size):
+        self.values = array("d", bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.index = 0
+
+    def last(self):
+        """Get the latest sample, None when empty"""
+        return self.values[self.index - 1] if self.count else None
+
+    def append(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def rollup(self):
+        """Get min, max, mean and p95 of the buffered samples, None when empty"""
+        if not self.count:
+            return None
+
+        samples = sorted(self.values[:self.count])
+        return {
+            "min": round(samples[0], 2),
+            "max": round(samples[-1], 2),
+            "mean": round(sum(samples) / self.count, 2),
+            "p95": round(samples[min(self.count - 1, int(0.95 * self.count))], 2),
+        }
 
 
 class SystemMonitor:
-    def __init__(self):
-        self.start_time = time.time()
+    THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+    def __init__(self, interval=METRICS_SAMPLE_INTERVAL, window=METRICS_WINDOW, history=None):
+        """Initialize the system monitor
+
+        Args:
+            interval: Seconds between two samples taken by run()
+            window: Seconds of history kept for the rollups
+            history: Optional TimeSeriesStore receiving every sample as series "system.<metric>"
+        """
+        self.interval = interval
+        self.history = history
+        size = max(1, int(window / interval))
+
+        cores = psutil.cpu_count() or 1
+        self.buffers = {
+            "cpu": RingBuffer(size),
+            "memory": RingBuffer(size),
+            "storage": RingBuffer(size),
+            "load_1m": RingBuffer(size),
+            "net_sent_bps": RingBuffer(size),
+            "net_recv_bps": RingBuffer(size),
+        }
+        self.core_buffers = [RingBuffer(size) for _ in range(cores)]
+        if os.path.exists(self.THERMAL_ZONE):
+            self.buffers["soc_temperature"] = RingBuffer(size)
+
+        # The first cpu_percent call only sets the reference point and always returns 0
+        psutil.cpu_percent(percpu=True)
+        self.last_net = psutil.net_io_counters()
+        self.last_sample = time.monotonic()
+
         logger.info("System monitor initialized")
 
+    async def run(self):
+        """Sample the system metrics every `interval` seconds until cancelled"""
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Failed to sample system metrics: {e}")
+            await asyncio.sleep(self.interval)
+
+    def sample(self):
+        """Take one sample of every metric into the ring buffers"""
+        now = time.monotonic()
+        elapsed = max(now - self.last_sample, 1e-6)
+        self.last_sample = now
+
+        cores = psutil.cpu_percent(percpu=True)
+        for buffer, value in zip(self.core_buffers, cores):
+            buffer.append(value)
+        self.buffers["cpu"].append(sum(cores) / len(cores))
+
+        self.buffers["memory"].append(psutil.virtual_memory().percent)
+        self.buffers["storage"].append(psutil.disk_usage('/').percent)
+        self.buffers["load_1m"].append(os.getloadavg()[0])
+
+        net = psutil.net_io_counters()
+        self.buffers["net_sent_bps"].append((net.bytes_sent - self.last_net.bytes_sent) / elapsed)
+        self.buffers["net_recv_bps"].append((net.bytes_recv - self.last_net.bytes_recv) / elapsed)
+        self.last_net = net
+
+        if "soc_temperature" in self.buffers:
+            with open(self.THERMAL_ZONE) as f:
+                self.buffers["soc_temperature"].append(int(f.read()) / 1000.0)
+
+        if self.history is not None:
+            self.history.append_many({f"system.{name}": buffer.last() for name, buffer in self.buffers.items()})
+
+    def get_rollups(self):
+        """Get min, max, mean and p95 of every metric over the sampled window"""
+        rollups = {name: buffer.rollup() for name, buffer in self.buffers.items()}
+        rollups["cpu_cores"] = [buffer.rollup() for buffer in self.core_buffers]
+        return rollups
+
     def get_cpu_usage(self):
         """Get CPU usage percentage as integer"""
-        return int(psutil.cpu_percent())
+        return self._window_mean("cpu", lambda: psutil.cpu_percent())
 
     def get_memory_usage(self):
         """Get memory usage percentage as integer"""
-        return int(psutil.virtual_memory().percent)
+        return self._window_mean("memory", lambda: psutil.virtual_memory().percent)
 
     def get_storage_usage(self):
         """Get storage usage percentage as integer"""
-        return int(psutil.disk_usage('/').percent)
+        return self._window_mean("storage", lambda: psutil.disk_usage('/').percent)
 
     def get_uptime(self):
         """Get system uptime in format 'Xd Xh Xm Xs'"""
-        uptime_seconds = time.time() - self.start_time
+        uptime_seconds = time.time() - psutil.boot_time()
         days, remainder = divmod(uptime_seconds, 86400)
         hours, remainder = divmod(remainder, 3600)
         minutes, seconds = divmod(remainder, 60)
@@ -48,3 +157,8 @@ class SystemMonitor:
             "storage_usage": self.get_storage_usage(),
             "uptime": self.get_uptime()
         }
+
+    def _window_mean(self, name, read_now):
+        """Mean over the sampled window, a direct reading when nothing was sampled yet"""
+        rollup = self.buffers[name].rollup()
+        return int(rollup["mean"] if rollup else read_now())
@@ -0,0 +1,317 @@
+import asyncio
+import threading
+import time
+
+from config import (
+    logger, TELEMETRY_FLUSH_INTERVAL, TELEMETRY_FLUSH_SIZE, TELEMETRY_MAX_PENDING, TELEMETRY_PUT_TIMEOUT,
+    OUTBOX_REPLAY_BATCHES
+)
+from postgrest_client import is_retryable
+
+
+class TelemetryQueue:
+    """Bounded write-behind queue for telemetry updates.
+
+    Pending updates are coalesced per device (latest value wins) and flushed together
+    with the pending control unit metrics as one bulk request, either when
+    `flush_size` devices are pending or when `flush_interval` seconds have passed.
+    With an outbox, failed flushes are persisted there instead of being kept in
+    memory and replayed in order before any newer update is sent. Only network and
+    server errors are retried. A write rejected for good is split into single updates
+    and the ones still rejected are quarantined (or dropped without an outbox).
+    """
+
+    def __init__(self, flush_fn, flush_interval=TELEMETRY_FLUSH_INTERVAL, flush_size=TELEMETRY_FLUSH_SIZE,
+                 max_pending=TELEMETRY_MAX_PENDING, put_timeout=TELEMETRY_PUT_TIMEOUT, outbox=None):
+        """Initialize the queue
+
+        Args:
+            flush_fn: Callable(device_rows, control_unit_update) sending one bulk write, raises on failure
+            flush_interval: Maximum seconds an update waits before it is flushed
+            flush_size: Number of pending devices that triggers an early flush
+            max_pending: Number of pending devices at which producers are blocked
+            put_timeout: Seconds a producer waits for room before the update is rejected
+            outbox: Optional Outbox receiving the updates of failed flushes
+        """
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.outbox = outbox
+
+        # Key: device_id, Value: dict of pending fields (including "id")
+        self.pending = {}
+        self.control_unit = None
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.retry_after = 0.0
+        self.stop_requested = False
+        self.thread = None
+        # Called from producers when the size trigger is reached and no flush thread is waiting
+        self.on_flush_needed = None
+
+        self.stats = {
+            "queued": 0,
+            "coalesced": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "rejected_updates": 0,
+            "rows_flushed": 0,
+            "last_flush_size": 0,
+            "max_flush_size": 0,
+            "last_flush_latency": 0.0,
+            "total_flush_latency": 0.0,
+        }
+
+    def start(self):
+        """Start the background flush thread"""
+        if self.thread and self.thread.is_alive():
+            return
+
+        self.stop_requested = False
+        self.thread = threading.Thread(target=self._run, name="telemetry-flush", daemon=True)
+        self.thread.start()
+        logger.info("Telemetry queue started")
+
+    def stop(self):
+        """Stop the flush thread and flush whatever is still pending"""
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+        logger.info("Telemetry queue stopped")
+
+    def put(self, device_id, fields):
+        """Queue an update of a device row, merging it into any pending update of the same device
+
+        Returns False when the queue stayed full for `put_timeout` seconds and the update was dropped.
+        """
+        with self.condition:
+            if device_id in self.pending:
+                self.pending[device_id].update(fields)
+                self.stats["coalesced"] += 1
+                return True
+
+            # Backpressure: wait for the flush thread to make room
+            deadline = time.monotonic() + self.put_timeout
+            while len(self.pending) >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.stop_requested:
+                    self.stats["rejected"] += 1
+                    logger.warning(f"Telemetry queue full, dropping update of device {device_id}")
+                    return False
+                self._wake_flusher()
+                self.condition.wait(remaining)
+
+            self.pending[device_id] = {"id": device_id, **fields}
+            self.stats["queued"] += 1
+            if len(self.pending) >= self.flush_size:
+                self._wake_flusher()
+            return True
+
+    def put_control_unit(self, fields):
+        """Queue an update of the control unit row, latest values win"""
+        with self.condition:
+            if self.control_unit is None:
+                self.control_unit = dict(fields)
+                self.stats["queued"] += 1
+            else:
+                self.control_unit.update(fields)
+                self.stats["coalesced"] += 1
+
+    def flush(self):
+        """Send everything pending as one bulk write, returns False when the write failed"""
+        with self.flush_lock:
+            with self.condition:
+                rows = list(self.pending.values())
+                control_unit = self.control_unit
+                self.pending = {}
+                self.control_unit = None
+                self.last_flush = time.monotonic()
+                self.condition.notify_all()
+
+            if not rows and control_unit is None:
+                return True
+
+            if self.outbox is not None and len(self.outbox):
+                # Keep the order: new updates line up behind the undelivered backlog
+                self._store(rows, control_unit)
+                return True
+
+            start = time.monotonic()
+            rows_left, control_unit_left, error = self._send(rows, control_unit)
+            if error is not None:
+                self.stats["failed_flushes"] += 1
+                logger.error(f"Failed to flush {len(rows_left)} telemetry updates: {error}")
+                if self.outbox is not None:
+                    self._store(rows_left, control_unit_left)
+                else:
+                    self._requeue(rows_left, control_unit_left)
+                return False
+
+            latency = time.monotonic() - start
+            self.stats["flushes"] += 1
+            self.stats["rows_flushed"] += len(rows)
+            self.stats["last_flush_size"] = len(rows)
+            self.stats["max_flush_size"] = max(self.stats["max_flush_size"], len(rows))
+            self.stats["last_flush_latency"] = latency
+            self.stats["total_flush_latency"] += latency
+            logger.debug("Flushed %d telemetry updates in %.1f ms", len(rows), latency * 1000)
+            return True
+
+    def replay_outbox(self, max_batches=OUTBOX_REPLAY_BATCHES):
+        """Replay undelivered updates from the outbox, returns the number of entries sent"""
+        if self.outbox is None or not len(self.outbox):
+            return 0
+
+        with self.flush_lock:
+            return self.outbox.replay(self._send_entries, max_batches)
+
+    def _send_entries(self, entries):
+        """Send a batch of outbox entries as one bulk write, in order with latest values winning"""
+        rows = {}
+        control_unit = None
+        for kind, payload in entries:
+            if kind == "devices":
+                for row in payload:
+                    rows[row["id"]] = {**rows.get(row["id"], {}), **row}
+            elif kind == "control_unit":
+                control_unit = {**(control_unit or {}), **payload}
+
+        _, _, error = self._send(list(rows.values()), control_unit)
+        if error is not None:
+            raise error
+
+    def _send(self, rows, control_unit):
+        """Send updates as one bulk write, sending them one at a time when it is rejected for good
+
+        Only the updates that are still rejected on their own are quarantined, so one bad row (e.g. a
+        column the table lacks) doesn't take the rest of the flush with it.
+
+        Returns:
+            Rows and control unit update left undelivered by a retryable error and that error,
+            ([], None, None) when nothing is left to retry
+        """
+        try:
+            self.flush_fn(rows, control_unit)
+            return [], None, None
+        except Exception as e:
+            if is_retryable(e):
+                return rows, control_unit, e
+            error = e
+
+        parts = [([row], None) for row in rows]
+        if control_unit is not None:
+            parts.append(([], control_unit))
+        if len(parts) > 1:
+            logger.warning(f"{len(parts)} telemetry updates rejected, sending them one at a time: {error}")
+            for index, (part_rows, part_control_unit) in enumerate(parts):
+                try:
+                    self.flush_fn(part_rows, part_control_unit)
+                except Exception as e:
+                    if is_retryable(e):
+                        left = parts[index:]
+                        return [row for part, _ in left for row in part], left[-1][1], e
+                    self._reject(part_rows, part_control_unit, e)
+        else:
+            self._reject(rows, control_unit, error)
+        return [], None, None
+
+    def _store(self, rows, control_unit):
+        """Persist the updates of a failed flush in the outbox"""
+        if rows:
+            self.outbox.append("devices", rows)
+        if control_unit is not None:
+            self.outbox.append("control_unit", control_unit)
+
+    def _reject(self, rows, control_unit, error):
+        """Keep updates that were rejected for good out of the retries, quarantined when there is an outbox"""
+        self.stats["rejected_updates"] += len(rows) + (control_unit is not None)
+        if self.outbox is None:
+            logger.error(f"Dropped {len(rows)} telemetry updates rejected by Supabase")
+            return
+        if rows:
+            self.outbox.quarantine("devices", rows, error)
+        if control_unit is not None:
+            self.outbox.quarantine("control_unit", control_unit, error)
+
+    def _requeue(self, rows, control_unit):
+        """Put failed updates back without overwriting anything newer queued meanwhile"""
+        with self.condition:
+            for row in rows:
+                newer = self.pending.get(row["id"])
+                self.pending[row["id"]] = {**row, **newer} if newer else row
+
+            if control_unit is not None:
+                self.control_unit = {**control_unit, **(self.control_unit or {})}
+
+    def seconds_until_flush(self):
+        """Get the seconds until the size or time trigger fires, zero or less when a flush is due"""
+        with self.condition:
+            return self._seconds_until_flush()
+
+    def run_cycle(self):
+        """Replay the outbox backlog, flush and sync the outbox once"""
+        # Catch up on the backlog first so replayed values never overwrite newer ones
+        self.replay_outbox()
+
+        if self.flush():
+            self.retry_after = 0.0
+        else:
+            # Don't hammer a failing uplink when the size trigger is still reached
+            self.retry_after = time.monotonic() + self.flush_interval
+
+        if self.outbox is not None:
+            self.outbox.maybe_sync()
+
+    async def run_async(self, executor=None):
+        """Flush on the size or time trigger from an asyncio event loop until cancelled"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self.on_flush_needed = lambda: loop.call_soon_threadsafe(wakeup.set)
+
+        try:
+            while True:
+                remaining = self.seconds_until_flush()
+                if remaining > 0:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    wakeup.clear()
+                    continue
+
+                await loop.run_in_executor(executor, self.run_cycle)
+        finally:
+            self.on_flush_needed = None
+
+    def _seconds_until_flush(self):
+        wake_at = self.last_flush + self.flush_interval
+        if len(self.pending) >= self.flush_size:
+            wake_at = min(wake_at, self.retry_after)
+        return wake_at - time.monotonic()
+
+    def _wake_flusher(self):
+        self.condition.notify_all()
+        if self.on_flush_needed is not None:
+            self.on_flush_needed()
+
+    def _run(self):
+        """Flush on the size or time trigger until stopped"""
+        while True:
+            with self.condition:
+                while not self.stop_requested:
+                    remaining = self._seconds_until_flush()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                if self.stop_requested:
+                    return
+
+            self.run_cycle()
@@ -0,0 +1,78 @@
+import mmap
+import os
+
+import pytest
+
+from actuation_process import COMMAND, SLOT_SIZE, ActuationProcessBackend, Ring
+
+
+@pytest.fixture
+def rings():
+    """Producer and consumer ends of a ring of 4 slots"""
+    buffer = mmap.mmap(-1, Ring.size(4))
+    read, write = os.pipe()
+    yield Ring(buffer, 0, 4, write), Ring(buffer, 0, 4, read)
+    os.close(read)
+    os.close(write)
+    buffer.close()
+
+
+def test_full_ring_refuses_until_a_slot_is_read(rings):
+    producer, consumer = rings
+    for sequence in range(4):
+        assert producer.put(COMMAND, (sequence, 1), b"x")
+    assert not producer.put(COMMAND, (4, 1), b"x")
+
+    assert consumer.wait() == 4
+    assert consumer.get(COMMAND) == ((0, 1), b"x")
+    assert producer.put(COMMAND, (4, 1), b"y")
+
+
+def test_slots_are_reused_in_order(rings):
+    producer, consumer = rings
+    received = []
+    for sequence in range(10):
+        assert producer.put(COMMAND, (sequence, 2), bytes([sequence]) * sequence)
+        consumer.wait()
+        received.append(consumer.get(COMMAND))
+
+    assert received == [((sequence, 2), bytes([sequence]) * sequence) for sequence in range(10)]
+
+
+def test_payload_must_fit_a_slot(rings):
+    producer, _ = rings
+    with pytest.raises(ValueError):
+        producer.put(COMMAND, (1, 1), b"x" * SLOT_SIZE)
+
+
+@pytest.fixture
+def backend():
+    backend = ActuationProcessBackend("sim", cpus="", priority=0, slots=8, timeout=10)
+    yield backend
+    backend.close()
+
+
+def test_worker_applies_and_reads_back(backend):
+    backend.setup_output(17, False)
+    ack = backend.apply({17: True})
+
+    assert ack.ok
+    assert ack.sent <= ack.received <= ack.applied <= ack.acked
+    assert backend.read(17) is True
+
+
+def test_worker_errors_are_raised(backend):
+    with pytest.raises(RuntimeError):
+        backend.apply({18: True})
+    assert backend.stats["errors"] == 1
+
+
+def test_dead_worker_is_restarted_with_its_pins(backend):
+    backend.setup_output(17, True)
+    process = backend.worker.process
+    process.kill()
+    process.wait()
+    backend.worker.ack_thread.join(5)
+
+    assert backend.read(17) is True
+    assert backend.stats["restarts"] == 1
@@ -0,0 +1,83 @@
+from boot_snapshot import BootSnapshot
+from device_sync import DeviceSync
+from gpio_backend import SimulatedGPIOBackend
+from gpio_manager import GPIOManager
+from main import RaspberryPiController
+from rule_engine import RuleEngine
+from test_device_sync import FakeSupabase
+
+
+def make_controller(tmp_path):
+    """Controller with only what save_snapshot needs, nothing touches the network"""
+    controller = RaspberryPiController.__new__(RaspberryPiController)
+    controller.gpio = GPIOManager(SimulatedGPIOBackend())
+    controller.boot_snapshot = BootSnapshot(str(tmp_path / "boot_snapshot.json"))
+    controller.device_sync = DeviceSync(
+        FakeSupabase([{"id": "a", "type": "switch", "gpio_pin": 17, "is_active": False}]), controller.gpio
+    )
+    controller.device_sync.sync(full=True)
+    controller.rules = RuleEngine(controller.gpio)
+    controller.snapshot_version = (0, 0)
+    return controller
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot = BootSnapshot(str(tmp_path / "boot_snapshot.json"))
+    assert snapshot.load() is None
+
+    snapshot.save([{"id": "a", "is_active": True}])
+    assert snapshot.load() == [{"id": "a", "is_active": True}]
+
+
+def test_local_changes_reach_the_snapshot(tmp_path):
+    controller = make_controller(tmp_path)
+    controller.save_snapshot()
+    saves = controller.boot_snapshot.stats["saves"]
+
+    # Switched by a rule or the local API: the GPIO manager changes, the synced rows don't
+    controller.gpio.update_device_state("a", True)
+    controller.save_snapshot()
+
+    assert controller.boot_snapshot.stats["saves"] == saves + 1
+    assert controller.boot_snapshot.load()[0]["is_active"] is True
+
+
+def test_unchanged_devices_are_not_saved_again(tmp_path):
+    controller = make_controller(tmp_path)
+    controller.save_snapshot()
+    saves = controller.boot_snapshot.stats["saves"]
+
+    controller.save_snapshot()
+    assert controller.boot_snapshot.stats["saves"] == saves
+
+
+def test_rules_are_kept_for_the_next_boot(tmp_path):
+    controller = make_controller(tmp_path)
+    controller.save_snapshot()
+    saves = controller.boot_snapshot.stats["saves"]
+
+    controller.rules.load([{
+        "id": "r", "sensor_device_id": "t", "operator": ">", "threshold": 24, "hysteresis": 0.5,
+        "target_device_id": "a", "target_state": True,
+    }])
+    controller.save_snapshot()
+    assert controller.boot_snapshot.stats["saves"] == saves + 1
+
+    snapshot = BootSnapshot(controller.boot_snapshot.path)
+    snapshot.load()
+    rules = RuleEngine(controller.gpio)
+    rules.load(snapshot.rules)
+    assert rules.evaluate({"t": 25}) == [("a", True, "r", 25)]
+
+
+def test_input_edges_do_not_rewrite_the_snapshot(tmp_path):
+    controller = make_controller(tmp_path)
+    controller.gpio.register_device("button", 22, "sensor", False)
+    controller.save_snapshot()
+    saves = controller.boot_snapshot.stats["saves"]
+
+    controller.handle_input("button", True, 0.0)
+    controller.handle_input("button", False, 0.1)
+    controller.save_snapshot()
+
+    assert controller.boot_snapshot.stats["saves"] == saves
@@ -0,0 +1,91 @@
+from device_sync import DeviceSync
+from gpio_backend import SimulatedGPIOBackend
+from gpio_manager import GPIOManager
+
+
+class FakeSupabase:
+    """Device rows of one control unit, changes are stamped with an increasing updated_at"""
+
+    def __init__(self, rows):
+        self.clock = 0
+        self.rows = {}
+        for row in rows:
+            self.put(row)
+
+    def put(self, row):
+        self.clock += 1
+        self.rows[row["id"]] = {**row, "updated_at": self.clock}
+
+    def get_devices_changed_since(self, watermark=None):
+        return [dict(row) for row in self.rows.values() if watermark is None or row["updated_at"] >= watermark]
+
+    def get_device_ids(self):
+        return set(self.rows)
+
+
+def make_sync(rows):
+    backend = SimulatedGPIOBackend()
+    supabase = FakeSupabase(rows)
+    return DeviceSync(supabase, GPIOManager(backend)), supabase, backend
+
+
+def test_first_sync_registers_every_device():
+    sync, _, backend = make_sync([
+        {"id": "a", "type": "switch", "gpio_pin": 17, "is_active": True},
+        {"id": "b", "type": "switch", "gpio_pin": 18, "is_active": False},
+    ])
+
+    stats = sync.sync(full=True)
+
+    assert stats["added"] == 2
+    assert backend.levels == {17: True, 18: False}
+
+
+def test_unchanged_devices_are_not_touched():
+    sync, _, backend = make_sync([{"id": "a", "type": "switch", "gpio_pin": 17, "is_active": True}])
+    sync.sync(full=True)
+    writes = backend.stats["writes"]
+    setups = backend.stats["setups"]
+
+    stats = sync.sync()
+
+    assert stats["pins_touched"] == 0
+    assert backend.stats["writes"] == writes
+    assert backend.stats["setups"] == setups
+
+
+def test_state_change_writes_only_that_pin():
+    sync, supabase, backend = make_sync([
+        {"id": "a", "type": "switch", "gpio_pin": 17, "is_active": False},
+        {"id": "b", "type": "switch", "gpio_pin": 18, "is_active": False},
+    ])
+    sync.sync(full=True)
+    pins_written = backend.stats["pins_written"]
+
+    supabase.put({"id": "b", "type": "switch", "gpio_pin": 18, "is_active": True})
+    stats = sync.sync()
+
+    assert stats["changed"] == 1
+    assert backend.levels[18] is True
+    assert backend.stats["pins_written"] == pins_written + 1
+
+
+def test_deleted_device_releases_its_pin():
+    sync, supabase, backend = make_sync([{"id": "a", "type": "switch", "gpio_pin": 17, "is_active": True}])
+    sync.sync(full=True)
+
+    del supabase.rows["a"]
+    stats = sync.sync()
+
+    assert stats["removed"] == 1
+    assert 17 not in backend.modes
+    assert "a" not in sync.gpio.devices
+
+
+def test_failed_fetch_keeps_the_snapshot():
+    sync, supabase, _ = make_sync([{"id": "a", "type": "switch", "gpio_pin": 17, "is_active": True}])
+    sync.sync(full=True)
+    supabase.get_devices_changed_since = lambda watermark=None: None
+
+    assert sync.sync() is None
+    assert [row["id"] for row in sync.get_devices()] == ["a"]
@@ -0,0 +1,165 @@
+import time
+
+import pytest
+
+from digital_inputs import DigitalInput, DigitalInputs
+
+
+class Timer:
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeLoop:
+    """Event loop stand-in running the call_later() timers on the fake clock"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.timers = []
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(self.clock() + delay, callback, args)
+        self.timers.append(timer)
+        return timer
+
+    def advance_to(self, when):
+        """Run the timers due until `when` in order, then move the clock there"""
+        while True:
+            due = [timer for timer in self.timers if timer.when <= when and not timer.cancelled]
+            if not due:
+                break
+            timer = min(due, key=lambda item: item.when)
+            self.timers.remove(timer)
+            self.clock.now = timer.when
+            timer.callback(*timer.args)
+        self.clock.now = when
+
+
+@pytest.fixture
+def perf_clock(clock, monkeypatch):
+    clock.now = 0.0
+    monkeypatch.setattr(time, "perf_counter", clock)
+    return clock
+
+
+def make_inputs(clock, debounce=0.5, glitch=0.0):
+    """Inputs with one pull-up button on GPIO 5, released (high) at the start
+
+    Times are multiples of 1/16 s so the fake clock adds up exactly.
+    """
+    changes = []
+    inputs = DigitalInputs(None, lambda device_id, active, timestamp: changes.append((active, timestamp)))
+    inputs.loop = FakeLoop(clock)
+    item = DigitalInput("button", 5, True, debounce, glitch)
+    inputs.inputs = {"button": item}
+    inputs.by_pin = {5: item}
+    inputs._initialize(item, True)
+    return inputs, changes
+
+
+def edge(inputs, level, at):
+    """An edge seen at `at`, handled once the loop got there"""
+    inputs.loop.advance_to(at)
+    inputs._on_edge(5, level, at)
+
+
+def test_leading_edge_is_accepted_right_away(perf_clock):
+    inputs, changes = make_inputs(perf_clock)
+
+    edge(inputs, False, 1.0)
+
+    assert changes == [(True, 1.0)]
+
+
+def test_bounces_within_the_debounce_time_are_ignored(perf_clock):
+    inputs, changes = make_inputs(perf_clock)
+
+    for index, level in enumerate([False, True, False, True, False]):
+        edge(inputs, level, 1.0 + index * 0.0625)
+    inputs.loop.advance_to(3.0)
+
+    assert changes == [(True, 1.0)]
+    assert inputs.stats == {"edges": 5, "accepted": 1, "reports": 0}
+
+
+def test_release_during_the_debounce_time_is_seen_once_it_ends(perf_clock):
+    inputs, changes = make_inputs(perf_clock)
+
+    edge(inputs, False, 1.0)
+    edge(inputs, True, 1.125)
+    inputs.loop.advance_to(1.4375)
+    assert changes == [(True, 1.0)]
+
+    inputs.loop.advance_to(1.5)
+    assert changes == [(True, 1.0), (False, 1.125)]
+
+
+def test_edge_after_the_debounce_time_is_accepted(perf_clock):
+    inputs, changes = make_inputs(perf_clock)
+
+    edge(inputs, False, 1.0)
+    edge(inputs, True, 1.5)
+
+    assert changes == [(True, 1.0), (False, 1.5)]
+
+
+def test_glitch_shorter_than_the_filter_is_dropped(perf_clock):
+    inputs, changes = make_inputs(perf_clock, glitch=0.25)
+
+    edge(inputs, False, 1.0)
+    edge(inputs, True, 1.125)
+    inputs.loop.advance_to(3.0)
+
+    assert changes == []
+    assert inputs.stats["accepted"] == 0
+
+
+def test_level_holding_for_the_glitch_filter_is_accepted(perf_clock):
+    inputs, changes = make_inputs(perf_clock, glitch=0.25)
+
+    edge(inputs, False, 1.0)
+    inputs.loop.advance_to(1.1875)
+    assert changes == []
+
+    inputs.loop.advance_to(1.25)
+    assert changes == [(True, 1.0)]
+
+
+def test_glitch_filter_waits_for_the_last_edge(perf_clock):
+    inputs, changes = make_inputs(perf_clock, glitch=0.25)
+
+    edge(inputs, False, 1.0)
+    edge(inputs, True, 1.125)
+    edge(inputs, False, 1.1875)
+    inputs.loop.advance_to(1.375)
+    assert changes == []
+
+    inputs.loop.advance_to(1.4375)
+    assert changes == [(True, 1.1875)]
+
+
+def test_changes_are_coalesced_for_reporting(perf_clock):
+    inputs, _ = make_inputs(perf_clock)
+
+    edge(inputs, False, 1.0)
+    edge(inputs, True, 2.0)
+    edge(inputs, False, 3.0)
+
+    assert inputs.changed == {"button": (True, 3.0, 3)}
+
+
+@pytest.mark.parametrize("row, expected", [
+    ({}, (7, True, 0.02, 0.0)),
+    ({"input_pull": "None", "input_debounce_ms": 50, "input_glitch_ms": "5"}, (7, None, 0.05, 0.005)),
+    ({"input_pull": "down", "input_debounce_ms": 0}, (7, False, 0.0, 0.0)),
+])
+def test_row_columns_override_the_defaults(row, expected):
+    item = DigitalInputs(None)._configure({"id": "button", "gpio_pin": "7", **row})
+
+    assert item.config == expected
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+from device_sync import DeviceSync
+from event_dispatcher import EventDispatcher
+from gpio_backend import SimulatedGPIOBackend
+from gpio_manager import GPIOManager
+from test_device_sync import FakeSupabase
+
+
+def test_events_of_a_device_are_coalesced():
+    applied = []
+    dispatcher = EventDispatcher(lambda event_type, data: applied.append((event_type, data["is_active"])))
+
+    async def main():
+        dispatcher.submit("device_created", {"id": "a", "is_active": False})
+        dispatcher.submit("device_updated", {"id": "a", "is_active": True})
+        dispatcher.submit("device_updated", {"id": "b", "is_active": True})
+        task = asyncio.create_task(dispatcher.run())
+        while dispatcher.stats["applied"] < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(main())
+    assert sorted(applied) == [("device_created", True), ("device_updated", True)]
+    assert dispatcher.stats["coalesced"] == 1
+
+
+def test_full_queue_drops_new_devices():
+    dispatcher = EventDispatcher(lambda event_type, data: None, max_pending=1)
+
+    assert dispatcher.submit("device_updated", {"id": "a"})
+    assert dispatcher.submit("device_updated", {"id": "a"})
+    assert not dispatcher.submit("device_updated", {"id": "b"})
+
+
+def test_resync_and_dispatch_run_concurrently():
+    """A resync fetching while an event is applied must not deadlock on the GPIO batch and the sync lock"""
+    gpio = GPIOManager(SimulatedGPIOBackend())
+    supabase = FakeSupabase([{"id": "a", "type": "switch", "gpio_pin": 17, "is_active": False}])
+    device_sync = DeviceSync(supabase, gpio)
+    device_sync.sync(full=True)
+
+    fetching = threading.Event()
+    fetch = supabase.get_devices_changed_since
+
+    def slow_fetch(watermark=None):
+        fetching.set()
+        # The event is applied while the resync waits for Supabase
+        threading.Event().wait(0.2)
+        return fetch(watermark)
+
+    supabase.get_devices_changed_since = slow_fetch
+    supabase.put({"id": "b", "type": "switch", "gpio_pin": 18, "is_active": True})
+
+    def handle(event_type, device_data):
+        gpio.update_device_state(device_data["id"], device_data["is_active"])
+        device_sync.note_realtime(event_type, device_data)
+        device_sync.get_devices()
+
+    dispatcher = EventDispatcher(handle, batch=gpio.batch)
+
+    def dispatch():
+        fetching.wait(5)
+        supabase.put({"id": "a", "type": "switch", "gpio_pin": 17, "is_active": True})
+        dispatcher._apply({"a": ("device_updated", {"id": "a", "is_active": True}, 0.0)})
+
+    threads = [threading.Thread(target=device_sync.sync, daemon=True), threading.Thread(target=dispatch, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert dispatcher.stats["applied"] == 1
+    assert gpio.backend.levels == {17: True, 18: True}
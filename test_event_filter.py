@@ -0,0 +1,88 @@
+import pytest
+
+from device_registry import DeviceRecord, DeviceRegistry, DeviceType
+from event_filter import EventFilter
+
+
+@pytest.fixture
+def registry():
+    registry = DeviceRegistry()
+    registry.add(DeviceRecord("fan", 17, DeviceType.SWITCH, False))
+    registry.add(DeviceRecord("t", 4, DeviceType.TEMPERATURE))
+    return registry
+
+
+def update(device_id="fan", **fields):
+    pins = {"fan": (17, "switch"), "t": (4, "temperature")}
+    gpio_pin, device_type = pins[device_id]
+    return {"id": device_id, "gpio_pin": gpio_pin, "type": device_type, "updated_at": "2026-01-01", **fields}
+
+
+def test_echo_of_a_write_is_dropped_once(clock, registry):
+    events = EventFilter(registry, ttl=5)
+    events.remember([{"id": "t", "value": 21.5, "last_updated": "2026-01-01"}])
+
+    assert not events.accept("device_updated", update("t", value=21.5))
+    assert events.stats["echoes"] == 1
+    # The write was consumed, the same values again are an unchanged sensor update
+    assert not events.accept("device_updated", update("t", value=21.5))
+    assert events.stats["unchanged"] == 1
+
+
+@pytest.mark.parametrize("elapsed, echo", [(4.99, True), (5, False)])
+def test_echo_expires_after_the_ttl(clock, registry, elapsed, echo):
+    events = EventFilter(registry, ttl=5)
+    events.remember([{"id": "fan", "is_active": True}])
+
+    clock.advance(elapsed)
+    # Past the TTL the update is taken for a change made elsewhere
+    assert events.accept("device_updated", update(is_active=True)) is not echo
+
+
+def test_echo_of_a_later_write_consumes_the_older_ones(clock, registry):
+    events = EventFilter(registry)
+    events.remember([{"id": "fan", "is_active": True}])
+    events.remember([{"id": "fan", "is_active": False}])
+
+    assert not events.accept("device_updated", update(is_active=False))
+    assert "fan" not in events.writes
+
+
+def test_different_values_are_not_an_echo(clock, registry):
+    events = EventFilter(registry)
+    events.remember([{"id": "fan", "is_active": False}])
+
+    assert events.accept("device_updated", update(is_active=True))
+    assert events.stats["passed"] == 1
+
+
+def test_expired_writes_are_forgotten(clock, registry):
+    events = EventFilter(registry, ttl=5)
+    events.remember([{"id": "fan", "is_active": True}])
+
+    clock.advance(5)
+    events.remember([{"id": "t", "value": 1.0}])
+
+    assert list(events.writes) == ["t"]
+
+
+def test_updates_changing_nothing_are_dropped(clock, registry):
+    events = EventFilter(registry)
+
+    assert not events.accept("device_updated", update(is_active=False, name="Fan"))
+    assert events.accept("device_updated", update(is_active=False, gpio_pin=18))
+    assert events.accept("device_updated", update(is_active=False, type="sensor"))
+
+
+def test_pending_device_always_passes(clock, registry):
+    events = EventFilter(registry, is_pending=lambda device_id: device_id == "fan")
+
+    assert events.accept("device_updated", update(is_active=False))
+
+
+@pytest.mark.parametrize("event_type", ["device_created", "device_deleted"])
+def test_inserts_and_deletes_always_pass(clock, registry, event_type):
+    events = EventFilter(registry)
+    events.remember([{"id": "fan", "is_active": False}])
+
+    assert events.accept(event_type, update(is_active=False))
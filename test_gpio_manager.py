@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from gpio_backend import SimulatedGPIOBackend
+from gpio_manager import GPIOManager
+
+
+@pytest.fixture
+def gpio():
+    return GPIOManager(SimulatedGPIOBackend())
+
+
+def test_output_pin_conflict_is_rejected(gpio, caplog):
+    assert gpio.register_device("a", 17, "switch", True)
+
+    assert not gpio.register_device("b", 17, "relay")
+    assert "b" not in gpio.registry
+    assert gpio.backend.levels == {17: True}
+    assert "already used by device a" in caplog.text
+    assert "Invalid GPIO pin" not in caplog.text
+
+
+def test_moving_an_output_releases_the_old_pin(gpio):
+    gpio.register_device("a", 17, "switch", True)
+
+    assert gpio.register_device("a", 18, "switch", False)
+    assert gpio.backend.modes == {18: "out"}
+    assert list(gpio.registry.on_pin(18)) == ["a"]
+
+    # The released pin is free for another device
+    assert gpio.register_device("b", 17, "switch")
+
+
+def test_output_turned_into_a_sensor_releases_its_pin(gpio):
+    gpio.register_device("a", 17, "switch", True)
+
+    assert gpio.register_device("a", 17, "sensor")
+    assert 17 not in gpio.backend.modes
+
+
+def test_failed_setup_leaves_the_pin_unclaimed(gpio):
+    def fail(pin, state):
+        raise RuntimeError("pin is busy")
+
+    gpio.backend.setup_output = fail
+
+    assert not gpio.register_device("a", 17, "switch")
+    assert "a" not in gpio.registry
+    assert not gpio.registry.on_pin(17)
+
+
+def test_concurrent_registrations_claim_a_pin_once(gpio):
+    barrier = threading.Barrier(8)
+    results = []
+
+    def register(device_id):
+        barrier.wait()
+        results.append(gpio.register_device(device_id, 17, "switch"))
+
+    threads = [threading.Thread(target=register, args=(f"device-{index}",)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+    assert len(gpio.registry.on_pin(17)) == 1
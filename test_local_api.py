@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from local_api import HEADER, SEQUENCE, StateReader, StateView
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "states")
+
+
+def test_reader_sees_the_latest_publish(path):
+    view = StateView(path, size=4096)
+    reader = StateReader(path)
+
+    view.publish({"devices": {"a": {"state": False}}})
+    view.publish({"devices": {"a": {"state": True}}})
+
+    assert reader.read() == {"devices": {"a": {"state": True}}}
+    assert view.sequence == 4
+    reader.close()
+    view.close()
+
+
+def test_payload_larger_than_the_file_is_not_published(path):
+    view = StateView(path, size=HEADER.size + 16)
+    reader = StateReader(path)
+    assert view.publish({"devices": {}})
+
+    assert not view.publish({"devices": {"a-long-device-id": {"state": True}}})
+    assert reader.read() == {"devices": {}}
+    reader.close()
+    view.close()
+
+
+def test_reader_retries_while_a_write_is_in_progress(path):
+    view = StateView(path, size=4096)
+    reader = StateReader(path)
+    view.publish({"devices": {}})
+
+    SEQUENCE.pack_into(view.map, 8, view.sequence + 1)
+    with pytest.raises(RuntimeError):
+        reader.read(retries=3)
+
+    SEQUENCE.pack_into(view.map, 8, view.sequence)
+    assert reader.read() == {"devices": {}}
+    reader.close()
+    view.close()
+
+
+def test_torn_payload_fails_the_checksum(path):
+    view = StateView(path, size=4096)
+    reader = StateReader(path)
+    view.publish({"devices": {"a": {"state": True}}})
+
+    view.map[HEADER.size] = ord("[")
+    with pytest.raises(RuntimeError):
+        reader.read(retries=3)
+    reader.close()
+    view.close()
+
+
+def test_reader_follows_a_new_file(path):
+    view = StateView(path, size=4096)
+    reader = StateReader(path)
+    view.publish({"devices": {"a": {}}})
+    assert reader.read() == {"devices": {"a": {}}}
+
+    # A restarted controller creates a new file in place of the old one
+    os.remove(path)
+    view.close()
+    view = StateView(path, size=4096)
+    view.publish({"devices": {"b": {}}})
+
+    assert reader.read() == {"devices": {"b": {}}}
+    reader.close()
+    view.close()
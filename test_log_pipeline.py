@@ -0,0 +1,58 @@
+import logging
+
+import pytest
+
+from log_pipeline import NonBlockingQueueHandler, RateLimitFilter
+
+
+def record(created, lineno=10, msg="Failed to connect: %s", args=("timeout",)):
+    item = logging.LogRecord("raspberry-iot", logging.ERROR, "realtime_manager.py", lineno, msg, args, None)
+    item.created = created
+    return item
+
+
+def test_burst_passes_then_the_site_is_suppressed():
+    limit = RateLimitFilter(burst=3, interval=60)
+
+    assert [limit.filter(record(1000 + index)) for index in range(5)] == [True, True, True, False, False]
+    assert limit.suppressed == 2
+
+
+@pytest.mark.parametrize("elapsed, passed", [(59.99, False), (60, True)])
+def test_window_ends_after_the_interval(elapsed, passed):
+    limit = RateLimitFilter(burst=1, interval=60)
+    limit.filter(record(1000))
+
+    assert limit.filter(record(1000 + elapsed)) is passed
+
+
+def test_first_record_of_the_next_window_counts_the_suppressed_ones():
+    limit = RateLimitFilter(burst=1, interval=60)
+    limit.filter(record(1000))
+    limit.filter(record(1001))
+    limit.filter(record(1002))
+
+    item = record(1060)
+    assert limit.filter(item)
+    assert item.getMessage() == "Failed to connect: timeout (2 similar messages suppressed)"
+    # Nothing was suppressed in the window after that one
+    item = record(1120)
+    limit.filter(item)
+    assert item.getMessage() == "Failed to connect: timeout"
+
+
+def test_call_sites_are_limited_separately():
+    limit = RateLimitFilter(burst=1, interval=60)
+
+    assert limit.filter(record(1000, lineno=10))
+    assert limit.filter(record(1000, lineno=20))
+    assert not limit.filter(record(1001, lineno=10, msg="Another error text"))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(maxsize=2)
+    for index in range(3):
+        handler.handle(record(1000 + index))
+
+    assert handler.queued == 2
+    assert handler.dropped == 1
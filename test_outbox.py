@@ -0,0 +1,184 @@
+import sqlite3
+
+import httpx
+import pytest
+
+from outbox import Outbox
+from postgrest_client import PostgrestError
+from telemetry_queue import TelemetryQueue
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.db"), max_entries=100, replay_batch_size=4, replay_rate=0)
+    yield outbox
+    outbox.close()
+
+
+class Sender:
+    """Send function failing for the payloads in `errors`"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    def __call__(self, entries):
+        for kind, payload in entries:
+            if payload["n"] in self.errors:
+                raise self.errors[payload["n"]]
+        self.sent.extend(payload["n"] for _, payload in entries)
+
+
+def fill(outbox, count):
+    for n in range(count):
+        outbox.append("control_unit", {"n": n})
+    outbox.sync()
+
+
+def quarantined(outbox):
+    return outbox.db.execute("SELECT payload, error FROM outbox_quarantine ORDER BY seq").fetchall()
+
+
+def test_replay_delivers_in_order(outbox):
+    fill(outbox, 10)
+    send = Sender()
+
+    assert outbox.replay(send) == 10
+    assert send.sent == list(range(10))
+    assert len(outbox) == 0
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ConnectError("offline"),
+    PostgrestError(503, "Service Unavailable"),
+    PostgrestError(429, "Too Many Requests"),
+])
+def test_retryable_errors_keep_the_entries(outbox, error):
+    fill(outbox, 6)
+
+    assert outbox.replay(Sender({5: error})) == 4
+    assert len(outbox) == 2
+    assert quarantined(outbox) == []
+
+
+def test_rejected_entry_is_quarantined_and_the_rest_delivered(outbox):
+    fill(outbox, 10)
+    send = Sender({2: PostgrestError(400, "All object keys must match", code="PGRST102")})
+
+    assert outbox.replay(send) == 9
+    assert send.sent == [0, 1, 3, 4, 5, 6, 7, 8, 9]
+    assert quarantined(outbox) == [('{"n":2}', "400 All object keys must match")]
+    assert outbox.stats["quarantined"] == 1
+    assert len(outbox) == 0
+
+
+def test_network_error_while_isolating_stops_the_replay(outbox):
+    fill(outbox, 4)
+    send = Sender({1: PostgrestError(400, "Bad Request")})
+
+    def flaky(entries):
+        if len(entries) == 1 and entries[0][1]["n"] == 1:
+            raise httpx.ReadTimeout("timeout")
+        send(entries)
+
+    assert outbox.replay(flaky) == 1
+    assert len(outbox) == 3
+    assert quarantined(outbox) == []
+
+
+def test_count_is_kept_without_querying(outbox):
+    fill(outbox, 8)
+    outbox.append("control_unit", {"n": 8})
+    outbox.replay(Sender(), max_batches=1)
+
+    assert len(outbox) == 5
+    assert outbox.stored == outbox.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 5
+
+
+def test_count_survives_a_reopen(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    outbox = Outbox(path, max_entries=5)
+    fill(outbox, 7)
+    assert len(outbox) == 5
+    outbox.close()
+
+    outbox = Outbox(path)
+    assert len(outbox) == 5
+    outbox.close()
+
+
+def test_rejected_flush_does_not_block_the_queue(outbox):
+    calls = []
+
+    def flush(rows, control_unit):
+        if any("bogus" in row for row in rows):
+            raise PostgrestError(400, "Could not find the 'bogus' column")
+        calls.append(rows)
+
+    queue = TelemetryQueue(flush, outbox=outbox)
+    queue.put("a", {"bogus": 1})
+    assert queue.flush()
+    queue.put("a", {"value": 1})
+
+    assert queue.flush()
+    assert calls == [[{"id": "a", "value": 1}]]
+    assert queue.stats["rejected_updates"] == 1
+    assert len(quarantined(outbox)) == 1
+
+
+def test_only_the_rejected_row_is_quarantined(outbox):
+    calls = []
+
+    def flush(rows, control_unit):
+        if any("bogus" in row for row in rows):
+            raise PostgrestError(400, "Could not find the 'bogus' column")
+        calls.append((rows, control_unit))
+
+    queue = TelemetryQueue(flush, outbox=outbox)
+    queue.put("a", {"value": 1})
+    queue.put("b", {"bogus": 1})
+    queue.put_control_unit({"cpu_usage": 5})
+
+    assert queue.flush()
+    assert calls == [([{"id": "a", "value": 1}], None), ([], {"cpu_usage": 5})]
+    assert queue.stats["rejected_updates"] == 1
+    assert len(quarantined(outbox)) == 1
+    assert len(outbox) == 0
+
+
+def test_network_error_while_isolating_keeps_the_rest(outbox):
+    calls = []
+    offline = {"b"}
+
+    def flush(rows, control_unit):
+        if any("bogus" in row for row in rows):
+            raise PostgrestError(400, "Could not find the 'bogus' column")
+        if any(row["id"] in offline for row in rows):
+            raise ConnectionError("offline")
+        calls.append(rows)
+
+    queue = TelemetryQueue(flush, outbox=outbox)
+    queue.put("a", {"value": 1})
+    queue.put("b", {"value": 2})
+    queue.put("c", {"bogus": 3})
+
+    assert not queue.flush()
+    assert calls == [[{"id": "a", "value": 1}]]
+    assert len(outbox) == 1
+    assert not quarantined(outbox)
+
+    offline.clear()
+    queue.replay_outbox()
+    assert calls[1:] == [[{"id": "b", "value": 2}]]
+    assert len(outbox) == 0
+    assert len(quarantined(outbox)) == 1
+
+
+def test_database_survives_a_crash(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    outbox = Outbox(path)
+    fill(outbox, 3)
+
+    # Another connection sees what was synced without a close
+    assert sqlite3.connect(path).execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 3
+    outbox.close()
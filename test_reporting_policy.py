@@ -0,0 +1,126 @@
+import pytest
+
+from reporting_policy import ReportingPolicy, ReportingSettings
+
+
+def make_policy(rate_limit=0.0, burst=10, **settings):
+    policy = ReportingPolicy(ReportingSettings(**settings), rate_limit=rate_limit, burst=burst)
+    policy.last_refill = 0.0
+    return policy
+
+
+def test_first_value_is_always_reported():
+    policy = make_policy(abs_deadband=100)
+
+    assert policy.should_report("t", 20.0, now=0)
+
+
+@pytest.mark.parametrize("value, reported", [(20.5, False), (20.51, True), (19.5, False), (19.49, True)])
+def test_absolute_deadband_edges(value, reported):
+    policy = make_policy(abs_deadband=0.5)
+    policy.should_report("t", 20.0, now=0)
+
+    assert policy.should_report("t", value, now=1) is reported
+
+
+@pytest.mark.parametrize("value, reported", [(20.2, False), (20.21, True)])
+def test_relative_deadband_edges(value, reported):
+    policy = make_policy(rel_deadband=1)
+    policy.should_report("t", 20.0, now=0)
+
+    assert policy.should_report("t", value, now=1) is reported
+
+
+def test_both_deadbands_have_to_be_exceeded():
+    policy = make_policy(abs_deadband=0.1, rel_deadband=5)
+    policy.should_report("t", 20.0, now=0)
+
+    assert not policy.should_report("t", 20.5, now=1)
+    assert policy.should_report("t", 21.5, now=2)
+
+
+def test_deadband_is_measured_from_the_last_reported_value():
+    policy = make_policy(abs_deadband=0.5)
+    policy.should_report("t", 20.0, now=0)
+
+    # Creeping up in suppressed steps still reports once the total change is past the deadband
+    assert not policy.should_report("t", 20.3, now=1)
+    assert not policy.should_report("t", 20.5, now=2)
+    assert policy.should_report("t", 20.6, now=3)
+
+
+def test_min_interval_holds_back_large_changes():
+    policy = make_policy(min_interval=10)
+    policy.should_report("t", 20.0, now=0)
+
+    assert not policy.should_report("t", 30.0, now=9.99)
+    assert policy.should_report("t", 30.0, now=10)
+
+
+def test_heartbeat_after_max_interval():
+    policy = make_policy(abs_deadband=1, max_interval=60)
+    policy.should_report("t", 20.0, now=0)
+
+    assert not policy.should_report("t", 20.0, now=59.9)
+    assert policy.should_report("t", 20.0, now=60)
+    assert policy.stats["forced"] == 1
+    # The heartbeat restarts the interval
+    assert not policy.should_report("t", 20.0, now=100)
+
+
+def test_no_heartbeat_without_max_interval():
+    policy = make_policy(max_interval=0)
+    policy.should_report("t", 20.0, now=0)
+
+    assert not policy.should_report("t", 20.0, now=10 ** 6)
+
+
+def test_tuples_are_reported_when_any_component_changes():
+    policy = make_policy(abs_deadband=1)
+    policy.should_report("cu", (10, 20, 30), now=0)
+
+    assert not policy.should_report("cu", (10.5, 20.5, 29.5), now=1)
+    assert policy.should_report("cu", (10, 20, 31.5), now=2)
+
+
+def test_other_values_are_compared_for_equality():
+    policy = make_policy(abs_deadband=1)
+    policy.should_report("s", "on", now=0)
+
+    assert not policy.should_report("s", "on", now=1)
+    assert policy.should_report("s", "off", now=2)
+
+
+def test_rate_limit_allows_a_burst_then_refills():
+    policy = make_policy(rate_limit=1, burst=2)
+
+    assert [policy.should_report(key, 1.0, now=0) for key in "abc"] == [True, True, False]
+    assert policy.stats["rate_limited"] == 1
+    assert policy.should_report("c", 1.0, now=1)
+    assert not policy.should_report("d", 1.0, now=1.5)
+
+
+def test_heartbeats_bypass_the_rate_limit():
+    policy = make_policy(rate_limit=1, burst=1, max_interval=60)
+    policy.should_report("a", 1.0, now=0)
+    policy.tokens = 0
+
+    assert policy.should_report("a", 1.0, now=60)
+
+
+def test_row_settings_override_the_defaults():
+    policy = make_policy(abs_deadband=5, max_interval=60)
+    policy.configure("t", {"report_deadband": "0.1", "report_max_interval": None})
+
+    assert policy.settings["t"].abs_deadband == 0.1
+    assert policy.settings["t"].max_interval == 60
+    policy.should_report("t", 20.0, now=0)
+    assert policy.should_report("t", 20.2, now=1)
+
+
+def test_forgotten_key_is_reported_again():
+    policy = make_policy(abs_deadband=1)
+    policy.should_report("t", 20.0, now=0)
+    policy.forget("t")
+
+    assert policy.should_report("t", 20.0, now=1)
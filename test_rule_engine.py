@@ -0,0 +1,100 @@
+import pytest
+
+from gpio_backend import SimulatedGPIOBackend
+from gpio_manager import GPIOManager
+from rule_engine import RuleEngine, compile_rule
+
+
+def rule(**fields):
+    return {
+        "id": "r", "sensor_device_id": "t", "operator": ">", "threshold": 24, "hysteresis": 0.5,
+        "target_device_id": "fan", "target_state": True, **fields,
+    }
+
+
+def make_engine(rows):
+    gpio = GPIOManager(SimulatedGPIOBackend())
+    gpio.register_device("fan", 17, "switch", False)
+    actions = []
+    engine = RuleEngine(gpio, lambda *action: actions.append(action))
+    engine.load(rows)
+    return engine, gpio, actions
+
+
+@pytest.mark.parametrize("operator, value, triggered", [
+    (">", 24.0, False), (">", 24.01, True),
+    (">=", 23.99, False), (">=", 24.0, True),
+    ("<", 24.0, False), ("<", 23.99, True),
+    ("<=", 24.01, False), ("<=", 24.0, True),
+])
+def test_threshold_edges(operator, value, triggered):
+    evaluate = compile_rule(rule(operator=operator)).evaluate
+
+    assert evaluate(value) is (True if triggered else False)
+
+
+def test_hysteresis_band_keeps_the_state():
+    evaluate = compile_rule(rule()).evaluate
+
+    assert evaluate(25) is True
+    # Back under the threshold but within 0.5 of it: no change
+    assert evaluate(24) is None
+    assert evaluate(23.5) is None
+    assert evaluate(23.49) is False
+    # Above the release point but not past the threshold
+    assert evaluate(23.8) is None
+    assert evaluate(24.1) is True
+
+
+def test_hysteresis_below_the_threshold():
+    evaluate = compile_rule(rule(operator="<", threshold=5, hysteresis=1, target_state=False)).evaluate
+
+    assert evaluate(4) is False
+    assert evaluate(5.5) is None
+    assert evaluate(6.01) is True
+
+
+def test_repeated_readings_report_only_changes():
+    evaluate = compile_rule(rule()).evaluate
+
+    assert evaluate(20) is False
+    assert evaluate(20) is None
+    assert evaluate(30) is True
+    assert evaluate(31) is None
+
+
+@pytest.mark.parametrize("fields", [{"operator": "=="}, {"threshold": "warm"}, {"threshold": None}])
+def test_invalid_rows_are_rejected(fields):
+    with pytest.raises((KeyError, TypeError, ValueError)):
+        compile_rule(rule(**fields))
+
+
+def test_readings_switch_the_target():
+    engine, gpio, actions = make_engine([rule()])
+
+    engine.evaluate({"t": 25})
+    engine.evaluate({"t": 24})
+    engine.evaluate({"t": 23})
+
+    assert actions == [("fan", True, "r", 25), ("fan", False, "r", 23)]
+    assert gpio.devices["fan"].state is False
+
+
+def test_reloading_an_unchanged_rule_keeps_its_latch():
+    engine, _, actions = make_engine([rule()])
+    engine.evaluate({"t": 25})
+    version = engine.version
+
+    engine.load([rule()])
+    engine.evaluate({"t": 24})
+
+    assert engine.version == version
+    assert actions == [("fan", True, "r", 25)]
+
+
+def test_disabled_and_invalid_rules_are_skipped():
+    engine, _, _ = make_engine([rule(), rule(id="off", is_enabled=False), rule(id="bad", operator="~")])
+
+    assert list(engine.rules) == ["r"]
+    assert engine.rows() == [{"id": "r", "sensor_device_id": "t", "operator": ">", "threshold": 24, "hysteresis": 0.5,
+                              "target_device_id": "fan", "target_state": True}]
@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from sensor_sampler import DS18B20Sampler
+
+W1_SLAVE = "72 01 4b 46 7f ff 0e 10 57 : crc=57 {crc}\n72 01 4b 46 7f ff 0e 10 57 t={value}\n"
+
+
+def add_probe(root, sensor_id, value=23125, crc="YES", temperature_file=False):
+    """Create the sysfs directory of a probe, with the legacy w1_slave file or the newer temperature file"""
+    directory = root / sensor_id
+    directory.mkdir()
+    if temperature_file:
+        (directory / "temperature").write_text(f"{value}\n")
+    else:
+        (directory / "w1_slave").write_text(W1_SLAVE.format(crc=crc, value=value))
+    return directory
+
+
+def device(device_id, sensor_id):
+    return {"id": device_id, "sensor_id": sensor_id}
+
+
+@pytest.fixture
+def bus(tmp_path):
+    root = tmp_path / "w1"
+    root.mkdir()
+    (root / "w1_bus_master1").mkdir()
+    return root
+
+
+def make_sampler(bus, **kwargs):
+    return DS18B20Sampler(devices_path=str(bus), max_workers=4, **kwargs)
+
+
+def test_reads_both_file_formats(bus):
+    add_probe(bus, "28-000000000001", 23125)
+    add_probe(bus, "28-000000000002", -1250, temperature_file=True)
+    sampler = make_sampler(bus)
+
+    readings = sampler.sample([device("a", "28-000000000001"), device("b", "28-000000000002")])
+
+    assert readings == {"a": 23.125, "b": -1.25}
+    sampler.close()
+
+
+def test_crc_failure_is_not_a_reading(bus):
+    add_probe(bus, "28-000000000001", crc="NO")
+    sampler = make_sampler(bus)
+
+    assert sampler.sample([device("a", "28-000000000001")]) == {}
+    assert sampler.get_stats()["28-000000000001"]["errors"] == 1
+    sampler.close()
+
+
+@pytest.mark.parametrize("temperature_file", [False, True])
+def test_power_on_reset_value_is_not_a_reading(bus, temperature_file):
+    add_probe(bus, "28-000000000001", 85000, temperature_file=temperature_file)
+    sampler = make_sampler(bus)
+
+    assert sampler.sample([device("a", "28-000000000001")]) == {}
+    assert sampler.get_stats()["28-000000000001"]["last_temperature"] is None
+    sampler.close()
+
+
+def test_temperatures_near_the_reset_value_are_readings(bus):
+    add_probe(bus, "28-000000000001", 84937)
+    sampler = make_sampler(bus)
+
+    assert sampler.sample([device("a", "28-000000000001")]) == {"a": 84.937}
+    sampler.close()
+
+
+def test_slow_probe_times_out_without_holding_up_the_others(bus):
+    add_probe(bus, "28-000000000001")
+    add_probe(bus, "28-000000000002", 19500)
+    sampler = make_sampler(bus, read_timeout=0.2)
+    released = threading.Event()
+    sampler.sensors["28-000000000001"].read = lambda: released.wait(5)
+
+    try:
+        readings = sampler.sample([device("a", "28-000000000001"), device("b", "28-000000000002")])
+    finally:
+        released.set()
+
+    assert readings == {"b": 19.5}
+    assert sampler.get_stats()["28-000000000001"]["timeouts"] == 1
+    sampler.close()
+
+
+def test_hot_plugged_probe_is_discovered(bus):
+    sampler = make_sampler(bus)
+    add_probe(bus, "28-000000000001")
+
+    assert sampler.sample([device("a", "28-000000000001")]) == {"a": 23.125}
+    sampler.close()
+
+
+def test_single_probe_needs_no_sensor_id(bus):
+    add_probe(bus, "28-000000000001")
+    sampler = make_sampler(bus)
+
+    assert sampler.sample([{"id": "a"}]) == {"a": 23.125}
+    sampler.close()
+
+
+def test_ambiguous_probe_without_sensor_id_is_skipped(bus):
+    add_probe(bus, "28-000000000001")
+    add_probe(bus, "28-000000000002")
+    sampler = make_sampler(bus)
+
+    assert sampler.sample([{"id": "a"}]) == {}
+    sampler.close()
+
+
+def test_bulk_conversion_is_triggered_once_per_sweep(bus, monkeypatch):
+    monkeypatch.setattr(DS18B20Sampler, "CONVERSION_TIME", 0)
+    (bus / "w1_bus_master1" / "therm_bulk_read").write_text("")
+    add_probe(bus, "28-000000000001")
+    sampler = make_sampler(bus)
+
+    assert sampler.sample([device("a", "28-000000000001")]) == {"a": 23.125}
+    assert (bus / "w1_bus_master1" / "therm_bulk_read").read_text() == "trigger\n"
+    sampler.close()
@@ -0,0 +1,123 @@
+import pytest
+
+from benchmarks.fake_postgrest import FakePostgREST
+from postgrest_client import PostgrestClient, PostgrestError
+from supabase_client import SupabaseManager
+from timeseries_store import TimeSeriesStore
+
+
+@pytest.fixture
+def fake():
+    fake = FakePostgREST().start()
+    fake.seed("devices", [
+        {"id": "sensor", "value": 20.0, "unit": "°C", "is_active": None},
+        {"id": "switch", "value": None, "unit": None, "is_active": False},
+        {"id": "button", "value": None, "unit": None, "is_active": False},
+    ])
+    fake.seed("control_units", [{"id": "test-unit"}])
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def supabase(fake):
+    supabase = SupabaseManager()
+    supabase.db.close()
+    supabase.db = PostgrestClient(fake.url, "test.test.test")
+    yield supabase
+    supabase.db.close()
+    supabase.outbox.close()
+
+
+def test_bulk_upsert_with_mixed_keys_is_rejected(fake):
+    client = PostgrestClient(fake.url, "test.test.test")
+
+    with pytest.raises(PostgrestError) as error:
+        client.upsert("devices", [{"id": "sensor", "value": 1}, {"id": "switch", "is_active": True}], on_conflict="id")
+    assert error.value.status == 400
+    assert not error.value.retryable
+    client.close()
+
+
+def test_sensor_values_and_states_flush_together(fake, supabase):
+    telemetry = supabase.telemetry
+    telemetry.put("sensor", {"value": 21.5, "unit": "°C", "last_updated": "2026-01-01T00:00:00+00:00"})
+    supabase.report_device_state("switch", True)
+
+    assert telemetry.flush()
+    assert len(supabase.outbox) == 0
+    assert fake.tables["devices"]["sensor"]["value"] == 21.5
+    assert fake.tables["devices"]["switch"]["is_active"] is True
+    assert fake.requests["PATCH devices"] == 2
+    assert fake.requests["POST devices"] == 0
+
+
+def test_devices_with_the_same_values_share_a_request(fake, supabase):
+    supabase.telemetry.put("switch", {"is_active": False, "last_updated": "2026-01-01T00:00:00+00:00"})
+    supabase.telemetry.put("button", {"is_active": False, "last_updated": "2026-01-01T00:00:00+00:00"})
+
+    assert supabase.telemetry.flush()
+    assert fake.requests["PATCH devices"] == 1
+
+
+def test_deleted_device_is_not_recreated(fake, supabase):
+    del fake.tables["devices"]["sensor"]
+    supabase.telemetry.put("sensor", {"value": 21.0, "unit": "°C", "last_updated": "2026-01-01T00:00:00+00:00"})
+
+    assert supabase.telemetry.flush()
+    assert "sensor" not in fake.tables["devices"]
+
+
+def test_bulk_upsert_groups_rows_by_columns(fake, supabase, monkeypatch):
+    monkeypatch.setattr("supabase_client.TELEMETRY_BULK_UPSERT", True)
+    supabase.telemetry.put("sensor", {"value": 21.5, "unit": "°C", "last_updated": "2026-01-01T00:00:00+00:00"})
+    supabase.report_device_state("switch", True)
+
+    assert supabase.telemetry.flush()
+    assert fake.tables["devices"]["switch"]["is_active"] is True
+    assert fake.requests["POST devices"] == 2
+
+
+def test_input_changes_flush_with_sensor_values(fake, supabase):
+    supabase.telemetry.put("sensor", {"value": 22.0, "unit": "°C", "last_updated": "2026-01-01T00:00:00+00:00"})
+    supabase.report_inputs({"button": (True, 0.0, 3)})
+
+    assert supabase.telemetry.flush()
+    assert fake.tables["devices"]["button"]["is_active"] is True
+    assert fake.tables["devices"]["sensor"]["value"] == 22.0
+    assert len(supabase.outbox) == 0
+
+
+def test_local_api_change_with_a_value_flushes(fake, supabase):
+    """report_local_change sends a state and a value, next to a state-only rule action and a sensor value"""
+    supabase.telemetry.put("sensor", {"value": 19.0, "unit": "°C", "last_updated": "2026-01-01T00:00:00+00:00"})
+    supabase.report_device_state("switch", True, 50)
+    supabase.report_device_state("button", False)
+
+    assert supabase.telemetry.flush()
+    assert fake.tables["devices"]["switch"]["value"] == 50
+    assert fake.tables["devices"]["button"]["is_active"] is False
+    assert len(supabase.outbox) == 0
+
+
+def test_telemetry_queued_before_connecting_is_delivered_on_shutdown(fake, supabase):
+    supabase.report_device_state("switch", True)
+
+    supabase.disconnect()
+
+    assert fake.tables["devices"]["switch"]["is_active"] is True
+    assert "is_online" not in fake.tables["control_units"]["test-unit"]
+
+
+def test_history_is_uploaded_under_the_owning_unit(fake, supabase, tmp_path, monkeypatch):
+    monkeypatch.setattr("supabase_client.TIMESERIES_TABLE", "device_history")
+    store = TimeSeriesStore(str(tmp_path / "timeseries"))
+    store.set_owners({"sensor": "unit-greenhouse"})
+    store.append("sensor", 21.0, timestamp=30)
+    store.append("system.cpu_usage", 5.0, timestamp=30)
+
+    assert store.upload(supabase.upload_history, bucket=60, now=120) == 2
+    store.close()
+
+    owners = {row["series"]: row["controller_id"] for row in fake.tables["device_history"].values()}
+    assert owners == {"sensor": "unit-greenhouse", "system.cpu_usage": "test-unit"}
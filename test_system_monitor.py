@@ -0,0 +1,83 @@
+from collections import namedtuple
+
+import pytest
+
+import system_monitor
+from system_monitor import RingBuffer, SystemMonitor
+
+NetCounters = namedtuple("NetCounters", "bytes_sent bytes_recv")
+
+
+def test_empty_buffer():
+    buffer = RingBuffer(3)
+
+    assert buffer.last() is None
+    assert buffer.rollup() is None
+
+
+def test_wrap_around_keeps_the_latest_samples():
+    buffer = RingBuffer(3)
+    for value in (1, 2, 3, 4, 5):
+        buffer.append(value)
+
+    assert buffer.count == 3
+    assert buffer.last() == 5
+    assert buffer.rollup() == {"min": 3, "max": 5, "mean": 4, "p95": 5}
+
+
+def test_last_right_after_wrapping():
+    buffer = RingBuffer(2)
+    buffer.append(1)
+    buffer.append(2)
+
+    assert buffer.index == 0
+    assert buffer.last() == 2
+
+
+def test_single_slot_buffer():
+    buffer = RingBuffer(1)
+    buffer.append(7)
+    buffer.append(8)
+
+    assert buffer.rollup() == {"min": 8, "max": 8, "mean": 8, "p95": 8}
+
+
+@pytest.mark.parametrize("count, p95", [(1, 0), (19, 18), (20, 19), (100, 95)])
+def test_p95_index(count, p95):
+    buffer = RingBuffer(100)
+    for value in range(count):
+        buffer.append(value)
+
+    assert buffer.rollup()["p95"] == p95
+
+
+def test_rollup_rounds_to_two_decimals():
+    buffer = RingBuffer(3)
+    for value in (1.111, 2.222, 3.339):
+        buffer.append(value)
+
+    assert buffer.rollup() == {"min": 1.11, "max": 3.34, "mean": 2.22, "p95": 3.34}
+
+
+def test_network_rates_use_the_elapsed_time(clock, monkeypatch):
+    counters = [NetCounters(0, 0)]
+    monkeypatch.setattr(system_monitor.psutil, "net_io_counters", lambda: counters[-1])
+    monitor = SystemMonitor(interval=1, window=10)
+    monitor.buffers.pop("soc_temperature", None)
+
+    clock.advance(2)
+    counters.append(NetCounters(2000, 500))
+    monitor.sample()
+
+    assert monitor.buffers["net_sent_bps"].last() == 1000
+    assert monitor.buffers["net_recv_bps"].last() == 250
+
+
+def test_window_mean_falls_back_to_a_direct_reading(monkeypatch):
+    monitor = SystemMonitor(interval=1, window=10)
+    monkeypatch.setattr(system_monitor.psutil, "virtual_memory", lambda: namedtuple("Memory", "percent")(42.9))
+
+    assert monitor.get_memory_usage() == 42
+    monitor.buffers["memory"].append(10)
+    monitor.buffers["memory"].append(21)
+    assert monitor.get_memory_usage() == 15
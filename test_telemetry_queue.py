@@ -0,0 +1,70 @@
+import pytest
+
+from telemetry_queue import TelemetryQueue
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    def __call__(self, rows, control_unit):
+        if self.error:
+            raise self.error
+        self.calls.append((rows, control_unit))
+
+
+def test_updates_of_a_device_are_coalesced():
+    flush = Recorder()
+    queue = TelemetryQueue(flush, flush_size=100)
+
+    queue.put("a", {"value": 1, "unit": "°C"})
+    queue.put("a", {"value": 2})
+    queue.put("b", {"value": 3})
+    assert queue.flush()
+
+    assert flush.calls == [([{"id": "a", "value": 2, "unit": "°C"}, {"id": "b", "value": 3}], None)]
+    assert queue.stats["coalesced"] == 1
+
+
+def test_control_unit_goes_with_the_device_rows():
+    flush = Recorder()
+    queue = TelemetryQueue(flush)
+
+    queue.put_control_unit({"cpu_usage": 1})
+    queue.put_control_unit({"cpu_usage": 2, "is_online": True})
+    queue.put("a", {"value": 1})
+    queue.flush()
+
+    assert flush.calls == [([{"id": "a", "value": 1}], {"cpu_usage": 2, "is_online": True})]
+
+
+def test_failed_flush_is_requeued_behind_newer_values():
+    flush = Recorder()
+    queue = TelemetryQueue(flush)
+    queue.put("a", {"value": 1, "unit": "°C"})
+    flush.error = ConnectionError("offline")
+
+    assert not queue.flush()
+    queue.put("a", {"value": 2})
+    flush.error = None
+    assert queue.flush()
+
+    assert flush.calls == [([{"id": "a", "value": 2, "unit": "°C"}], None)]
+
+
+def test_full_queue_rejects_after_the_timeout():
+    queue = TelemetryQueue(Recorder(), max_pending=1, put_timeout=0.01)
+
+    assert queue.put("a", {"value": 1})
+    assert not queue.put("b", {"value": 1})
+    assert queue.stats["rejected"] == 1
+
+
+@pytest.mark.parametrize("pending, due", [(1, False), (2, True)])
+def test_size_trigger(pending, due):
+    queue = TelemetryQueue(Recorder(), flush_interval=60, flush_size=2)
+    for index in range(pending):
+        queue.put(str(index), {"value": index})
+
+    assert (queue.seconds_until_flush() <= 0) is due
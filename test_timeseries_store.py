@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+from timeseries_store import TimeSeriesStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / "timeseries"), segment_points=4, retention=100)
+    yield store
+    store.close()
+
+
+def test_range_is_start_inclusive_and_end_exclusive(store):
+    for timestamp in range(10):
+        store.append("t", float(timestamp), timestamp)
+
+    assert store.range("t", 3, 6) == [(3, 3.0), (4, 4.0), (5, 5.0)]
+    assert len(store.range("t")) == 10
+    assert store.range("t", 10) == []
+
+
+def test_full_segments_roll_over(store):
+    for timestamp in range(9):
+        store.append("t", 1.0, timestamp)
+
+    assert [segment.count for segment in store.series["t"]] == [4, 4, 1]
+
+
+def test_timestamps_never_go_backwards(store):
+    store.append("t", 1.0, 10)
+    store.append("t", 2.0, 5)
+
+    assert store.range("t") == [(10, 1.0), (10, 2.0)]
+
+
+def test_none_values_are_skipped(store):
+    store.append_many({"a": 1.0, "b": None}, 1)
+
+    assert store.names() == ["a"]
+
+
+def test_aggregate_per_bucket_across_segments(store):
+    for timestamp, value in enumerate([1, 3, 5, 7, 2, 4, 6, 8]):
+        store.append("t", float(value), timestamp * 30)
+
+    assert store.aggregate("t") == {"count": 8, "min": 1, "max": 8, "mean": 4.5}
+    assert store.aggregate("t", bucket=60) == [
+        {"count": 2, "min": 1, "max": 3, "mean": 2, "start": 0},
+        {"count": 2, "min": 5, "max": 7, "mean": 6, "start": 60},
+        {"count": 2, "min": 2, "max": 4, "mean": 3, "start": 120},
+        {"count": 2, "min": 6, "max": 8, "mean": 7, "start": 180},
+    ]
+    assert store.aggregate("missing") is None
+
+
+def test_upload_sends_each_complete_bucket_once(store):
+    sent = []
+    for timestamp in (0, 30, 60, 90, 120):
+        store.append("t", 1.0, timestamp)
+
+    # The bucket starting at 120 is still open
+    assert store.upload(sent.extend, bucket=60, now=150) == 2
+    assert [row["bucket_start"] for row in sent] == [0, 60]
+    assert store.upload(sent.extend, bucket=60, now=150) == 0
+    assert store.upload(sent.extend, bucket=60, now=180) == 1
+    assert sent[-1]["bucket_start"] == 120
+
+
+def test_upload_respects_the_limit(store):
+    sent = []
+    for timestamp in range(0, 300, 60):
+        store.append("t", 1.0, timestamp)
+
+    assert store.upload(sent.extend, bucket=60, limit=2, now=300) == 2
+    assert store.upload(sent.extend, bucket=60, limit=2, now=300) == 2
+    assert [row["bucket_start"] for row in sent] == [0, 60, 120, 180]
+
+
+def test_failed_upload_is_retried(store):
+    store.append("t", 1.0, 0)
+
+    def fail(rows):
+        raise ConnectionError("offline")
+
+    assert store.upload(fail, bucket=60, now=60) is None
+    assert store.stats["failed_uploads"] == 1
+    sent = []
+    assert store.upload(sent.extend, bucket=60, now=60) == 1
+
+
+def test_segments_past_the_retention_are_dropped(store):
+    for timestamp in range(8):
+        store.append("t", 1.0, timestamp * 10)
+
+    # The first segment ends at 30, the second at 70
+    store.maintain(now=130.01)
+    assert [segment.first_time for segment in store.series["t"]] == [40]
+    store.maintain(now=170.01)
+    assert "t" not in store.series
+    assert not os.path.exists(store._series_path("t"))
+
+
+def test_history_survives_a_reopen(tmp_path):
+    path = str(tmp_path / "timeseries")
+    store = TimeSeriesStore(path, segment_points=4)
+    for timestamp in range(6):
+        store.append("system.cpu", float(timestamp), timestamp * 30)
+    store.set_owners({"system.cpu": "unit-a"})
+    store.upload(lambda rows: None, bucket=60, now=120)
+    store.close()
+
+    store = TimeSeriesStore(path, segment_points=4)
+    assert len(store.range("system.cpu")) == 6
+    assert store.uploaded == {"system.cpu": 60}
+    assert store.owners == {"system.cpu": "unit-a"}
+    store.close()
+
+
+def test_corrupt_segment_is_skipped(tmp_path):
+    path = str(tmp_path / "timeseries")
+    store = TimeSeriesStore(path, segment_points=4)
+    store.append("t", 1.0, 1)
+    segment_path = store.series["t"][0].path
+    store.close()
+
+    with open(segment_path, "r+b") as f:
+        f.write(b"XXXX")
+
+    store = TimeSeriesStore(path, segment_points=4)
+    assert store.names() == []
+    store.close()
@@ -0,0 +1,348 @@
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import quote, unquote
+
+from config import (
+    logger, TIMESERIES_PATH, TIMESERIES_SEGMENT_POINTS, TIMESERIES_RETENTION, TIMESERIES_ROLLUP_INTERVAL,
+    TIMESERIES_UPLOAD_BATCH
+)
+
+# Magic, capacity and number of points, padded so the columns start 8-byte aligned
+HEADER = struct.Struct("<4sII4x")
+MAGIC = b"TSS1"
+
+
+class Segment:
+    """Fixed-capacity, memory-mapped file of one series: a column of timestamps followed by a column of values"""
+
+    __slots__ = ("path", "file", "map", "times", "values", "capacity", "count")
+
+    def __init__(self, path, capacity=None):
+        """Open a segment, created with `capacity` points when it doesn't exist"""
+        self.path = path
+        if capacity is not None and not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, capacity, 0))
+                f.truncate(HEADER.size + 16 * capacity)
+
+        self.file = open(path, "r+b")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0)
+            magic, self.capacity, self.count = HEADER.unpack_from(self.map)
+            if magic != MAGIC or len(self.map) != HEADER.size + 16 * self.capacity or self.count > self.capacity:
+                raise ValueError("not a valid segment file")
+        except Exception:
+            if getattr(self, "map", None) is not None:
+                self.map.close()
+            self.file.close()
+            raise
+
+        view = memoryview(self.map)
+        columns = HEADER.size + 8 * self.capacity
+        self.times = view[HEADER.size:columns].cast("d")
+        self.values = view[columns:].cast("d")
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def first_time(self):
+        return self.times[0] if self.count else None
+
+    @property
+    def last_time(self):
+        return self.times[self.count - 1] if self.count else None
+
+    def append(self, timestamp, value):
+        index = self.count
+        self.times[index] = timestamp
+        self.values[index] = value
+        self.count = index + 1
+        # The count is written last, a crashed process never leaves a counted point half written
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.count)
+
+    def slice(self, start, end):
+        """Get the index range of the points with start <= timestamp < end"""
+        low = 0 if start is None else bisect_left(self.times, start, 0, self.count)
+        high = self.count if end is None else bisect_left(self.times, end, low, self.count)
+        return low, high
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.times.release()
+        self.values.release()
+        self.map.close()
+        self.file.close()
+
+
+class TimeSeriesStore:
+    """Append-only local history of sensor readings and system metrics.
+
+    Every series is a directory of memory-mapped segments holding a fixed number of
+    points as two float64 columns (timestamps, values). Appending writes into the
+    mapped pages, the kernel writes them back; full segments are never touched again
+    and dropped as a whole once older than the retention. Timestamps are Unix seconds,
+    kept non-decreasing per series so ranges are found by binary search.
+    """
+
+    UPLOADED_FILE = "uploaded.json"
+    OWNERS_FILE = "owners.json"
+
+    def __init__(self, path=TIMESERIES_PATH, segment_points=TIMESERIES_SEGMENT_POINTS, retention=TIMESERIES_RETENTION):
+        """Initialize the store
+
+        Args:
+            path: Directory of the series, created when missing
+            segment_points: Points per segment file (16 bytes each)
+            retention: Seconds of history kept
+        """
+        self.path = path
+        self.segment_points = segment_points
+        self.retention = retention
+        self.lock = threading.Lock()
+
+        # Key: series name, Value: list of Segment, oldest first
+        self.series = {}
+        # Key: series name, Value: start of the newest bucket uploaded
+        self.uploaded = {}
+        # Key: series name, Value: control unit owning the device (gateway mode), uploaded with its rollups
+        self.owners = {}
+
+        self.stats = {"appended": 0, "segments_dropped": 0, "uploads": 0, "rows_uploaded": 0, "failed_uploads": 0}
+
+        os.makedirs(path, exist_ok=True)
+        self._open()
+        logger.info(f"Time-series store at {path}: {len(self.series)} series")
+
+    def append(self, name, value, timestamp=None):
+        """Append a point to a series, created on first use"""
+        self.append_many({name: value}, timestamp)
+
+    def append_many(self, points, timestamp=None):
+        """Append one point per series (name -> value), all with the same timestamp"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for name, value in points.items():
+                if value is None:
+                    continue
+                segments = self.series.get(name)
+                if not segments or segments[-1].full:
+                    segments = self._add_segment(name, timestamp)
+
+                segment = segments[-1]
+                last_time = segment.last_time
+                segment.append(timestamp if last_time is None or timestamp > last_time else last_time, value)
+                self.stats["appended"] += 1
+
+    def set_owners(self, owners):
+        """Record the control unit owning each series (name -> unit id), kept across restarts"""
+        with self.lock:
+            changed = {name: owner for name, owner in owners.items() if self.owners.get(name) != owner}
+            if not changed:
+                return
+            self.owners.update(changed)
+            owners = dict(self.owners)
+        self._save(self.OWNERS_FILE, owners)
+
+    def names(self):
+        """Get the names of all series"""
+        with self.lock:
+            return list(self.series)
+
+    def range(self, name, start=None, end=None):
+        """Get the (timestamp, value) points of a series with start <= timestamp < end"""
+        points = []
+        with self.lock:
+            for segment, low, high in self._slices(name, start, end):
+                points.extend(zip(segment.times[low:high].tolist(), segment.values[low:high].tolist()))
+        return points
+
+    def aggregate(self, name, start=None, end=None, bucket=None):
+        """Get count, min, max and mean of a series between start and end
+
+        With `bucket` seconds, a list of aggregates of the non-empty buckets (with their start) is returned
+        instead, None or an empty list when there are no points.
+        """
+        buckets = {}
+        with self.lock:
+            for segment, low, high in self._slices(name, start, end):
+                times = segment.times[low:high].tolist() if bucket else None
+                values = segment.values[low:high].tolist()
+                if not bucket:
+                    _merge(buckets, None, values)
+                    continue
+
+                # Consecutive points of the same bucket are aggregated together
+                index = 0
+                while index < len(values):
+                    bucket_start = math.floor(times[index] / bucket) * bucket
+                    stop = max(index + 1, bisect_left(times, bucket_start + bucket, index))
+                    _merge(buckets, bucket_start, values[index:stop])
+                    index = stop
+
+        if not bucket:
+            return _finish(buckets[None]) if buckets else None
+        return [dict(_finish(item), start=bucket_start) for bucket_start, item in buckets.items()]
+
+    def upload(self, send_fn, bucket=TIMESERIES_ROLLUP_INTERVAL, limit=TIMESERIES_UPLOAD_BATCH, now=None):
+        """Send the rollups of the complete buckets not uploaded yet
+
+        Args:
+            send_fn: Callable(rows) sending the rollup rows in bulk, raises on failure
+            bucket: Seconds per rollup
+            limit: Maximum rows per call, the rest follows with the next call
+            now: Current Unix time, the bucket containing it is not complete yet
+
+        Returns the number of rows sent, None when sending failed.
+        """
+        now = time.time() if now is None else now
+        complete_before = math.floor(now / bucket) * bucket
+
+        rows = []
+        watermarks = {}
+        for name in self.names():
+            if len(rows) >= limit:
+                break
+            uploaded = self.uploaded.get(name)
+            start = None if uploaded is None else uploaded + bucket
+            owner = self.owners.get(name)
+            for item in self.aggregate(name, start, complete_before, bucket)[:limit - len(rows)]:
+                rows.append({"series": name, "owner": owner, "bucket_start": item["start"], "bucket_seconds": bucket,
+                             "count": item["count"], "min": item["min"], "max": item["max"],
+                             "mean": item["mean"]})
+                watermarks[name] = item["start"]
+
+        if not rows:
+            return 0
+
+        try:
+            send_fn(rows)
+        except Exception as e:
+            self.stats["failed_uploads"] += 1
+            logger.error(f"Failed to upload {len(rows)} time-series rollups: {e}")
+            return None
+
+        self.uploaded.update(watermarks)
+        self._save(self.UPLOADED_FILE, self.uploaded)
+        self.stats["uploads"] += 1
+        self.stats["rows_uploaded"] += len(rows)
+        logger.debug(f"Uploaded {len(rows)} time-series rollups of {len(watermarks)} series")
+        return len(rows)
+
+    def maintain(self, now=None):
+        """Drop the segments older than the retention and write the mapped pages back"""
+        cutoff = (time.time() if now is None else now) - self.retention
+        with self.lock:
+            for name, segments in list(self.series.items()):
+                while segments and segments[0].last_time is not None and segments[0].last_time < cutoff:
+                    segment = segments.pop(0)
+                    segment.close()
+                    os.remove(segment.path)
+                    self.stats["segments_dropped"] += 1
+                if not segments:
+                    del self.series[name]
+                    self.uploaded.pop(name, None)
+                    try:
+                        os.rmdir(self._series_path(name))
+                    except OSError:
+                        pass
+                else:
+                    segments[-1].flush()
+
+    def close(self):
+        """Write back and unmap every segment"""
+        with self.lock:
+            for segments in self.series.values():
+                for segment in segments:
+                    segment.flush()
+                    segment.close()
+            self.series = {}
+
+    def _open(self):
+        """Map the segments left by a previous run"""
+        for entry in sorted(os.listdir(self.path)):
+            directory = os.path.join(self.path, entry)
+            if not os.path.isdir(directory):
+                continue
+
+            segments = []
+            for file_name in sorted(os.listdir(directory)):
+                if not file_name.endswith(".seg"):
+                    continue
+                try:
+                    segments.append(Segment(os.path.join(directory, file_name)))
+                except (OSError, ValueError) as e:
+                    logger.error(f"Skipping time-series segment {file_name} of {entry}: {e}")
+            if segments:
+                self.series[unquote(entry)] = segments
+
+        self.uploaded = {name: start for name, start in self._load(self.UPLOADED_FILE).items() if name in self.series}
+        self.owners = self._load(self.OWNERS_FILE)
+
+    def _add_segment(self, name, timestamp):
+        directory = self._series_path(name)
+        os.makedirs(directory, exist_ok=True)
+        segment = Segment(os.path.join(directory, f"{int(timestamp * 1000):015d}.seg"), self.segment_points)
+        segments = self.series.setdefault(name, [])
+        segments.append(segment)
+        return segments
+
+    def _slices(self, name, start, end):
+        """Yield (segment, low, high) of the segments of a series overlapping start <= timestamp < end"""
+        for segment in self.series.get(name, ()):
+            if not segment.count:
+                continue
+            if start is not None and segment.last_time < start:
+                continue
+            if end is not None and segment.first_time >= end:
+                break
+            low, high = segment.slice(start, end)
+            if low < high:
+                yield segment, low, high
+
+    def _series_path(self, name):
+        return os.path.join(self.path, quote(name, safe=""))
+
+    def _load(self, file_name):
+        try:
+            with open(os.path.join(self.path, file_name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load time-series state {file_name}: {e}")
+        return {}
+
+    def _save(self, file_name, data):
+        path = os.path.join(self.path, file_name)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+
+
+def _merge(buckets, key, values):
+    """Fold values into the [count, min, max, sum] of a bucket"""
+    if not values:
+        return
+    item = buckets.get(key)
+    if item is None:
+        buckets[key] = [len(values), min(values), max(values), math.fsum(values)]
+    else:
+        item[0] += len(values)
+        item[1] = min(item[1], min(values))
+        item[2] = max(item[2], max(values))
+        item[3] += math.fsum(values)
+
+
+def _finish(item):
+    count, minimum, maximum, total = item
+    return {"count": count, "min": minimum, "max": maximum, "mean": total / count}